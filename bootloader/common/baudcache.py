@@ -0,0 +1,173 @@
+'''
+Baud rate negotiation for the bootloaders, with a per-device cache.
+
+Some serial links (cheap USB hubs, long cables) do not work at the highest
+rate a bootloader supports. :func:`negotiate` runs a bootloading attempt at
+the fastest rate first, and at slower ones while the attempt fails with a
+link error. The rate which worked is stored in a small JSON file, keyed by
+the USB serial number and location of the serial adapter when pyserial can
+tell them (by the port name otherwise), so the next attempt on the same
+device starts at that rate rather than failing again at the faster ones.
+
+Delete the cache file to probe the faster rates again, e.g. after changing
+hubs.
+'''
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:
+    # Windows, concurrent processes may lose each other's updates
+    fcntl = None
+
+#============================ defines =========================================
+
+DEFAULT_PATH               = os.path.join(os.path.expanduser('~'),'.openwsn','bootload_baud.json')
+
+_fileLock                  = threading.Lock()
+
+#============================ classes =========================================
+
+class BaudCache(object):
+    '''
+    The highest rate known to work for each device, stored in ``path``.
+    '''
+
+    def __init__(self,path=DEFAULT_PATH):
+        self.path              = path
+
+    #======================== public ==========================================
+
+    def get(self,key):
+        with _fileLock:
+            return self._read().get(key)
+
+    def set(self,key,baud):
+        with _fileLock, self._processLock():
+            # read again, other processes may have written other devices
+            rates      = self._read()
+            if rates.get(key)==baud:
+                return
+            rates[key] = baud
+            self._write(rates)
+
+    def candidates(self,key,rates):
+        '''
+        :returns: ``rates``, fastest first, from the rate cached for ``key``
+            if any.
+        '''
+        rates  = sorted(set(rates),reverse=True)
+        cached = self.get(key)
+        if cached in rates:
+            rates = rates[rates.index(cached):]
+        return rates
+
+    #======================== private =========================================
+
+    @contextlib.contextmanager
+    def _processLock(self):
+        # serialize the updates of the bootloader processes flashing other
+        # devices at the same time
+        if fcntl is None:
+            yield
+            return
+        _makeDirs(os.path.dirname(self.path))
+        with open(self.path+'.lock','a') as f:
+            fcntl.flock(f.fileno(),fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(),fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path,'r') as f:
+                return dict(json.load(f))
+        except (IOError,OSError,ValueError,TypeError):
+            # missing or corrupted, start over
+            return {}
+
+    def _write(self,rates):
+        dirname = os.path.dirname(self.path)
+        _makeDirs(dirname)
+        # several bootloader processes may write the cache at once, each
+        # writes under a name of its own first
+        (fd,tmp) = tempfile.mkstemp(dir=dirname or '.',prefix=os.path.basename(self.path)+'.')
+        try:
+            with os.fdopen(fd,'w') as f:
+                json.dump(rates,f,indent=4,sort_keys=True)
+            if os.name=='nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp,self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+#============================ functions =======================================
+
+def _makeDirs(dirname):
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+def deviceKey(port):
+    '''
+    :returns: the key identifying the device behind serial port ``port``:
+        the serial number and USB location of its adapter, if known.
+    '''
+    try:
+        from serial.tools import list_ports
+        ports = list(list_ports.comports())
+    except Exception:
+        # old or missing pyserial
+        return str(port)
+    for info in ports:
+        device = getattr(info,'device',None) or info[0]
+        if device!=port:
+            continue
+        serialNumber = getattr(info,'serial_number',None)
+        location     = getattr(info,'location',None)
+        if serialNumber and location:
+            return '{0}@{1}'.format(serialNumber,location)
+        if serialNumber:
+            return serialNumber
+    return str(port)
+
+def negotiate(port,rates,attempt,linkErrors,cache=None,log=None):
+    '''
+    Run ``attempt(baud)`` at the rates of ``rates``, fastest first, until it
+    does not raise one of ``linkErrors``.
+
+    :param cache: the :class:`BaudCache` to start from and update, a
+        default one if ``None``.
+    :param log: called with a message each time a rate fails.
+    :returns: the value returned by ``attempt``.
+    :raises: the error of the last attempt, if all rates failed.
+    '''
+    if cache is None:
+        cache = BaudCache()
+    key = deviceKey(port)
+    for baud in cache.candidates(key,rates):
+        try:
+            returnVal = attempt(baud)
+        except linkErrors as err:
+            lastError = err
+            if log:
+                log('failed at {0} baud ({1})'.format(baud,err))
+            continue
+        try:
+            cache.set(key,baud)
+        except (IOError,OSError) as err:
+            # the cache only saves time, the flashing succeeded
+            if log:
+                log('cannot cache {0} baud ({1})'.format(baud,err))
+        return returnVal
+    raise lastError
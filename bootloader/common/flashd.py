@@ -0,0 +1,650 @@
+'''
+Local flashing service for a rack of motes.
+
+Started once per host, the daemon keeps:
+
+- a registry of the attached motes, with their port, USB serial number and
+  location, and the board they were last flashed as (stored by USB serial
+  number, so it survives replugging);
+- a store of the firmware it was sent, named by the SHA-1 of its contents,
+  so a firmware is transferred and stored once however many jobs use it;
+- a queue of flashing jobs, submitted over a Unix socket, each job flashing
+  one firmware on a list of ports.
+
+The ports of all jobs are flashed first come, first served, by the existing
+bootloader scripts, with at most ``perHub`` ports at the same time behind
+each USB hub so the bus is not saturated, and never two jobs on the same
+port. Two developers flashing the same rack thus queue up rather than
+collide.
+
+The protocol is one JSON object per line: the client sends a request, e.g.
+``{"cmd": "flash", "board": "telosb", "ports": ["/dev/ttyUSB0"], "sha1":
+...}`` and reads the answer, which has ``"ok": false`` and an ``"error"`` if
+the request failed. :func:`submit` is the client side of a flashing job.
+
+Usage::
+
+    python bootloader/common/flashd.py serve
+    python bootloader/common/flashd.py devices
+    python bootloader/common/flashd.py flash telosb all build/.../03oos_openwsn_prog.ihex
+
+and ``scons ... bootload=all bootload_daemon=1`` to have SCons submit its
+bootloading to the daemon.
+'''
+
+import base64
+import getopt
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+import flashreport
+
+log = logging.getLogger('flashd')
+log.addHandler(logging.NullHandler())
+
+#============================ defines =========================================
+
+DEFAULT_DIR                = os.path.join(os.path.expanduser('~'),'.openwsn','flashd')
+DEFAULT_SOCKET             = os.path.join(DEFAULT_DIR,'flashd.sock')
+PER_HUB                    = 2
+NUM_WORKERS                = 8
+MAX_JOBS                   = 100          # finished jobs kept for the 'jobs' command
+PYTHON                     = 'python'     # the bootloaders are Python 2 scripts
+
+BOOTLOADER_DIR             = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the command flashing each board, run from BOOTLOADER_DIR
+COMMANDS = {
+    'telosb':              [
+        os.path.join('telosb','bsl'),
+        '--telosb','--speed=auto','-c','{port}','-r','-e','-I','-p','--report={report}','{firmware}',
+    ],
+    'openmote-cc2538':     [
+        os.path.join('openmote-cc2538','cc2538-bsl.py'),
+        '-e','-w','-b','auto','--bootloader-invert-lines','-p','{port}','--report={report}','{firmware}',
+    ],
+    'openmotestm':         [
+        os.path.join('openmotestm','bin.py'),
+        '-p','{port}','--report={report}','{firmware}',
+    ],
+    'iot-lab_M3':          [
+        os.path.join('iot-lab_M3','iotlab-m3-bsl.py'),
+        '-i','{firmware}','-p','{port}',
+    ],
+}
+
+LOG_LINES                  = 20           # lines of bootloader output kept in a failed report
+
+_digestRe                  = re.compile(r'^[0-9a-f]{40}$')
+_extRe                     = re.compile(r'^(\.[A-Za-z0-9]+)?$')
+
+#============================ classes =========================================
+
+class FlashdError(Exception):
+    pass
+
+class Registry(object):
+    '''
+    The motes attached to this host, and the board of each.
+
+    :param path: the JSON file the boards are stored in.
+    '''
+
+    def __init__(self,path):
+
+        # store params
+        self.path              = path
+
+        # local variables
+        self.lock              = threading.Lock()
+        self.boards            = self._read()
+
+    #======================== public ==========================================
+
+    def scan(self):
+        '''
+        :returns: a dict per attached mote, with its ``port``, ``serial``
+            number, ``location`` and ``hub``, and ``board`` if known.
+        '''
+        returnVal = []
+        for (port,serialNumber,location) in listPorts():
+            returnVal += [self._device(port,serialNumber,location)]
+        return returnVal
+
+    def device(self,port):
+        '''
+        :returns: the dict describing ``port``, see :meth:`scan`, also if
+            pyserial cannot list it.
+        '''
+        for device in self.scan():
+            if device['port']==port:
+                return device
+        return self._device(port,None,None)
+
+    def register(self,device,board):
+        key = device['serial'] or device['port']
+        with self.lock:
+            if self.boards.get(key)==board:
+                return
+            self.boards[key] = board
+            self._write()
+        device['board']  = board
+
+    #======================== private =========================================
+
+    def _device(self,port,serialNumber,location):
+        with self.lock:
+            board = self.boards.get(serialNumber or port)
+        return {
+            'port':     port,
+            'serial':   serialNumber,
+            'location': location,
+            'hub':      hubOf(port,location),
+            'board':    board,
+        }
+
+    def _read(self):
+        try:
+            with open(self.path,'r') as f:
+                return dict(json.load(f))
+        except (IOError,OSError,ValueError,TypeError):
+            return {}
+
+    def _write(self):
+        _writeJson(self.path,self.boards)
+
+class FirmwareStore(object):
+    '''
+    The firmware images the daemon was sent, named by the SHA-1 of their
+    contents.
+    '''
+
+    def __init__(self,path):
+        self.path              = path
+
+    def filename(self,digest,ext):
+        if not _digestRe.match(digest) or not _extRe.match(ext):
+            raise FlashdError('invalid firmware {0}{1}'.format(digest,ext))
+        return os.path.join(self.path,digest+ext)
+
+    def has(self,digest,ext):
+        return os.path.isfile(self.filename(digest,ext))
+
+    def add(self,data,ext):
+        '''
+        Store ``data`` unless already there.
+
+        :returns: its SHA-1.
+        '''
+        digest   = hashlib.sha1(data).hexdigest()
+        filename = self.filename(digest,ext)
+        if not os.path.isfile(filename):
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            (fd,tmp) = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd,'wb') as f:
+                f.write(data)
+            os.rename(tmp,filename)
+        return digest
+
+class Job(object):
+    '''
+    Flashing one firmware on a list of ports.
+    '''
+
+    def __init__(self,jobId,board,devices,digest,ext):
+
+        # store params
+        self.id                = jobId
+        self.board             = board
+        self.devices           = devices
+        self.digest            = digest
+        self.ext               = ext
+
+        # local variables
+        self.submitted         = time.time()
+        self.numRunning        = 0
+        self.reports           = {}
+        self.done              = threading.Event()
+
+    @property
+    def ports(self):
+        return [d['port'] for d in self.devices]
+
+    def toDict(self):
+        if self.done.is_set():
+            state = 'done'
+        elif self.numRunning or self.reports:
+            state = 'running'
+        else:
+            state = 'queued'
+        return {
+            'id':        self.id,
+            'board':     self.board,
+            'ports':     self.ports,
+            'firmware':  self.digest+self.ext,
+            'submitted': self.submitted,
+            'state':     state,
+            'reports':   [self.reports[p] for p in self.ports if p in self.reports],
+        }
+
+class Flashd(object):
+    '''
+    The registry, firmware store and scheduler of the daemon.
+
+    :param path: the directory the registry and firmware are stored in.
+    :param perHub: the maximum number of ports flashed at the same time
+        behind one USB hub.
+    :param numWorkers: the maximum number of ports flashed at the same time.
+    :param python: the interpreter the bootloaders are run with.
+    '''
+
+    def __init__(self,path=DEFAULT_DIR,perHub=PER_HUB,numWorkers=NUM_WORKERS,python=PYTHON):
+
+        # store params
+        self.perHub            = perHub
+        self.numWorkers        = numWorkers
+        self.python            = python
+
+        # local variables
+        self.registry          = Registry(os.path.join(path,'registry.json'))
+        self.store             = FirmwareStore(os.path.join(path,'firmware'))
+        self.cond              = threading.Condition()
+        self.tasks             = []       # (job,device), first come first served
+        self.busyPorts         = set()
+        self.hubLoad           = {}       # hub -> number of ports being flashed
+        self.jobs              = []
+        self.nextJobId         = 1
+        self.workers           = []
+
+    #======================== public ==========================================
+
+    def start(self):
+        for i in range(self.numWorkers):
+            worker = threading.Thread(target=self._work,name='flashd_worker_{0}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers += [worker]
+
+    def submit(self,board,ports,digest,ext):
+        '''
+        Queue flashing firmware ``digest`` on ``ports``, or on all the
+        attached motes registered as ``board`` if ``ports`` is ``'all'``.
+
+        :returns: the :class:`Job`.
+        '''
+        if board not in COMMANDS:
+            raise FlashdError('bootloading on board={0} unsupported'.format(board))
+        if not self.store.has(digest,ext):
+            raise FlashdError('unknown firmware {0}{1}'.format(digest,ext))
+        if ports=='all':
+            devices = [d for d in self.registry.scan() if d['board']==board]
+            if not devices:
+                raise FlashdError('no attached mote is registered as {0}'.format(board))
+        else:
+            # each port once, the job is done when each has its report
+            devices = []
+            for p in ports:
+                device = self.registry.device(p)
+                if device['port'] not in [d['port'] for d in devices]:
+                    devices += [device]
+        for device in devices:
+            self.registry.register(device,board)
+        with self.cond:
+            job             = Job(self.nextJobId,board,devices,digest,ext)
+            self.nextJobId += 1
+            self.jobs       = self.jobs[-MAX_JOBS+1:]+[job]
+            self.tasks     += [(job,device) for device in devices]
+            self.cond.notify_all()
+        log.info('job {0}: {1} on {2}'.format(job.id,board,', '.join(job.ports)))
+        return job
+
+    def flash(self,board,port,firmware):
+        '''
+        Flash ``firmware`` on ``port`` with the bootloader of ``board``.
+
+        :returns: the report of the bootloader, see
+            :meth:`flashreport.FlashReport.toDict`.
+        '''
+        tmpDir     = tempfile.mkdtemp(prefix='flashd')
+        reportFile = os.path.join(tmpDir,'report.json')
+        command    = [self.python]+[
+            arg.format(port=port,firmware=firmware,report=reportFile) for arg in COMMANDS[board]
+        ]
+        report     = flashreport.FlashReport(port,board)
+        try:
+            with report.phase(flashreport.PHASE_UNKNOWN):
+                proc   = subprocess.Popen(
+                    command,
+                    cwd    = BOOTLOADER_DIR,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.STDOUT,
+                )
+                output = proc.communicate()[0]
+            try:
+                returnVal = flashreport.readReports(reportFile)[0]
+            except (IOError,ValueError,IndexError):
+                # the bootloader does not write reports, or died first
+                report.done(None if proc.returncode==0 else 'exit status {0}'.format(proc.returncode))
+                returnVal = report.toDict()
+            if proc.returncode!=0 and returnVal['ok']:
+                returnVal['ok']    = False
+                returnVal['error'] = 'exit status {0}'.format(proc.returncode)
+            if not returnVal['ok']:
+                lines = output.decode('utf-8','replace').splitlines()
+                returnVal['info']['log'] = lines[-LOG_LINES:]
+        except Exception as err:
+            report.done(err)
+            returnVal = report.toDict()
+        finally:
+            shutil.rmtree(tmpDir,ignore_errors=True)
+        returnVal['port']  = port
+        returnVal['board'] = board
+        return returnVal
+
+    def getJobs(self):
+        with self.cond:
+            return [job.toDict() for job in self.jobs]
+
+    def getQueue(self):
+        with self.cond:
+            return {
+                'queued':    len(self.tasks),
+                'busyPorts': sorted(self.busyPorts),
+                'hubLoad':   dict(self.hubLoad),
+            }
+
+    #======================== private =========================================
+
+    def _nextTask(self):
+        for (job,device) in self.tasks:
+            if device['port'] in self.busyPorts:
+                continue
+            if self.hubLoad.get(device['hub'],0)>=self.perHub:
+                continue
+            return (job,device)
+        return None
+
+    def _work(self):
+        while True:
+            with self.cond:
+                task = self._nextTask()
+                while task is None:
+                    self.cond.wait()
+                    task = self._nextTask()
+                self.tasks.remove(task)
+                (job,device)                 = task
+                self.busyPorts.add(device['port'])
+                self.hubLoad[device['hub']]  = self.hubLoad.get(device['hub'],0)+1
+                job.numRunning              += 1
+            report = self.flash(job.board,device['port'],self.store.filename(job.digest,job.ext))
+            log.info('job {0}: {1} {2}'.format(job.id,device['port'],'ok' if report['ok'] else report['error']))
+            with self.cond:
+                self.busyPorts.discard(device['port'])
+                self.hubLoad[device['hub']] -= 1
+                job.numRunning              -= 1
+                job.reports[device['port']]  = report
+                if len(job.reports)==len(job.devices):
+                    job.done.set()
+                self.cond.notify_all()
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        flashd = self.server.flashd
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            cmd     = request.get('cmd')
+            if   cmd=='devices':
+                answer = {'devices': flashd.registry.scan()}
+            elif cmd=='register':
+                flashd.registry.register(flashd.registry.device(request['port']),request['board'])
+                answer = {}
+            elif cmd=='jobs':
+                answer = {'jobs': flashd.getJobs(),'queue': flashd.getQueue()}
+            elif cmd=='flash':
+                ext = request.get('ext','')
+                if 'data' in request:
+                    request['sha1'] = flashd.store.add(base64.b64decode(request['data']),ext)
+                if not flashd.store.has(request['sha1'],ext):
+                    answer = {'ok': False,'missing': request['sha1']}
+                else:
+                    job = flashd.submit(request['board'],request['ports'],request['sha1'],ext)
+                    if request.get('wait',True):
+                        job.done.wait()
+                    answer = job.toDict()
+            else:
+                raise FlashdError('unknown command {0}'.format(cmd))
+        except (FlashdError,KeyError,ValueError) as err:
+            answer = {'ok': False,'error': str(err)}
+        except Exception as err:
+            # answer anyway, the client would otherwise wait for the answer
+            # until the connection is closed
+            log.exception('request failed')
+            answer = {'ok': False,'error': 'internal error: {0}'.format(err)}
+        answer.setdefault('ok',True)
+        self.wfile.write((json.dumps(answer)+'\n').encode('utf-8'))
+
+class FlashdServer(socketserver.ThreadingUnixStreamServer):
+    '''
+    Serve a :class:`Flashd` on a Unix socket.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self,socketPath,flashd):
+        self.flashd = flashd
+        if os.path.exists(socketPath):
+            if isRunning(socketPath):
+                raise FlashdError('a daemon already listens on {0}'.format(socketPath))
+            os.remove(socketPath)
+        elif not os.path.isdir(os.path.dirname(socketPath)):
+            os.makedirs(os.path.dirname(socketPath))
+        socketserver.ThreadingUnixStreamServer.__init__(self,socketPath,_RequestHandler)
+
+#============================ functions =======================================
+
+def listPorts():
+    '''
+    :returns: a ``(port,serialNumber,location)`` tuple per serial port
+        pyserial can list.
+    '''
+    try:
+        from serial.tools import list_ports
+        ports = list(list_ports.comports())
+    except Exception:
+        # old or missing pyserial
+        return []
+    returnVal = []
+    for info in ports:
+        returnVal += [(
+            getattr(info,'device',None) or info[0],
+            getattr(info,'serial_number',None),
+            getattr(info,'location',None),
+        )]
+    return returnVal
+
+def hubOf(port,location):
+    '''
+    :returns: the USB hub a serial adapter is plugged in, from its
+        ``location`` as given by pyserial (e.g. ``1-1.4.2:1.0`` is on hub
+        ``1-1.4``), or the port itself if unknown.
+    '''
+    if not location:
+        return port
+    path = location.split(':')[0]
+    if '.' in path:
+        return path.rsplit('.',1)[0]
+    # plugged in a root port, the hub is the bus
+    return path.split('-')[0]
+
+def request(socketPath,message,timeout=None):
+    '''
+    Send ``message`` to the daemon listening on ``socketPath``.
+
+    :returns: the answer.
+    :raises: :class:`FlashdError` if the daemon cannot be reached or the
+        request failed.
+    '''
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socketPath)
+        sock.sendall((json.dumps(message)+'\n').encode('utf-8'))
+        f = sock.makefile('rb')
+        try:
+            line = f.readline()
+        finally:
+            f.close()
+    except (socket.error,IOError) as err:
+        raise FlashdError('cannot reach the flashing daemon on {0}: {1}'.format(socketPath,err))
+    finally:
+        sock.close()
+    if not line:
+        raise FlashdError('the flashing daemon closed the connection')
+    answer = json.loads(line.decode('utf-8'))
+    if not answer['ok'] and 'error' in answer:
+        raise FlashdError(answer['error'])
+    return answer
+
+def isRunning(socketPath):
+    try:
+        request(socketPath,{'cmd': 'jobs'},timeout=5)
+    except FlashdError:
+        return False
+    return True
+
+def submit(socketPath,board,ports,firmware,wait=True):
+    '''
+    Flash ``firmware`` on ``ports`` (a list, or ``'all'``) through the
+    daemon. The firmware is only sent if the daemon does not have it yet.
+
+    :returns: the job, as a dict with the ``reports`` of its ports if
+        ``wait``.
+    '''
+    with open(firmware,'rb') as f:
+        data = f.read()
+    message = {
+        'cmd':   'flash',
+        'board': board,
+        'ports': ports,
+        'sha1':  hashlib.sha1(data).hexdigest(),
+        'ext':   os.path.splitext(firmware)[1],
+        'wait':  wait,
+    }
+    answer = request(socketPath,message)
+    if 'missing' in answer:
+        message['data'] = base64.b64encode(data).decode('ascii')
+        answer = request(socketPath,message)
+    return answer
+
+def _writeJson(path,data):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    (fd,tmp) = tempfile.mkstemp(dir=dirname or '.')
+    with os.fdopen(fd,'w') as f:
+        json.dump(data,f,indent=4,sort_keys=True)
+    if os.name=='nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp,path)
+
+#============================ main ============================================
+
+def usage():
+    print('''Usage: {0} [options] command
+Commands:
+    serve                         Run the daemon
+    devices                       List the attached motes
+    register port board           Set the board of the mote on port
+    jobs                          List the jobs and the queue
+    flash board ports firmware    Flash firmware on the comma-separated
+                                  ports, or all the motes of that board
+Options:
+    -s, --socket=path             Socket of the daemon (default {1})
+    -d, --dir=path                Registry and firmware store of the daemon
+                                  (default {2})
+    --per-hub=n                   Ports flashed at the same time behind a
+                                  USB hub (default {3})
+    -j, --jobs=n                  Ports flashed at the same time (default {4})
+    --python=path                 Interpreter of the bootloaders (default {5})
+'''.format(sys.argv[0],DEFAULT_SOCKET,DEFAULT_DIR,PER_HUB,NUM_WORKERS,PYTHON))
+
+def main():
+    socketPath = DEFAULT_SOCKET
+    kwargs     = {}
+    try:
+        (opts,args) = getopt.getopt(sys.argv[1:],'hs:d:j:',['help','socket=','dir=','per-hub=','jobs=','python='])
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(2)
+    for (o,a) in opts:
+        if   o in ('-h','--help'):
+            usage()
+            sys.exit(0)
+        elif o in ('-s','--socket'):
+            socketPath           = a
+        elif o in ('-d','--dir'):
+            kwargs['path']       = a
+        elif o=='--per-hub':
+            kwargs['perHub']     = int(a)
+        elif o in ('-j','--jobs'):
+            kwargs['numWorkers'] = int(a)
+        elif o=='--python':
+            kwargs['python']     = a
+    if not args:
+        usage()
+        sys.exit(2)
+
+    try:
+        if args[0]=='serve':
+            logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s')
+            flashd = Flashd(**kwargs)
+            flashd.start()
+            server = FlashdServer(socketPath,flashd)
+            print('listening on {0}'.format(socketPath))
+            try:
+                server.serve_forever()
+            finally:
+                os.remove(socketPath)
+        elif args[0]=='devices':
+            for d in request(socketPath,{'cmd': 'devices'})['devices']:
+                print('{0:<20} {1:<16} {2:<20} hub {3:<12} {4}'.format(d['port'],d['board'],d['serial'],d['hub'],d['location']))
+        elif args[0]=='register' and len(args)==3:
+            request(socketPath,{'cmd': 'register','port': args[1],'board': args[2]})
+        elif args[0]=='jobs':
+            for job in request(socketPath,{'cmd': 'jobs'})['jobs']:
+                print('{0:>4} {1:<8} {2:<16} {3}'.format(job['id'],job['state'],job['board'],', '.join(job['ports'])))
+        elif args[0]=='flash' and len(args)==4:
+            ports = args[2] if args[2]=='all' else args[2].split(',')
+            job   = submit(socketPath,args[1],ports,args[3])
+            for line in flashreport.formatSummary(job['reports']):
+                print(line)
+            if not all([r['ok'] for r in job['reports']]):
+                sys.exit(1)
+        else:
+            usage()
+            sys.exit(2)
+    except FlashdError as err:
+        print('ERROR: {0}'.format(err))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,213 @@
+'''
+Timing of the phases of flashing a mote, shared by the bootloaders.
+
+A bootloader creates a :class:`FlashReport` per port, and wraps each phase
+of its work in :meth:`FlashReport.phase`::
+
+    report = FlashReport(port)
+    with report.phase(PHASE_WRITE,numBytes=len(data)):
+        ...
+
+A phase can be entered several times, e.g. once per baud rate tried; its
+durations and byte counts add up. :meth:`FlashReport.toDict` gives the
+report as a JSON-serializable dict; :func:`writeReports` and
+:func:`readReports` store lists of them, which :func:`formatSummary` turns
+into a table of the slowest ports.
+'''
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+#============================ defines =========================================
+
+PHASE_CONNECT              = 'connect'
+PHASE_ERASE                = 'erase'
+PHASE_WRITE                = 'write'
+PHASE_VERIFY               = 'verify'
+PHASE_RESET                = 'reset'
+# the whole flashing, for a bootloader which does not report its phases
+PHASE_UNKNOWN              = 'unknown'
+PHASES                     = [PHASE_CONNECT,PHASE_ERASE,PHASE_WRITE,PHASE_VERIFY,PHASE_RESET,PHASE_UNKNOWN]
+
+#============================ classes =========================================
+
+class FlashReport(object):
+    '''
+    The phase timings and counters of flashing one port.
+
+    :param port: the serial port flashed.
+    :param board: the kind of board, for the summary.
+    '''
+
+    def __init__(self,port,board=None):
+
+        # store params
+        self.port              = port
+        self.board             = board
+
+        # local variables
+        self.start             = time.time()
+        self.end               = None
+        self.durations         = {}
+        self.numBytes          = {}
+        self.numRetries        = 0
+        self.retryReasons      = []
+        self.error             = None
+        self.info              = {}
+
+    #======================== public ==========================================
+
+    @contextlib.contextmanager
+    def phase(self,name,numBytes=0):
+        '''
+        Time the enclosed block as phase ``name``, which transferred
+        ``numBytes`` bytes. The time is accounted for even if the block
+        raises.
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name,0)+time.time()-start
+            self.addBytes(name,numBytes)
+
+    def addBytes(self,name,numBytes):
+        '''
+        Account for bytes transferred during phase ``name``, when they are
+        only known once it is running.
+        '''
+        if numBytes:
+            self.numBytes[name] = self.numBytes.get(name,0)+numBytes
+
+    def retry(self,reason=None):
+        self.numRetries       += 1
+        if reason is not None:
+            self.retryReasons += [str(reason)]
+
+    def set(self,key,value):
+        '''
+        Record a piece of information about the flashing, e.g. the baud rate.
+        '''
+        self.info[key] = value
+
+    def done(self,error=None):
+        '''
+        Mark the flashing finished, successfully if ``error`` is ``None``.
+        '''
+        self.end               = time.time()
+        self.error             = None if error is None else str(error)
+
+    def toDict(self):
+        end = self.end if self.end is not None else time.time()
+        phases = {}
+        for name in sorted(set(self.durations)|set(self.numBytes)):
+            duration = self.durations.get(name,0)
+            numBytes = self.numBytes.get(name,0)
+            phases[name] = {
+                'duration':       duration,
+                'bytes':          numBytes,
+                'bytesPerSecond': numBytes/duration if duration and numBytes else None,
+            }
+        return {
+            'port':         self.port,
+            'board':        self.board,
+            'ok':           self.error is None,
+            'error':        self.error,
+            'start':        self.start,
+            'duration':     end-self.start,
+            'phases':       phases,
+            'retries':      self.numRetries,
+            'retryReasons': self.retryReasons,
+            'info':         self.info,
+        }
+
+#============================ functions =======================================
+
+def writeReports(filename,reports):
+    '''
+    Write a list of reports, :class:`FlashReport` or dicts, as JSON.
+    '''
+    reports = [r.toDict() if isinstance(r,FlashReport) else r for r in reports]
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+    # write under a name of its own first, so concurrent writers of the same
+    # report neither clobber each other nor leave half a file
+    (fd,tmp) = tempfile.mkstemp(dir=dirname or '.',prefix=os.path.basename(filename)+'.')
+    try:
+        with os.fdopen(fd,'w') as f:
+            json.dump(reports,f,indent=4,sort_keys=True)
+        if os.name=='nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp,filename)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def readReports(filename):
+    '''
+    :returns: the list of report dicts in ``filename``, which may also hold
+        a single report.
+    '''
+    with open(filename,'r') as f:
+        reports = json.load(f)
+    if isinstance(reports,dict):
+        reports = [reports]
+    return reports
+
+def aggregate(reports):
+    '''
+    :returns: a dict with the total and slowest duration of each phase, the
+        overall throughput of the write phase, and the number of ports which
+        failed or needed retries.
+    '''
+    returnVal = {
+        'numPorts':    len(reports),
+        'numFailed':   len([r for r in reports if not r['ok']]),
+        'numRetried':  len([r for r in reports if r['retries']]),
+        'duration':    max([r['duration'] for r in reports] or [0]),
+        'phases':      {},
+    }
+    for name in PHASES:
+        durations = [(r['phases'][name]['duration'],r['port']) for r in reports if name in r['phases']]
+        if not durations:
+            continue
+        numBytes  = sum([r['phases'][name]['bytes'] for r in reports if name in r['phases']])
+        total     = sum([d for (d,_) in durations])
+        returnVal['phases'][name] = {
+            'total':          total,
+            'slowest':        max(durations)[0],
+            'slowestPort':    max(durations)[1],
+            'bytes':          numBytes,
+            'bytesPerSecond': numBytes/total if total and numBytes else None,
+        }
+    return returnVal
+
+def formatSummary(reports):
+    '''
+    :returns: the reports as a list of printable lines, slowest port first.
+    '''
+    lines  = []
+    lines += ['{0:>20} '.format('port')+' '.join('{0:>8}'.format(p) for p in PHASES)+'    total  B/s write retries']
+    for r in sorted(reports,key=lambda r: -r['duration']):
+        write = r['phases'].get(PHASE_WRITE,{}).get('bytesPerSecond')
+        lines += [
+            '{0:>20} '.format(r['port'])
+            + ' '.join(
+                '{0:>8.2f}'.format(r['phases'][p]['duration']) if p in r['phases'] else '{0:>8}'.format('-')
+                for p in PHASES
+            )
+            + ' {0:>8.2f}'.format(r['duration'])
+            + ' {0:>11}'.format('{0:.0f}'.format(write) if write else '-')
+            + ' {0:>7}'.format(r['retries'])
+            + ('' if r['ok'] else '  FAILED: {0}'.format(r['error']))
+        ]
+    return lines
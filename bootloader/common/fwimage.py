@@ -0,0 +1,504 @@
+'''
+Firmware image loading, shared by the bootloaders.
+
+A firmware file is parsed into a :class:`FirmwareImage`: a sparse map of the
+memory it fills, as a sorted list of ``(address,bytearray)`` segments. The
+supported formats are
+
+- Intel HEX (``FORMAT_IHEX``), including extended segment and linear
+  address records;
+- TI-Text (``FORMAT_TITEXT``), as written by the MSP430 tools;
+- ELF (``FORMAT_ELF``), 32-bit little-endian executables, whose allocated
+  sections are placed at their load address;
+- raw binary (``FORMAT_BIN``), placed at a given base address.
+
+:func:`load` caches the images it parses, keyed by the file's modification
+time and the hash of its content, so loading the same firmware for several
+motes (or several times in a build) only parses it once. Images returned by
+:func:`load` are shared through that cache, and must not be modified. Only
+the ``MEMORY_ENTRIES`` most recently loaded images are kept in memory, so a
+long-running process (e.g. flashd) does not keep every firmware it flashed.
+
+The parsed images are also stored on disk, in ``DEFAULT_CACHE_DIR``, keyed by
+the hash of the file. The bootloaders which flash each mote from its own
+process (telosb, openmotestm) then only parse a firmware in the first one.
+Only the ``CACHE_ENTRIES`` most recently used images are kept.
+'''
+
+import binascii
+import bisect
+import collections
+import hashlib
+import os
+import struct
+import threading
+
+#============================ defines =========================================
+
+FORMAT_IHEX                = 'ihex'
+FORMAT_TITEXT              = 'titext'
+FORMAT_ELF                 = 'elf'
+FORMAT_BIN                 = 'bin'
+
+EXTENSIONS                 = {
+    '.hex':  FORMAT_IHEX,
+    '.ihex': FORMAT_IHEX,
+    '.ihx':  FORMAT_IHEX,
+    '.a43':  FORMAT_IHEX,
+    '.txt':  FORMAT_TITEXT,
+    '.elf':  FORMAT_ELF,
+    '.exe':  FORMAT_ELF,
+    '.bin':  FORMAT_BIN,
+}
+
+# Intel HEX record types
+IHEX_DATA                  = 0x00
+IHEX_EOF                   = 0x01
+IHEX_EXT_SEGMENT_ADDR      = 0x02
+IHEX_START_SEGMENT_ADDR    = 0x03
+IHEX_EXT_LINEAR_ADDR       = 0x04
+IHEX_START_LINEAR_ADDR     = 0x05
+
+ELF_MAGIC                  = b'\x7fELF'
+ELF_HEADER                 = struct.Struct('<16sHHIIIIIHHHHHH')
+ELF_SECTION_HEADER         = struct.Struct('<IIIIIIIIII')
+ELF_PROGRAM_HEADER         = struct.Struct('<IIIIIIII')
+ELF_ET_EXEC                = 2
+ELF_SHT_NOBITS             = 8
+ELF_SHF_ALLOC              = 0x2
+ELF_PT_LOAD                = 1
+
+DEFAULT_CACHE_DIR          = os.path.join(os.path.expanduser('~'),'.openwsn','fwimage')
+CACHE_ENTRIES              = 32
+MEMORY_ENTRIES             = 8
+
+# the header of a cached image, and of each of its segments
+CACHE_MAGIC                = b'FWIMG1\0\0'
+CACHE_SEGMENT              = struct.Struct('<II')
+
+#============================ exceptions ======================================
+
+class ImageFormatError(Exception):
+    pass
+
+#============================ classes =========================================
+
+class FirmwareImage(object):
+    '''
+    The memory contents of a firmware, as sorted, non-overlapping segments.
+    Adjacent segments are merged.
+
+    :param segments: an iterable of ``(address,data)`` to start with.
+    '''
+
+    def __init__(self,segments=()):
+        self.starts            = []
+        self.datas             = []
+        for (address,data) in segments:
+            self.add(address,data)
+
+    #======================== public ==========================================
+
+    def add(self,address,data):
+        '''
+        Place ``data`` at ``address``, over whatever was there before.
+        '''
+        if not len(data):
+            return
+        data = bytearray(data)
+        end  = address+len(data)
+
+        # the segments touching [address,end) are merged with the new data
+        first = bisect.bisect_left(self.starts,address)
+        if first and self.starts[first-1]+len(self.datas[first-1])>=address:
+            first -= 1
+        last = bisect.bisect_right(self.starts,end)
+        if first<last:
+            start  = min(self.starts[first],address)
+            stop   = max(self.starts[last-1]+len(self.datas[last-1]),end)
+            merged = bytearray(b'\xff'*(stop-start))
+            for i in range(first,last):
+                offset = self.starts[i]-start
+                merged[offset:offset+len(self.datas[i])] = self.datas[i]
+            merged[address-start:end-start] = data
+            (address,data) = (start,merged)
+        self.starts[first:last] = [address]
+        self.datas[first:last]  = [data]
+
+    @property
+    def segments(self):
+        '''
+        :returns: the list of ``(address,bytearray)`` segments, by address.
+        '''
+        return list(zip(self.starts,self.datas))
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def minAddress(self):
+        return self.starts[0] if self.starts else None
+
+    def maxAddress(self):
+        '''
+        :returns: the address following the last byte of the image.
+        '''
+        return self.starts[-1]+len(self.datas[-1]) if self.starts else None
+
+    def size(self):
+        '''
+        :returns: the number of bytes the image fills, gaps not included.
+        '''
+        return sum(len(data) for data in self.datas)
+
+    def getRange(self,start,end,fill=0xff):
+        '''
+        :returns: the bytes from ``start`` to ``end`` (excluded) as a
+            ``bytearray``, the addresses the image does not fill being
+            ``fill``.
+        '''
+        returnVal = bytearray([fill])*(end-start)
+        i = max(bisect.bisect_right(self.starts,start)-1,0)
+        while i<len(self.starts) and self.starts[i]<end:
+            (address,data) = (self.starts[i],self.datas[i])
+            lo = max(address,start)
+            hi = min(address+len(data),end)
+            if lo<hi:
+                returnVal[lo-start:hi-start] = data[lo-address:hi-address]
+            i += 1
+        return returnVal
+
+    def toBinary(self,start=None,fill=0xff):
+        '''
+        Flatten the image, from ``start`` (by default the lowest address) to
+        its end, filling the gaps with ``fill``.
+
+        :returns: a ``bytearray``.
+        '''
+        if not self.starts:
+            return bytearray()
+        if start is None:
+            start = self.starts[0]
+        return self.getRange(start,self.maxAddress(),fill)
+
+    def blocks(self,size,skipBlank=False,fill=0xff):
+        '''
+        Iterate over the data of the image in blocks of at most ``size``
+        bytes, e.g. the frames to write. The blocks are cut at the multiples
+        of ``size``, and clamped to the segments: they never cover a gap
+        between segments, nor go past :meth:`maxAddress`.
+
+        :param skipBlank: skip the blocks which only hold ``fill`` bytes,
+            i.e. which are already right in an erased flash.
+        :returns: an iterator of ``(address,bytearray)``, by address.
+        '''
+        for (address,data) in zip(self.starts,self.datas):
+            end   = address+len(data)
+            start = address
+            while start<end:
+                stop  = min(start-start%size+size,end)
+                chunk = data[start-address:stop-address]
+                if not (skipBlank and chunk==bytearray([fill])*len(chunk)):
+                    yield (start,chunk)
+                start = stop
+
+#============================ parsers =========================================
+
+def parseIHex(content):
+    '''
+    :param content: the text of an Intel HEX file, as bytes.
+    '''
+    segments   = []
+    base       = 0
+    for (lineno,line) in enumerate(content.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1]!=b':':
+            raise ImageFormatError('line {0}: not an Intel HEX record'.format(lineno+1))
+        try:
+            record = bytearray(binascii.unhexlify(line[1:]))
+        except (TypeError,binascii.Error):
+            raise ImageFormatError('line {0}: invalid hex digits'.format(lineno+1))
+        if len(record)<5 or len(record)!=record[0]+5:
+            raise ImageFormatError('line {0}: bad record length'.format(lineno+1))
+        if sum(record)&0xff:
+            raise ImageFormatError('line {0}: bad checksum'.format(lineno+1))
+        (length,address,rtype) = (record[0],(record[1]<<8)|record[2],record[3])
+        data = record[4:4+length]
+        if rtype==IHEX_DATA:
+            _append(segments,base+address,data)
+        elif rtype==IHEX_EOF:
+            break
+        elif rtype==IHEX_EXT_SEGMENT_ADDR:
+            base = ((data[0]<<8)|data[1])<<4
+        elif rtype==IHEX_EXT_LINEAR_ADDR:
+            base = ((data[0]<<8)|data[1])<<16
+        # start address records do not describe memory contents
+    return FirmwareImage(segments)
+
+def parseTIText(content):
+    '''
+    :param content: the text of a TI-Text file, as bytes.
+    '''
+    segments   = []
+    address    = 0
+    for (lineno,line) in enumerate(content.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1]==b'q':
+            break
+        if line[:1]==b'@':
+            address = int(line[1:],16)
+            continue
+        try:
+            data = bytearray(binascii.unhexlify(b''.join(line.split())))
+        except (TypeError,binascii.Error):
+            raise ImageFormatError('line {0}: invalid hex digits'.format(lineno+1))
+        _append(segments,address,data)
+        address += len(data)
+    return FirmwareImage(segments)
+
+def parseELF(content):
+    '''
+    :param content: the content of a 32-bit little-endian ELF executable.
+    '''
+    if content[:4]!=ELF_MAGIC or len(content)<ELF_HEADER.size:
+        raise ImageFormatError('not an ELF file')
+    (ident,etype,_,_,_,phoff,shoff,_,_,phentsize,phnum,shentsize,shnum,_) = \
+        ELF_HEADER.unpack_from(content)
+    if etype!=ELF_ET_EXEC:
+        raise ImageFormatError('not an executable')
+
+    phdrs = [
+        ELF_PROGRAM_HEADER.unpack_from(content,phoff+i*phentsize)
+        for i in range(phnum)
+    ]
+    segments = []
+    for i in range(shnum):
+        (_,shtype,shflags,shaddr,shoffset,shsize,_,_,_,_) = \
+            ELF_SECTION_HEADER.unpack_from(content,shoff+i*shentsize)
+        if not (shflags&ELF_SHF_ALLOC) or shtype==ELF_SHT_NOBITS or not shsize:
+            continue
+        segments += [(_loadAddress(phdrs,shaddr,shoffset,shsize),content[shoffset:shoffset+shsize])]
+    return FirmwareImage(segments)
+
+def parseBin(content,base=0):
+    return FirmwareImage([(base,content)])
+
+PARSERS                    = {
+    FORMAT_IHEX:   parseIHex,
+    FORMAT_TITEXT: parseTIText,
+    FORMAT_ELF:    parseELF,
+}
+
+#============================ loading =========================================
+
+# least recently used first
+_cache                     = collections.OrderedDict() # path -> (mtime,size,digest)
+_images                    = collections.OrderedDict() # (digest,format,base) -> FirmwareImage
+_cacheLock                 = threading.Lock()
+
+def detectFormat(content,filename=None):
+    '''
+    :returns: the format given by the extension of ``filename`` or else,
+        from the first bytes of ``content``. Anything unrecognized is raw
+        binary.
+    '''
+    if filename:
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in EXTENSIONS:
+            return EXTENSIONS[ext]
+    if content[:4]==ELF_MAGIC:
+        return FORMAT_ELF
+    head = content[:1]
+    if head==b':':
+        return FORMAT_IHEX
+    if head==b'@':
+        return FORMAT_TITEXT
+    return FORMAT_BIN
+
+def loads(content,fmt=None,base=0):
+    '''
+    Parse the content of a firmware file.
+
+    :param fmt: one of the ``FORMAT_*`` constants, detected if ``None``.
+    :param base: where a raw binary is placed.
+    '''
+    content = bytes(content)
+    if fmt is None:
+        fmt = detectFormat(content)
+    if fmt==FORMAT_BIN:
+        return parseBin(content,base)
+    if fmt not in PARSERS:
+        raise ImageFormatError('unknown format {0}'.format(fmt))
+    return PARSERS[fmt](content)
+
+def load(filename,fmt=None,base=0,cacheDir=DEFAULT_CACHE_DIR):
+    '''
+    Parse a firmware file, or return the image parsed earlier if the file
+    has not changed.
+
+    :param fmt: one of the ``FORMAT_*`` constants, detected from the
+        extension or content of the file if ``None``.
+    :param base: where a raw binary is placed.
+    :param cacheDir: the directory the parsed images are stored in across
+        processes, ``None`` to only keep them in this process.
+    '''
+    path = os.path.abspath(filename)
+    st   = os.stat(path)
+    with _cacheLock:
+        known = _cache.get(path)
+    if known and known[:2]==(st.st_mtime,st.st_size):
+        digest  = known[2]
+        content = None
+    else:
+        with open(path,'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        with _cacheLock:
+            _cache.pop(path,None)
+            _cache[path] = (st.st_mtime,st.st_size,digest)
+            _trim(_cache)
+
+    with _cacheLock:
+        for (key,image) in _images.items():
+            if key[0]==digest and (fmt is None or key[1]==fmt) and key[2] in (base,None):
+                # most recently used last
+                _images[key] = _images.pop(key)
+                return image
+
+    if content is None:
+        # not parsed yet with this format or base
+        with open(path,'rb') as f:
+            content = f.read()
+    if fmt is None:
+        fmt = detectFormat(content,filename)
+    if fmt==FORMAT_BIN or not cacheDir:
+        # a raw binary is read as fast as its cache entry would be
+        image = loads(content,fmt,base)
+    else:
+        cacheFile = os.path.join(cacheDir,'{0}.{1}'.format(digest,fmt))
+        image     = _readCached(cacheFile)
+        if image is None:
+            image = loads(content,fmt,base)
+            _writeCached(cacheFile,image)
+    with _cacheLock:
+        key = (digest,fmt,base if fmt==FORMAT_BIN else None)
+        _images.pop(key,None)
+        _images[key] = image
+        _trim(_images)
+    return image
+
+#============================ verifying =======================================
+
+def mismatches(address,expected,actual,chunkSize=64):
+    '''
+    Compare what was read back from a device with what was written there.
+
+    :param address: the address of the first byte of ``expected``.
+    :returns: the list of ``(start,end)`` address ranges, ``end`` excluded,
+        where ``actual`` differs from ``expected`` or is missing.
+    '''
+    expected  = bytearray(expected)
+    actual    = bytearray(actual)
+    if expected==actual:
+        return []
+    returnVal = []
+    start     = None
+    length    = min(len(expected),len(actual))
+    for offset in range(0,length,chunkSize):
+        if expected[offset:offset+chunkSize]==actual[offset:offset+chunkSize]:
+            if start is not None:
+                returnVal += [(address+start,address+offset)]
+                start = None
+            continue
+        for i in range(offset,min(offset+chunkSize,length)):
+            if expected[i]!=actual[i]:
+                if start is None:
+                    start = i
+            elif start is not None:
+                returnVal += [(address+start,address+i)]
+                start = None
+    if len(expected)>length and start is None:
+        start = length
+    if start is not None:
+        returnVal += [(address+start,address+max(len(expected),length))]
+    return returnVal
+
+#============================ helpers =========================================
+
+def _trim(cache):
+    # drop the least recently used entries
+    while len(cache)>MEMORY_ENTRIES:
+        cache.popitem(last=False)
+
+def _readCached(cacheFile):
+    try:
+        with open(cacheFile,'rb') as f:
+            content = f.read()
+        if content[:len(CACHE_MAGIC)]!=CACHE_MAGIC:
+            return None
+        image  = FirmwareImage()
+        offset = len(CACHE_MAGIC)
+        while offset<len(content):
+            (address,length) = CACHE_SEGMENT.unpack_from(content,offset)
+            offset          += CACHE_SEGMENT.size
+            if offset+length>len(content):
+                return None # truncated
+            image.starts    += [address]
+            image.datas     += [bytearray(content[offset:offset+length])]
+            offset          += length
+        # the most recently used entries are kept by _writeCached()
+        os.utime(cacheFile,None)
+        return image
+    except (IOError,OSError,struct.error):
+        # missing or corrupted, parse the firmware again
+        return None
+
+def _writeCached(cacheFile,image):
+    # the segments of an image are sorted and do not overlap, they are
+    # stored as they are
+    chunks = [CACHE_MAGIC]
+    for (address,data) in image:
+        chunks += [CACHE_SEGMENT.pack(address,len(data)),bytes(data)]
+    cacheDir = os.path.dirname(cacheFile)
+    try:
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        # write under another name first, so a concurrent process never
+        # reads half an image
+        tmp = '{0}.{1}.tmp'.format(cacheFile,os.getpid())
+        with open(tmp,'wb') as f:
+            f.write(b''.join(chunks))
+        if os.name=='nt' and os.path.exists(cacheFile):
+            os.remove(cacheFile)
+        os.rename(tmp,cacheFile)
+
+        # drop the least recently used entries
+        entries = [os.path.join(cacheDir,name) for name in os.listdir(cacheDir)]
+        entries = sorted(entries,key=lambda path: os.stat(path).st_mtime)
+        for path in entries[:-CACHE_ENTRIES]:
+            os.remove(path)
+    except (IOError,OSError):
+        pass # the cache is only an optimization
+
+def _append(segments,address,data):
+    # extend the last segment if data follows it, which is the common case
+    if segments and segments[-1][0]+len(segments[-1][1])==address:
+        segments[-1][1].extend(data)
+    else:
+        segments.append((address,bytearray(data)))
+
+def _loadAddress(phdrs,shaddr,shoffset,shsize):
+    # a section stored in a loadable segment whose physical address differs
+    # from its virtual one (e.g. .data) is loaded at the physical address
+    for (ptype,poffset,pvaddr,ppaddr,pfilesz,pmemsz,_,_) in phdrs:
+        if (ptype==ELF_PT_LOAD and ppaddr and pvaddr!=ppaddr
+                and pvaddr<=shaddr and pvaddr+pmemsz>=shaddr+shsize
+                and poffset<=shoffset and poffset+pfilesz>=shoffset+shsize):
+            return shaddr+ppaddr-pvaddr
+    return shaddr
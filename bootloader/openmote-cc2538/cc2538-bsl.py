@@ -42,26 +42,28 @@ from subprocess import Popen, PIPE
 
 import sys, getopt
 import glob
+import mmap
 import time
 import tempfile
 import os
 import subprocess
 import struct
 import binascii
+import threading
 import traceback
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'common'))
+import fwimage
+import baudcache
+import flashreport
+
 try:
     import magic
     have_magic = True
 except ImportError:
     have_magic = False
 
-try:
-    from intelhex import IntelHex
-    have_hex_support = True
-except ImportError:
-    have_hex_support = False
-
 #version
 VERSION_STRING = "2.0"
 
@@ -86,8 +88,23 @@ except ImportError:
     sys.exit(1)
 
 
+# Port a worker thread of flash_ports() is programming
+_local = threading.local()
+
+# Held while asking a question, so the prompts of parallel workers do not
+# mix on stdin
+_prompt_lock = threading.Lock()
+
 def mdebug(level, message, attr='\n'):
     if QUIET >= level:
+        port = getattr(_local, 'port', None)
+        if port is not None:
+            if attr == '\r':
+                # progress lines of parallel workers would overwrite each
+                # other, their progress is reported through a callback
+                return
+            # a single write, so lines of parallel workers do not mix
+            message, attr = '%s: %s%s' % (port, message, attr), ''
         print(message, end=attr, file=sys.stderr)
 
 # Takes chip IDs (obtained via Get ID command) to human-readable names
@@ -106,9 +123,45 @@ COMMAND_RET_INVALID_CMD = 0x42
 COMMAND_RET_INVALID_ADR = 0x43
 COMMAND_RET_FLASH_FAIL = 0x44
 
+# Default options of program() and flash_ports()
+DEFAULT_CONF = {
+        'port': 'auto',
+        'baud': 500000,
+        'force_speed' : 0,
+        'address': None,
+        'force': 0,
+        'erase': 0,
+        'write': 0,
+        'verify': 0,
+        'read': 0,
+        'len': 0x80000,
+        'fname':'',
+        'ieee_address': 0,
+        'bootloader_active_high': False,
+        'bootloader_invert_lines' : False,
+        'disable-bootloader': 0,
+        'delta': 0,
+        'jobs': 8,
+        'baud_cache': baudcache.DEFAULT_PATH,
+        'report': None
+    }
+
+# Rates tried, fastest first, when conf['baud'] is 'auto'
+AUTO_BAUDS = (500000, 460800, 400000, 230400, 115200)
+
+# Default maximum number of ports flash_ports() programs at the same time
+MAX_JOBS = DEFAULT_CONF['jobs']
+
 class CmdException(Exception):
     pass
 
+class LinkError(CmdException):
+    """
+    The serial link to the target failed (timeout, corrupted data), which may
+    not happen at a lower baud rate.
+    """
+    pass
+
 class FirmwareFile(object):
     HEX_FILE_EXTENSIONS = ('hex', 'ihx', 'ihex')
 
@@ -118,8 +171,8 @@ class FirmwareFile(object):
 
         This class will try to guess the file type if python-magic is available.
 
-        If python-magic indicates a plain text file, and if IntelHex is
-        available, then the file will be treated as one of Intel HEX format.
+        If python-magic indicates a plain text file, then the file will be
+        treated as one of Intel HEX format.
 
         In all other cases, the file will be treated as a raw binary file.
 
@@ -133,6 +186,7 @@ class FirmwareFile(object):
             bytes: A bytearray with firmware contents ready to send to the device
         """
         self._crc32 = None
+        self._page_crc32s = {}
         firmware_is_hex = False
 
         if have_magic:
@@ -160,20 +214,13 @@ class FirmwareFile(object):
                        "python-magic.")
             mdebug(10, "Please see the readme for more details.")
 
-        if firmware_is_hex:
-            if have_hex_support:
-                self.bytes = bytearray(IntelHex(path).tobinarray())
-                return
-            else:
-                error_str = "Firmware is Intel Hex, but the IntelHex library " \
-                            "could not be imported.\n" \
-                            "Install IntelHex in site-packages or program " \
-                            "your device with a raw binary (.bin) file.\n" \
-                            "Please see the readme for more details."
-                raise CmdException(error_str)
-
-        with open(path, 'rb') as f:
-            self.bytes = bytearray(f.read())
+        # the image is flattened from its lowest address, gaps filled with 0xff
+        try:
+            image = fwimage.load(path, fwimage.FORMAT_IHEX if firmware_is_hex
+                                       else fwimage.FORMAT_BIN)
+        except fwimage.ImageFormatError as e:
+            raise CmdException("Invalid firmware file %s: %s" % (path, e))
+        self.bytes = image.toBinary()
 
     def crc32(self):
         """
@@ -188,9 +235,37 @@ class FirmwareFile(object):
 
         return self._crc32
 
+    def page_crc32s(self, page_size):
+        """
+        Return the crc32 checksums of the successive pages of the firmware
+        image, the last one possibly shorter than page_size.
+
+        Return:
+            A list of CRC32s, ready for comparison with the CRCs returned by
+            the ROM bootloader's COMMAND_CRC32 on each page
+        """
+        if page_size not in self._page_crc32s:
+            data = bytes(self.bytes)
+            self._page_crc32s[page_size] = [
+                binascii.crc32(data[offs:offs + page_size]) & 0xffffffff
+                for offs in range(0, len(data), page_size)]
+
+        return self._page_crc32s[page_size]
+
 class CommandInterface(object):
     ACK_BYTE = 0xCC
     NACK_BYTE = 0x33
+
+    def __init__(self, force=False, progress=None):
+        """
+        Parameters:
+            force -- Do not ask before writing a firmware which disables the
+                     boot loader backdoor.
+            progress -- Called as progress(done, total) while writing memory.
+        """
+        self.force = force
+        self.progress = progress
+
     def open(self, aport='/dev/tty.usbserial-000013FAB', abaudrate=500000):
         self.sp = serial.Serial(
             port=aport,
@@ -249,8 +324,8 @@ class CommandInterface(object):
                                                CommandInterface.NACK_BYTE):
             got += self._read(1)
             if time.time() > stop:
-                raise CmdException("Timeout waiting for ACK/NACK after '%s'"
-                                   % (info,))
+                raise LinkError("Timeout waiting for ACK/NACK after '%s'"
+                                % (info,))
 
         # Our bytearray's length is: 2 initial bytes + 2 bytes for the ACK/NACK
         # plus a possible N-4 additional (buffered) bytes
@@ -355,7 +430,7 @@ class CommandInterface(object):
         else:
             self.sendNAck()
             #TODO: retry receiving!
-            raise CmdException("Received packet checksum error")
+            raise LinkError("Received packet checksum error")
             return 0
 
     def sendSynch(self):
@@ -572,6 +647,56 @@ class CommandInterface(object):
             if self.checkLastCmd():
                 return data # self._decode_addr(ord(data[3]),ord(data[2]),ord(data[1]),ord(data[0]))
 
+    def memReadPacket(self, addr):
+        cmd = 0x2A
+        return (bytearray((8, self._calc_checks(cmd, addr, 4), cmd))
+                + bytearray(self._encode_addr(addr))
+                + bytearray((4,))) # width, 4 bytes
+
+    def memReadPacketCC26xx(self, addr, count):
+        cmd = 0x2A
+        return (bytearray((9, self._calc_checks(cmd, addr, 1 + count), cmd))
+                + bytearray(self._encode_addr(addr))
+                + bytearray((1, count))) # width, 4 bytes; number of reads
+
+    def memReadPipelined(self, packets):
+        """
+        Send Mem Read (0x2A) command packets back to back, and yield the data
+        of their responses.
+
+        The ROM bootloader only reads the next command once the response to
+        the previous one is acknowledged, so each packet is sent in the same
+        write as that acknowledgement, rather than after it, and the status
+        is only requested once, after the last response.
+
+        Parameters:
+            packets -- An iterable of command packets, see memReadPacket().
+        """
+        ack = bytearray()
+        for packet in packets:
+            self._write(ack + packet)
+            got = self._read(2)
+            if len(got) != 2:
+                raise LinkError("Timeout waiting for the ACK to Mem Read (0x2A)")
+            if got == bytearray((0x00, CommandInterface.NACK_BYTE)):
+                raise CmdException("NACK to Mem Read (0x2A)")
+            if got != bytearray((0x00, CommandInterface.ACK_BYTE)):
+                # neither ACK nor NACK, the link garbled it
+                raise LinkError("No ACK to Mem Read (0x2A), got %r" % (bytes(got),))
+            got = self._read(2)
+            if len(got) != 2:
+                raise LinkError("Timeout waiting for the response to Mem Read (0x2A)")
+            data = self._read(got[0] - 2)
+            if len(data) != got[0] - 2 or sum(data) & 0xFF != got[1]:
+                self.sendNAck()
+                raise LinkError("Received packet checksum error")
+            ack = bytearray((0x00, CommandInterface.ACK_BYTE))
+            yield data
+        if ack:
+            self._write(ack)
+            if not self.checkLastCmd():
+                raise CmdException("Mem Read (0x2A) failed")
+
     def cmdMemReadCC26xx(self, addr):
         cmd = 0x2A
         lng = 9
@@ -608,21 +733,24 @@ class CommandInterface(object):
 
 # Complex commands section
 
-    def writeMemory(self, addr, data):
-        lng = len(data)
-        trsf_size = 248 # amount of data bytes transferred per packet (theory: max 252 + 3)
-        empty_packet = bytearray((0xFF,) * trsf_size)
-
+    def checkBootloaderEnabled(self, data):
         # Boot loader enable check
         # TODO: implement check for all chip sizes & take into account partial firmware uploads
-        if (lng == 524288): #check if file is for 512K model
+        if (len(data) == 524288): #check if file is for 512K model
             if not ((data[524247] & (1 << 4)) >> 4): #check the boot loader enable bit  (only for 512K model)
-                if not ( conf['force'] or query_yes_no("The boot loader backdoor is not enabled "\
+                if not ( self.force or query_yes_no("The boot loader backdoor is not enabled "\
                     "in the firmware you are about to write to the target. "\
                     "You will NOT be able to reprogram the target using this tool if you continue! "\
                     "Do you want to continue?","no") ):
                     raise Exception('Aborted by user.')
 
+    def writeMemory(self, addr, data):
+        lng = len(data)
+        trsf_size = 248 # amount of data bytes transferred per packet (theory: max 252 + 3)
+        empty_packet = bytearray((0xFF,) * trsf_size)
+
+        self.checkBootloaderEnabled(data)
+
         mdebug(5, "Writing %(lng)d bytes starting at address 0x%(addr)08X" %
                { 'lng': lng, 'addr': addr})
 
@@ -641,13 +769,19 @@ class CommandInterface(object):
             else:   # skipped packet, address needs to be set
                 addr_set = 0
 
+            if self.progress:
+                self.progress(offs + trsf_size, len(data))
+
             offs = offs + trsf_size
             addr = addr + trsf_size
             lng = lng - trsf_size
 
         mdebug(5, "Write %(len)d bytes at 0x%(addr)08X" % {'addr': addr, 'len': lng})
         self.cmdDownload(addr,lng)
-        return self.cmdSendData(data[offs:offs+lng]) # send last data packet
+        ret = self.cmdSendData(data[offs:offs+lng]) # send last data packet
+        if self.progress:
+            self.progress(len(data), len(data))
+        return ret
 
 class Chip(object):
     def __init__(self, command_interface):
@@ -656,12 +790,98 @@ class Chip(object):
         # Some defaults. The child can override.
         self.flash_start_addr = 0x00000000
         self.has_cmd_set_xosc = False
+        self.page_size = None # no page erase, no delta write
 
     def crc(self, address, size):
         return getattr(self.command_interface, self.crc_cmd)(address, size)
 
+    def read_memory_bulk(self, addr, length, out, offset=0):
+        """
+        Read length bytes of memory starting at addr into out[offset:], e.g.
+        a preallocated bytearray or a writable mmap.
+
+        Parameters:
+            addr -- The address to start reading at, 4-byte aligned.
+            length -- A multiple of 4.
+        """
+        cmd = self.command_interface
+        done = 0
+        for (addr, size, data) in self._read_memory_chunks(addr, length):
+            out[offset + done:offset + done + size] = bytes(data)
+            done += size
+            if done % 1024 == 0 or done == length:
+                if cmd.progress:
+                    cmd.progress(done, length)
+                mdebug(5, " Read %d of %d bytes" % (done, length), '\r')
+
+    def delta_write(self, addr, firmware):
+        """
+        Write a firmware, erasing and rewriting only the flash pages whose
+        CRC32 on the target differs from that of the firmware. Adjacent
+        pages which differ are erased and written together.
+
+        Flash beyond the end of the firmware is left untouched: when the
+        last page of the firmware is rewritten, the rest of that page is read
+        back before the erase and written again after it.
+
+        Parameters:
+            addr -- The page-aligned address to write the firmware at.
+            firmware -- A FirmwareFile.
+
+        Return:
+            The number of pages rewritten.
+        """
+        cmd = self.command_interface
+        data = firmware.bytes
+        if addr % self.page_size:
+            raise CmdException("Delta write address 0x%08X is not aligned "
+                               "on a %d-byte page" % (addr, self.page_size))
+        cmd.checkBootloaderEnabled(data)
+
+        # find the runs of pages which differ
+        runs = [] # [offset, length]
+        local_crcs = firmware.page_crc32s(self.page_size)
+        for (page, local_crc) in enumerate(local_crcs):
+            offs = page * self.page_size
+            size = min(self.page_size, len(data) - offs)
+            if self.crc(addr + offs, size) == local_crc:
+                continue
+            if runs and runs[-1][0] + runs[-1][1] == offs:
+                runs[-1][1] += size
+            else:
+                runs.append([offs, size])
+        num_pages = sum((size + self.page_size - 1) // self.page_size
+                        for (offs, size) in runs)
+        mdebug(5, "%d of %d pages differ" % (num_pages, len(local_crcs)))
+
+        # erase and rewrite them
+        progress, cmd.progress = cmd.progress, None
+        try:
+            done = 0
+            for (offs, size) in runs:
+                erase_size = (size + self.page_size - 1) // self.page_size * self.page_size
+                block = bytearray(data[offs:offs + size])
+                if erase_size > size:
+                    # keep what follows the firmware in its last page
+                    last_page = erase_size - self.page_size
+                    page = bytearray(self.page_size)
+                    self.read_memory_bulk(addr + offs + last_page,
+                                          self.page_size, page)
+                    block += page[size - last_page:]
+                if not cmd.cmdEraseMemory(addr + offs, erase_size):
+                    raise CmdException("Erase of 0x%08X failed" % (addr + offs))
+                if not cmd.writeMemory(addr + offs, block):
+                    raise CmdException("Write at 0x%08X failed" % (addr + offs))
+                done += size
+                if progress:
+                    progress(done, sum(size for (_, size) in runs))
+        finally:
+            cmd.progress = progress
+
+        return num_pages
+
     def disable_bootloader(self):
-        if not (conf['force'] or query_yes_no("Disabling the bootloader will prevent you from "\
+        if not (self.command_interface.force or query_yes_no("Disabling the bootloader will prevent you from "\
                             "using this script until you re-enable the bootloader "\
                             "using JTAG. Do you want to continue?", "no")):
             raise Exception('Aborted by user.')
@@ -671,7 +891,7 @@ class Chip(object):
         else:
             pattern = [ord(b) for b in struct.pack('<L', self.bootloader_dis_val)]
 
-        if cmd.writeMemory(self.bootloader_address, pattern):
+        if self.command_interface.writeMemory(self.bootloader_address, pattern):
             mdebug(5, "    Set bootloader closed done                      ")
         else:
             raise CmdException("Set bootloader closed failed             ")
@@ -682,6 +902,7 @@ class CC2538(Chip):
         self.flash_start_addr = 0x00200000
         self.addr_ieee_address_secondary = 0x0027ffcc
         self.has_cmd_set_xosc = True
+        self.page_size = 2048
         self.bootloader_dis_val = 0xefffffff
         self.crc_cmd = "cmdCRC32"
 
@@ -719,6 +940,13 @@ class CC2538(Chip):
         data = self.command_interface.cmdMemRead(addr)
         return bytearray([data[x] for x in range(3, -1, -1)])
 
+    def _read_memory_chunks(self, addr, length):
+        # one 4-byte word per command
+        cmd = self.command_interface
+        packets = (cmd.memReadPacket(a) for a in range(addr, addr + length, 4))
+        for (i, data) in enumerate(cmd.memReadPipelined(packets)):
+            yield (addr + i * 4, 4, data[3::-1])
+
 class CC26xx(Chip):
     # Class constants
     MISC_CONF_1 = 0x500010A0
@@ -830,6 +1058,15 @@ class CC26xx(Chip):
         # they are stored on the device
         return self.command_interface.cmdMemReadCC26xx(addr)
 
+    def _read_memory_chunks(self, addr, length):
+        # up to 63 4-byte words per command
+        cmd = self.command_interface
+        chunks = [(a, min(63 * 4, addr + length - a))
+                  for a in range(addr, addr + length, 63 * 4)]
+        packets = (cmd.memReadPacketCC26xx(a, size // 4) for (a, size) in chunks)
+        for (i, data) in enumerate(cmd.memReadPipelined(packets)):
+            yield chunks[i] + (data,)
+
 def query_yes_no(question, default="yes"):
     valid = {"yes":True,   "y":True,  "ye":True,
              "no":False,     "n":False}
@@ -842,19 +1079,25 @@ def query_yes_no(question, default="yes"):
     else:
         raise ValueError("invalid default answer: '%s'" % default)
 
-    while True:
-        sys.stdout.write(question + prompt)
-        if PY3:
-            choice = input().lower()
-        else:
-            choice = raw_input().lower()
-        if default is not None and choice == '':
-            return valid[default]
-        elif choice in valid:
-            return valid[choice]
-        else:
-            sys.stdout.write("Please respond with 'yes' or 'no' "\
-                             "(or 'y' or 'n').\n")
+    port = getattr(_local, 'port', None)
+    if port is not None:
+        question = '%s: %s' % (port, question)
+
+    with _prompt_lock:
+        while True:
+            sys.stdout.write(question + prompt)
+            sys.stdout.flush()
+            if PY3:
+                choice = input().lower()
+            else:
+                choice = raw_input().lower()
+            if default is not None and choice == '':
+                return valid[default]
+            elif choice in valid:
+                return valid[choice]
+            else:
+                sys.stdout.write("Please respond with 'yes' or 'no' "\
+                                 "(or 'y' or 'n').\n")
 
 # Convert the entered IEEE address into an integer
 def parse_ieee_address (inaddr):
@@ -876,6 +1119,274 @@ def parse_ieee_address (inaddr):
                 raise ValueError("IEEE address contains invalid bytes")
         return addr
 
+def program(conf, filename=None, firmware=None, progress=None, report=None):
+    """
+    Run the operations selected in conf on the target connected to
+    conf['port'].
+
+    If conf['baud'] is 'auto', the operations are run at the rates of
+    AUTO_BAUDS, fastest first, until they do not fail with a LinkError. The
+    rate which worked is cached for the port's USB serial adapter in
+    conf['baud_cache'], and later calls start from it.
+
+    Parameters:
+        conf -- A dict of options, see DEFAULT_CONF. Updated with the
+                address and baud rate actually used.
+        filename -- The firmware file to write or verify, or the file to
+                    read the target's memory into.
+        firmware -- A FirmwareFile, to use instead of parsing filename.
+        progress -- Called as progress(done, total) while writing.
+        report -- A flashreport.FlashReport the duration and bytes of each
+                  phase, the retries and the baud rate are recorded in.
+
+    Raises CmdException, or Exception, on failure.
+    """
+    if report is None:
+        report = flashreport.FlashReport(conf['port'])
+
+    if conf['write'] and conf['delta']:
+        # the delta write only compares pages, check the whole image
+        conf['verify'] = 1
+
+    try:
+        if (conf['write'] or conf['verify']) and firmware is None:
+            mdebug(5, "Reading data from %s" % filename)
+            firmware = FirmwareFile(filename)
+
+        if conf['baud'] != 'auto':
+            _program(conf, filename, firmware, progress, report)
+        else:
+            def attempt(baud):
+                conf['baud'] = baud
+                try:
+                    _program(conf, filename, firmware, progress, report)
+                except LinkError as err:
+                    report.retry(err)
+                    raise
+
+            baudcache.negotiate(conf['port'], AUTO_BAUDS, attempt, LinkError,
+                                cache=baudcache.BaudCache(conf['baud_cache']),
+                                log=lambda message: mdebug(5, message + ", trying slower"))
+    except Exception as err:
+        report.done(err)
+        raise
+    report.done()
+
+def _program(conf, filename, firmware, progress, report):
+    cmd = CommandInterface(force=conf['force'], progress=progress)
+    with report.phase(flashreport.PHASE_CONNECT):
+        cmd.open(conf['port'], conf['baud'])
+    try:
+        with report.phase(flashreport.PHASE_CONNECT):
+            cmd.invoke_bootloader(conf['bootloader_active_high'], conf['bootloader_invert_lines'])
+            mdebug(5, "Opening port %(port)s, baud %(baud)d" % {'port':conf['port'],
+                                                          'baud':conf['baud']})
+            mdebug(5, "Connecting to target...")
+
+            if not cmd.sendSynch():
+                raise LinkError("Can't connect to target. Ensure boot loader is started. (no answer on synch sequence)")
+
+            # if (cmd.cmdPing() != 1):
+            #     raise CmdException("Can't connect to target. Ensure boot loader is started. (no answer on ping command)")
+
+            chip_id = cmd.cmdGetChipId()
+            chip_id_str = CHIP_ID_STRS.get(chip_id, None)
+
+            if chip_id_str is None:
+                mdebug(10, '    Unrecognized chip ID. Trying CC13xx/CC26xx')
+                device = CC26xx(cmd)
+            else:
+                mdebug(10, "    Target id 0x%x, %s" % (chip_id, chip_id_str))
+                device = CC2538(cmd)
+
+            # Choose a good default address unless the user specified -a
+            if conf['address'] is None:
+                conf['address'] = device.flash_start_addr
+
+            if conf['force_speed'] != 1 and device.has_cmd_set_xosc:
+                if cmd.cmdSetXOsc(): #switch to external clock source
+                    cmd.close()
+                    conf['baud'] = 1000000
+                    cmd.open(conf['port'], conf['baud'])
+                    mdebug(6, "Opening port %(port)s, baud %(baud)d" % {'port':conf['port'], 'baud':conf['baud']})
+                    mdebug(6, "Reconnecting to target at higher speed...")
+                    if (cmd.sendSynch() != 1):
+                        raise CmdException("Can't connect to target after clock source switch. (Check external crystal)")
+                else:
+                    raise CmdException("Can't switch target to external clock source. (Try forcing speed)")
+
+        if conf['delta'] and not device.page_size:
+            mdebug(5, "Delta write not supported on this target, doing a full erase and write")
+            conf['delta'] = 0
+            conf['erase'] = 1
+
+        if conf['erase'] and not conf['delta']:
+            with report.phase(flashreport.PHASE_ERASE):
+                # we only do full erase for now
+                if device.erase():
+                    mdebug(5, "    Erase done")
+                else:
+                    raise CmdException("Erase failed")
+
+        if conf['write'] and conf['delta']:
+            mdebug(5, "Writing the pages which differ, from 0x%08X" % conf['address'])
+            with report.phase(flashreport.PHASE_WRITE):
+                num_pages = device.delta_write(conf['address'], firmware)
+                report.addBytes(flashreport.PHASE_WRITE, num_pages * device.page_size)
+            report.set('delta_pages', num_pages)
+            mdebug(5, "    Delta write done, %d pages rewritten" % num_pages)
+        elif conf['write']:
+            # TODO: check if boot loader back-door is open, need to read flash size first to get address
+            with report.phase(flashreport.PHASE_WRITE, len(firmware.bytes)):
+                if cmd.writeMemory(conf['address'], firmware.bytes):
+                    mdebug(5, "    Write done                                ")
+                else:
+                    raise CmdException("Write failed                       ")
+
+        if conf['verify']:
+            mdebug(5,"Verifying by comparing CRC32 calculations.")
+
+            crc_local = firmware.crc32()
+            with report.phase(flashreport.PHASE_VERIFY, len(firmware.bytes)):
+                crc_target = device.crc(conf['address'], len(firmware.bytes)) #CRC of target will change according to length input file
+
+            if crc_local == crc_target:
+                mdebug(5, "    Verified (match: 0x%08x)" % crc_local)
+            else:
+                cmd.cmdReset()
+                # the packets were checksummed, a slower rate would not help
+                raise CmdException("NO CRC32 match: Local = 0x%x, Target = 0x%x" % (crc_local,crc_target))
+
+        if conf['ieee_address'] != 0:
+            ieee_addr = parse_ieee_address(conf['ieee_address'])
+            if PY3:
+                mdebug(5, "Setting IEEE address to %s" % (':'.join(['%02x' % b for b in struct.pack('>Q', ieee_addr)])))
+                ieee_addr_bytes = struct.pack('<Q', ieee_addr)
+            else:
+                mdebug(5, "Setting IEEE address to %s" % (':'.join(['%02x' % ord(b) for b in struct.pack('>Q', ieee_addr)])))
+                ieee_addr_bytes = [ord(b) for b in struct.pack('<Q', ieee_addr)]
+
+            if cmd.writeMemory(device.addr_ieee_address_secondary, ieee_addr_bytes):
+                mdebug(5, "    Set address done                                ")
+            else:
+                raise CmdException("Set address failed                       ")
+
+        if conf['read']:
+            length = conf['len']
+
+            # Round up to a 4-byte boundary
+            length = (length + 3) & ~0x03
+
+            mdebug(5, "Reading %s bytes starting at address 0x%x" % (length, conf['address']))
+            with open(filename, 'w+b') as f:
+                f.truncate(length)
+                if length:
+                    # stream the words straight into the mapped output file
+                    dump = mmap.mmap(f.fileno(), length)
+                    try:
+                        with report.phase('read', length):
+                            device.read_memory_bulk(conf['address'], length, dump)
+                        crc_local = binascii.crc32(dump[:]) & 0xffffffff
+                    finally:
+                        dump.close()
+                    crc_target = device.crc(conf['address'], length)
+                    if crc_local != crc_target:
+                        raise LinkError("Read corrupted, NO CRC32 match: Local = 0x%x, Target = 0x%x" % (crc_local, crc_target))
+                    mdebug(5, "    Read done, verified (match: 0x%08x)" % crc_target)
+                else:
+                    mdebug(5, "    Read done")
+
+        if conf['disable-bootloader']:
+            device.disable_bootloader()
+
+        with report.phase(flashreport.PHASE_RESET):
+            cmd.cmdReset()
+        report.set('baud', conf['baud'])
+    finally:
+        cmd.close()
+
+def flash_ports(ports, conf, filename=None, firmware=None, jobs=MAX_JOBS,
+                progress=None):
+    """
+    Run the operations selected in conf on the targets connected to several
+    ports, with a pool of at most jobs worker threads.
+
+    The firmware is parsed once and shared by all ports.
+
+    Parameters:
+        ports -- A list of serial ports.
+        conf -- A dict of options, see DEFAULT_CONF. Copied for each port.
+        filename, firmware -- As for program().
+        jobs -- The maximum number of ports programmed at the same time.
+        progress -- Called as progress(port, done, total) while writing.
+
+    Return:
+        A dict {port: {'ok': bool, 'error': str or None, 'duration': float,
+                       'report': dict}}, the report being the phase timings
+        of the port, see flashreport.FlashReport.toDict().
+    """
+    if conf['read']:
+        raise CmdException("Reading is only supported on a single port")
+
+    if (conf['write'] or conf['verify']) and firmware is None:
+        mdebug(5, "Reading data from %s" % filename)
+        firmware = FirmwareFile(filename)
+
+    todo = list(reversed(ports))
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not todo:
+                    return
+                port = todo.pop()
+            _local.port = port
+            if progress is None:
+                port_progress = None
+            else:
+                port_progress = lambda done, total: progress(port, done, total)
+            report = flashreport.FlashReport(port, 'cc2538')
+            try:
+                program(dict(conf, port=port), filename, firmware, port_progress,
+                        report)
+            except Exception as err:
+                mdebug(0, "ERROR: %s" % str(err))
+            result = report.toDict()
+            result = {'ok': result['ok'], 'error': result['error'],
+                      'duration': result['duration'], 'report': result}
+            with lock:
+                results[port] = result
+
+    workers = [threading.Thread(target=worker, name='cc2538-bsl-%d' % i)
+               for i in range(min(jobs, len(ports)))]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for t in workers:
+        t.join()
+    return results
+
+class ProgressPrinter(object):
+    """
+    Progress callback for flash_ports(), printing the progress of each port
+    in steps of step percent.
+    """
+    def __init__(self, step=10):
+        self.step = step
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, port, done, total):
+        percent = min(100, 100 * done // total) if total else 100
+        percent -= percent % self.step
+        with self.lock:
+            if self.last.get(port) == percent:
+                return
+            self.last[port] = percent
+        mdebug(5, "Write %d%%" % percent)
+
 def print_version():
     # Get the version using "git describe".
     try:
@@ -890,7 +1401,7 @@ def print_version():
     print('%s %s' % (sys.argv[0], version))
 
 def usage():
-    print("""Usage: %s [-DhqVfewvr] [-l length] [-p port] [-b baud] [-a addr] [-i addr] [--bootloader-active-high] [--bootloader-invert-lines] [file.bin]
+    print("""Usage: %s [-DhqVfewvdr] [-l length] [-p port[,port...]] [-j jobs] [-b baud] [-a addr] [-i addr] [--bootloader-active-high] [--bootloader-invert-lines] [--report file] [file.bin]
     -h, --help               This help
     -q                       Quiet
     -V                       Verbose
@@ -898,47 +1409,42 @@ def usage():
     -e                       Erase (full)
     -w                       Write
     -v                       Verify (CRC32 check)
+    -d, --delta              With -w, only erase and write the flash pages which
+                             differ from the firmware (implies -v)
     -r                       Read
     -l length                Length of read
-    -p port                  Serial port (default: first USB-like port in /dev)
-    -b baud                  Baud speed (default: 500000)
+    -p port                  Serial port (default: first USB-like port in /dev),
+                             or comma-separated ports to program in parallel
+    -j, --jobs n             Maximum number of ports programmed at the same
+                             time (default: 8)
+    -b baud                  Baud speed (default: 500000), or 'auto' to use the
+                             fastest one that works, cached per USB serial
+                             adapter in %s
     -a addr                  Target address
     -i, --ieee-address addr  Set the secondary 64 bit IEEE address
     --bootloader-active-high Use active high signals to enter bootloader
     --bootloader-invert-lines Inverts the use of RTS and DTR to enter bootloader
     -D, --disable-bootloader After finishing, disable the bootloader
+    --report file            Write the duration, bytes and retries of each
+                             phase (connect, erase, write, verify, reset) of
+                             each port to file, as JSON
     --version                Print script version
 
 Examples:
     ./%s -e -w -v example/main.bin
     ./%s -e -w -v --ieee-address 00:12:4b:aa:bb:cc:dd:ee example/main.bin
+    ./%s -e -w -v -p /dev/ttyUSB0,/dev/ttyUSB1 example/main.bin
 
-    """ % (sys.argv[0],sys.argv[0],sys.argv[0]))
+    """ % (sys.argv[0],baudcache.DEFAULT_PATH,sys.argv[0],sys.argv[0],sys.argv[0]))
 
 if __name__ == "__main__":
 
-    conf = {
-            'port': 'auto',
-            'baud': 500000,
-            'force_speed' : 0,
-            'address': None,
-            'force': 0,
-            'erase': 0,
-            'write': 0,
-            'verify': 0,
-            'read': 0,
-            'len': 0x80000,
-            'fname':'',
-            'ieee_address': 0,
-            'bootloader_active_high': False,
-            'bootloader_invert_lines' : False,
-            'disable-bootloader': 0
-        }
+    conf = dict(DEFAULT_CONF)
 
 # http://www.python.org/doc/2.5.2/lib/module-getopt.html
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "DhqVfewvrp:b:a:l:i:", ['help', 'ieee-address=', 'disable-bootloader', 'bootloader-active-high', 'bootloader-invert-lines', 'version'])
+        opts, args = getopt.getopt(sys.argv[1:], "DhqVfewvdrp:b:a:l:i:j:", ['help', 'jobs=', 'delta', 'ieee-address=', 'disable-bootloader', 'bootloader-active-high', 'bootloader-invert-lines', 'report=', 'version'])
     except getopt.GetoptError as err:
         # print help information and exit:
         print(str(err)) # will print something like "option -a not recognized"
@@ -961,12 +1467,17 @@ if __name__ == "__main__":
             conf['write'] = 1
         elif o == '-v':
             conf['verify'] = 1
+        elif o == '-d' or o == '--delta':
+            conf['delta'] = 1
         elif o == '-r':
             conf['read'] = 1
         elif o == '-p':
             conf['port'] = a
+        elif o == '-j' or o == '--jobs':
+            conf['jobs'] = int(a)
         elif o == '-b':
-            conf['baud'] = eval(a)
+            # an 'auto' rate is kept too, rather than switched to 1Mbps
+            conf['baud'] = a if a == 'auto' else eval(a)
             conf['force_speed'] = 1
         elif o == '-a':
             conf['address'] = eval(a)
@@ -980,6 +1491,8 @@ if __name__ == "__main__":
             conf['bootloader_invert_lines'] = True
         elif o == '-D' or o == '--disable-bootloader':
             conf['disable-bootloader'] = 1
+        elif o == '--report':
+            conf['report'] = a
         elif o == '--version':
             print_version()
             sys.exit(0)
@@ -1026,108 +1539,28 @@ if __name__ == "__main__":
             else:
                 raise Exception('No serial port found.')
 
-        cmd = CommandInterface()
-        cmd.open(conf['port'], conf['baud'])
-        cmd.invoke_bootloader(conf['bootloader_active_high'], conf['bootloader_invert_lines'])
-        mdebug(5, "Opening port %(port)s, baud %(baud)d" % {'port':conf['port'],
-                                                      'baud':conf['baud']})
-        if conf['write'] or conf['verify']:
-            mdebug(5, "Reading data from %s" % args[0])
-            firmware = FirmwareFile(args[0])
-
-        mdebug(5, "Connecting to target...")
-
-        if not cmd.sendSynch():
-            raise CmdException("Can't connect to target. Ensure boot loader is started. (no answer on synch sequence)")
-
-        # if (cmd.cmdPing() != 1):
-        #     raise CmdException("Can't connect to target. Ensure boot loader is started. (no answer on ping command)")
-
-        chip_id = cmd.cmdGetChipId()
-        chip_id_str = CHIP_ID_STRS.get(chip_id, None)
-
-        if chip_id_str is None:
-            mdebug(10, '    Unrecognized chip ID. Trying CC13xx/CC26xx')
-            device = CC26xx(cmd)
+        ports = conf['port'].split(',')
+        if len(ports) > 1:
+            results = flash_ports(ports, conf, args[0] if args else None,
+                                  jobs=conf['jobs'], progress=ProgressPrinter())
+            if conf['report']:
+                flashreport.writeReports(conf['report'],
+                                         [results[port]['report'] for port in ports])
+            for port in ports:
+                result = results[port]
+                mdebug(5, "%s: %s (%.1fs)" % (port,
+                       'OK' if result['ok'] else 'FAILED: %s' % result['error'],
+                       result['duration']))
+            if not all(r['ok'] for r in results.values()):
+                raise CmdException("%d of %d ports failed"
+                                   % (len([r for r in results.values() if not r['ok']]), len(ports)))
         else:
-            mdebug(10, "    Target id 0x%x, %s" % (chip_id, chip_id_str))
-            device = CC2538(cmd)
-
-        # Choose a good default address unless the user specified -a
-        if conf['address'] is None:
-            conf['address'] = device.flash_start_addr
-
-        if conf['force_speed'] != 1 and device.has_cmd_set_xosc:
-            if cmd.cmdSetXOsc(): #switch to external clock source
-                cmd.close()
-                conf['baud'] = 1000000
-                cmd.open(conf['port'], conf['baud'])
-                mdebug(6, "Opening port %(port)s, baud %(baud)d" % {'port':conf['port'], 'baud':conf['baud']})
-                mdebug(6, "Reconnecting to target at higher speed...")
-                if (cmd.sendSynch() != 1):
-                    raise CmdException("Can't connect to target after clock source switch. (Check external crystal)")
-            else:
-                raise CmdException("Can't switch target to external clock source. (Try forcing speed)")
-
-        if conf['erase']:
-            # we only do full erase for now
-            if device.erase():
-                mdebug(5, "    Erase done")
-            else:
-                raise CmdException("Erase failed")
-
-        if conf['write']:
-            # TODO: check if boot loader back-door is open, need to read flash size first to get address
-            if cmd.writeMemory(conf['address'], firmware.bytes):
-                mdebug(5, "    Write done                                ")
-            else:
-                raise CmdException("Write failed                       ")
-
-        if conf['verify']:
-            mdebug(5,"Verifying by comparing CRC32 calculations.")
-
-            crc_local = firmware.crc32()
-            crc_target = device.crc(conf['address'], len(firmware.bytes)) #CRC of target will change according to length input file
-
-            if crc_local == crc_target:
-                mdebug(5, "    Verified (match: 0x%08x)" % crc_local)
-            else:
-                cmd.cmdReset()
-                raise Exception("NO CRC32 match: Local = 0x%x, Target = 0x%x" % (crc_local,crc_target))
-
-        if conf['ieee_address'] != 0:
-            ieee_addr = parse_ieee_address(conf['ieee_address'])
-            if PY3:
-                mdebug(5, "Setting IEEE address to %s" % (':'.join(['%02x' % b for b in struct.pack('>Q', ieee_addr)])))
-                ieee_addr_bytes = struct.pack('<Q', ieee_addr)
-            else:
-                mdebug(5, "Setting IEEE address to %s" % (':'.join(['%02x' % ord(b) for b in struct.pack('>Q', ieee_addr)])))
-                ieee_addr_bytes = [ord(b) for b in struct.pack('<Q', ieee_addr)]
-
-            if cmd.writeMemory(device.addr_ieee_address_secondary, ieee_addr_bytes):
-                mdebug(5, "    Set address done                                ")
-            else:
-                raise CmdException("Set address failed                       ")
-
-        if conf['read']:
-            length = conf['len']
-
-            # Round up to a 4-byte boundary
-            length = (length + 3) & ~0x03
-
-            mdebug(5, "Reading %s bytes starting at address 0x%x" % (length, conf['address']))
-            with open(args[0], 'wb') as f:
-                for i in range(0, length >> 2):
-                    rdata = device.read_memory(conf['address'] + (i * 4)) #reading 4 bytes at a time
-                    mdebug(5, " 0x%x: 0x%02x%02x%02x%02x" % (conf['address'] + (i * 4), rdata[0], rdata[1], rdata[2], rdata[3]), '\r')
-                    f.write(rdata)
-                f.close()
-            mdebug(5, "    Read done                                ")
-
-        if conf['disable-bootloader']:
-            device.disable_bootloader()
-
-        cmd.cmdReset()
+            report = flashreport.FlashReport(conf['port'], 'cc2538')
+            try:
+                program(conf, args[0] if args else None, report=report)
+            finally:
+                if conf['report']:
+                    flashreport.writeReports(conf['report'], [report])
 
     except Exception as err:
         if QUIET >= 10:
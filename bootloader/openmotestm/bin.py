@@ -14,13 +14,20 @@
 # along with stm32loader; see the file COPYING3.  If not see
 # <http://www.gnu.org/licenses/>.
 
-import sys, getopt
+import sys, getopt, os
 from bootloader import CommandInterface
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import fwimage
+import flashreport
 
 # the pages that contains the code, pages 62~255 are protected by storing the 64 bits address.
-# before downloading the code, pages 0~61 should be erased first.
+# before downloading the code, the pages of 0~61 it covers are erased.
 WRPxPages  = [i for i in range( 0, 62)]
 
+# flash page size of the STM32F103 high-density line on the OpenMote-STM32
+PAGE_SIZE  = 2048
+FLASH_BASE = 0x08000000
+
 class BootLoaderJobs():
 
     chip_ids = {
@@ -35,45 +42,64 @@ class BootLoaderJobs():
         0x413: "STM32F4xx",
     }
     
-    def __init__(self,port,baund = 115200, address = 0x08000000):
-        self.port    = port
-        self.baund   = baund
-        self.address = address
-        self.cmd     = CommandInterface()
+    def __init__(self,port,baund = 115200, address = FLASH_BASE, pageSize = PAGE_SIZE):
+        self.port     = port
+        self.baund    = baund
+        self.address  = address
+        self.pageSize = pageSize
+        self.cmd      = CommandInterface()
+        self.report   = flashreport.FlashReport(port, 'openmotestm')
     
     def initialChip(self):
 
-        self.cmd.open(self.port, self.baund)
-        print "Open port" + self.port + ", baud " + str(self.baund)
-        self.cmd.initChip()
+        with self.report.phase(flashreport.PHASE_CONNECT):
+            self.cmd.open(self.port, self.baund)
+            print "Open port" + self.port + ", baud " + str(self.baund)
+            self.cmd.initChip()
+        self.report.set('baud', self.baund)
 
     # turn of debugging information
     def turnOffDebugging(self):
         self.cmd.quiet()
     
+    # the flash pages covered by len bytes at address
+    def pagesOf(self, address, length):
+        first = (address - FLASH_BASE) // self.pageSize
+        last  = (address + length - 1 - FLASH_BASE) // self.pageSize
+        pages = range(first, last + 1)
+        if set(pages) - set(WRPxPages):
+            raise ValueError("the image covers protected pages {0}".format(sorted(set(pages) - set(WRPxPages))))
+        return pages
+
     # this function will download the target file to the device at 0x8000000 and verify.
+    # a .hex or .elf file is downloaded at the address it gives instead.
     def downloadJob(self,binFile):
         status = False # True instead of success, False instead of Failed
-        print "Erasing..."
-        self.cmd.cmdEraseMemory(WRPxPages)
-        data = map(lambda c: ord(c), file(binFile, 'rb').read())
+        image = fwimage.load(binFile, base=self.address)
+        address = image.minAddress()
+        data = image.toBinary()
+        pages = self.pagesOf(address, len(data))
+        print "Erasing pages {0}-{1}...".format(pages[0], pages[-1])
+        with self.report.phase(flashreport.PHASE_ERASE, len(pages) * self.pageSize):
+            self.cmd.cmdEraseMemory(pages)
         print "Starting to write {0}KB data into flash...".format(len(data)>>10)
-        self.cmd.writeMemory(self.address, data)
+        with self.report.phase(flashreport.PHASE_WRITE, len(data)):
+            self.cmd.writeMemory(address, data)
         print "Writing complete."
         print "Verifying the data..."
-        verify = self.cmd.readMemory(self.address, len(data))
-        if(data == verify):
+        with self.report.phase(flashreport.PHASE_VERIFY, len(data)):
+            verify = self.cmd.readMemory(address, len(data))
+        mismatches = fwimage.mismatches(address, data, verify)
+        if not mismatches:
             print "The data is OK."
             print "Download on port " + self.port + " successfully!"
             status = True
         else:
             print "Verifying failded."
-            print str(len(data)) + ' vs ' + str(len(verify))
-            for i in xrange(0, len(data)):
-                if data[i] != verify[i]:
-                    print hex(i) + ': ' + hex(data[i]) + ' vs ' + hex(verify[i])
+            for (start, end) in mismatches:
+                print "0x{0:x}-0x{1:x}: {2} bytes differ".format(start, end - 1, end - start)
         return status
-        
+
     def getChipInformation(self):
         bootversion = self.cmd.cmdGet()
         print "Bootloader version " + str(bootversion)
@@ -81,16 +107,18 @@ class BootLoaderJobs():
         print "Chip id: 0x" + str(chipId) + " " + self.chip_ids.get(chipId, "Unknown")
         
     def releasePort(self):
-        self.cmd.releaseChip()
+        with self.report.phase(flashreport.PHASE_RESET):
+            self.cmd.releaseChip()
         self.cmd.sp.close()
 
 if __name__ == "__main__":
     
     serialPort = "COM6"
+    reportFile = None
     
     # get options and arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "p:h")
+        opts, args = getopt.getopt(sys.argv[1:], "p:h", ["report="])
     except getopt.GetoptError, err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
@@ -100,10 +128,13 @@ if __name__ == "__main__":
     for option,value in opts:
         if option == '-p':
             serialPort = str(value)
+        elif option == '--report':
+            reportFile = value
         elif option == '-h':
             print ""
-            print "    example: bin.py -p 'port' file.bin "
+            print "    example: bin.py -p 'port' [--report=file.json] file.bin "
             print "    Note: The 'port' represents your serial port. default value is COM6"
+            print "    --report writes the duration and bytes of each phase to a JSON file"
             sys.exit(0)
         else:
             assert False, "can't handled the option"
@@ -111,9 +142,19 @@ if __name__ == "__main__":
         
     # create an bootloader jobs object
     bljobs = BootLoaderJobs(serialPort)
-    bljobs.initialChip()
-    bljobs.downloadJob(args[0])
-    bljobs.releasePort()
+    try:
+        bljobs.initialChip()
+        if bljobs.downloadJob(args[0]):
+            bljobs.report.done()
+        else:
+            bljobs.report.done("verification failed")
+        bljobs.releasePort()
+    except Exception, err:
+        bljobs.report.done(err)
+        raise
+    finally:
+        if reportFile:
+            flashreport.writeReports(reportFile, [bljobs.report])
             
     
 
@@ -129,7 +129,7 @@ class CommandInterface(object):
             crc = N ^ 0xFF
             self.sp.write(chr(N) + chr(crc))
             self._wait_for_ask("0x11 length failed")
-            return map(lambda c: ord(c), self.sp.read(lng))
+            return bytearray(self.sp.read(lng))
         else:
             raise CmdException("ReadMemory (0x11) failed")
 
@@ -149,15 +149,15 @@ class CommandInterface(object):
             # self.mdebug( "*** Write memory command")
             self.sp.write(self._encode_addr(addr))
             self._wait_for_ask("0x31 address failed")
-            #map(lambda c: hex(ord(c)), data)
             lng = (len(data)-1) & 0xFF
             # self.mdebug( "    %s bytes to write" % [lng+1]);
-            self.sp.write(chr(lng)) # len really
-            crc = 0xFF
-            for c in data:
+            # length, data and checksum go out in one write
+            frame = bytearray([lng]) + data + bytearray(1)
+            crc = 0
+            for c in frame:
                 crc = crc ^ c
-                self.sp.write(chr(c))
-            self.sp.write(chr(crc))
+            frame[-1] = crc
+            self.sp.write(bytes(frame))
             self._wait_for_ask("0x31 programming failed")
             # self.mdebug( "    Write memory done")
         else:
@@ -166,7 +166,7 @@ class CommandInterface(object):
 
     def cmdEraseMemory(self, sectors = None):
         if self.extended_erase:
-            return self.cmdExtendedEraseMemory()
+            return self.cmdExtendedEraseMemory(sectors)
 
         if self.cmdGeneric(0x43):
             # self.mdebug( "*** Erase memory command")
@@ -190,14 +190,22 @@ class CommandInterface(object):
         else:
             raise CmdException("Erase memory (0x43) failed")
 
-    def cmdExtendedEraseMemory(self):
+    def cmdExtendedEraseMemory(self, sectors = None):
         if self.cmdGeneric(0x44):
             self.mdebug( "*** Extended Erase memory command")
-            # Global mass erase
-            self.sp.write(chr(0xFF))
-            self.sp.write(chr(0xFF))
-            # Checksum
-            self.sp.write(chr(0x00))
+            if sectors is None:
+                # Global mass erase
+                frame = bytearray([0xFF, 0xFF, 0x00])
+            else:
+                # Pages erase, count-1 then page numbers on two bytes, MSB first
+                frame = bytearray()
+                for n in [len(sectors)-1] + list(sectors):
+                    frame += bytearray([(n >> 8) & 0xFF, n & 0xFF])
+                crc = 0
+                for c in frame:
+                    crc = crc ^ c
+                frame.append(crc)
+            self.sp.write(bytes(frame))
             tmp = self.sp.timeout
             self.sp.timeout = 30
             print "Extended erase (0x44), this can take ten seconds or more"
@@ -252,31 +260,28 @@ class CommandInterface(object):
 # Complex commands section
 
     def readMemory(self, addr, lng):
-        data = []
-        
-        while lng > 256:
-            sys.stdout.write("Read {1} bytes at 0x{0:x}\r".format(addr, 256))
+        data = bytearray(lng)
+
+        for offs in xrange(0, lng, 256):
+            n = min(256, lng - offs)
+            sys.stdout.write("Read {1} bytes at 0x{0:x}\r".format(addr + offs, n))
             sys.stdout.flush()
-            data = data + self.cmdReadMemory(addr, 256)
-            addr = addr + 256
-            lng = lng - 256
-        sys.stdout.write("Read {1} bytes at 0x{0:x}\n".format(addr, 256))
-        data = data + self.cmdReadMemory(addr, lng)
+            data[offs:offs+n] = self.cmdReadMemory(addr + offs, n)
+        sys.stdout.write("\n")
         return data
 
     def writeMemory(self, addr, data):
+        data = memoryview(bytearray(data))
         lng = len(data)
-        
-        offs = 0
-        while lng > 256:
-            sys.stdout.write("Write {1} bytes at 0x{0:x}\r".format(addr, 256))
+
+        for offs in xrange(0, lng, 256):
+            chunk = bytearray(data[offs:offs+256])
+            sys.stdout.write("Write {1} bytes at 0x{0:x}\r".format(addr + offs, len(chunk)))
             sys.stdout.flush()
-            self.cmdWriteMemory(addr, data[offs:offs+256])
-            offs = offs + 256
-            addr = addr + 256
-            lng = lng - 256
-        sys.stdout.write("Write {1} bytes at 0x{0:x}\n".format(addr, 256))
-        self.cmdWriteMemory(addr, data[offs:offs+lng] + ([0xFF] * (256-lng)) )
+            # the bootloader writes a multiple of 4 bytes
+            chunk += bytearray([0xFF]) * (-len(chunk) % 4)
+            self.cmdWriteMemory(addr + offs, chunk)
+        sys.stdout.write("\n")
 
     def __init__(self) :
         pass
\ No newline at end of file
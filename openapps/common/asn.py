@@ -0,0 +1,149 @@
+'''
+Absolute Slot Number (ASN) arithmetic.
+
+The ASN is a 40-bit counter of TSCH timeslots, sent over the serial port as
+three little-endian fields (``<HHB``): bits 0-15, bits 16-31 and bits 32-39.
+:class:`Asn` holds one as a single integer. Subtracting two ASNs gives the
+number of slots between them, modulo ``2**40``, so the result is correct
+across a wraparound of the counter.
+
+The functions ending in ``Array`` do the same on NumPy arrays of ASNs, e.g.
+the columns of a :class:`measurementsink.ColumnarSink`, to process a whole
+capture at once.
+'''
+
+#============================ defines =========================================
+
+ASN_BITS                   = 40
+ASN_MODULO                 = 1<<ASN_BITS
+ASN_MASK                   = ASN_MODULO-1
+
+#============================ classes =========================================
+
+class Asn(object):
+    '''
+    A 40-bit Absolute Slot Number.
+    '''
+
+    __slots__ = ['value']
+
+    def __init__(self,value=0):
+        self.value = value&ASN_MASK
+
+    @classmethod
+    def fromFields(cls,asn_0_1,asn_2_3,asn_4):
+        '''
+        :returns: the ASN made of the three fields openserial sends.
+        '''
+        return cls(asn_0_1|(asn_2_3<<16)|(asn_4<<32))
+
+    @classmethod
+    def fromBytes(cls,buf):
+        '''
+        :param buf: the 5 bytes of an ASN, least significant first.
+        '''
+        buf = bytearray(buf)
+        return cls(sum(b<<(8*i) for (i,b) in enumerate(buf[:5])))
+
+    #======================== public ==========================================
+
+    def toFields(self):
+        return (self.value&0xffff,(self.value>>16)&0xffff,self.value>>32)
+
+    def toBytes(self):
+        return bytes(bytearray((self.value>>(8*i))&0xff for i in range(5)))
+
+    def elapsed(self,since,slotDuration):
+        '''
+        :returns: the time from ASN ``since`` to this one, in the unit of
+            ``slotDuration``.
+        '''
+        return (self-since)*slotDuration
+
+    #======================== operators =======================================
+
+    def __sub__(self,other):
+        if isinstance(other,Asn):
+            # number of slots, in [-2**39,2**39)
+            return diff(self.value,other.value)
+        return Asn(self.value-other)
+
+    def __add__(self,slots):
+        return Asn(self.value+slots)
+
+    def __int__(self):
+        return self.value
+
+    def __index__(self):
+        return self.value
+
+    def __eq__(self,other):
+        return isinstance(other,Asn) and self.value==other.value
+
+    def __ne__(self,other):
+        return not self==other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return 'Asn(0x{0:010x})'.format(self.value)
+
+#============================ functions =======================================
+
+def diff(a,b):
+    '''
+    :returns: the number of slots from ASN ``b`` to ASN ``a``, both integers.
+    '''
+    d = (a-b)&ASN_MASK
+    if d>=ASN_MODULO>>1:
+        d -= ASN_MODULO
+    return d
+
+#============================ batch ===========================================
+
+def fromFieldsArray(asn_0_1,asn_2_3,asn_4):
+    '''
+    :returns: an int64 array of ASNs, from arrays (or sequences) of the three
+        fields.
+    '''
+    import numpy # only needed for batch processing
+
+    return (
+          numpy.asarray(asn_0_1,dtype=numpy.int64)
+        | (numpy.asarray(asn_2_3,dtype=numpy.int64)<<16)
+        | (numpy.asarray(asn_4,dtype=numpy.int64)<<32)
+    )
+
+def fromBytesArray(buf,offset=0,stride=5,count=-1):
+    '''
+    Gather ASNs stored every ``stride`` bytes of ``buf`` (e.g. a fixed-size
+    record layout in a memory-mapped file) without copying them one by one.
+
+    :returns: an int64 array of ASNs.
+    '''
+    import numpy # only needed for batch processing
+
+    raw = numpy.frombuffer(buf,dtype=numpy.uint8,offset=offset)
+    if count<0:
+        count = (len(raw)-5)//stride+1
+    raw = numpy.lib.stride_tricks.as_strided(raw,shape=(count,5),strides=(stride,1))
+    return (raw.astype(numpy.int64)<<numpy.arange(0,40,8,dtype=numpy.int64)).sum(axis=1)
+
+def diffArray(a,b):
+    '''
+    :returns: the int64 array of the number of slots from ``b`` to ``a``,
+        element-wise.
+    '''
+    import numpy # only needed for batch processing
+
+    d  = (numpy.asarray(a,dtype=numpy.int64)-numpy.asarray(b,dtype=numpy.int64))&ASN_MASK
+    d -= (d>=ASN_MODULO>>1)*ASN_MODULO
+    return d
+
+def elapsedArray(a,since,slotDuration):
+    '''
+    :returns: the array of the times from ``since`` to ``a``, in the unit of
+        ``slotDuration``.
+    '''
+    return diffArray(a,since)*slotDuration
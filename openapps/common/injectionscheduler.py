@@ -0,0 +1,172 @@
+'''
+Schedule the frames a dagroot script sends to its mote.
+
+The mote only listens to its serial port right after it sent a
+``SERFRAME_MOTE2PC_REQUEST`` ('R') frame, and only has
+``SERIAL_INPUT_BUFFER_SIZE`` bytes to receive into (see
+drivers/common/openserial.h). :class:`InjectionScheduler` keeps the pending
+PC->mote frames in one deque per priority level, and on each request sends
+the most urgent ones which fit in that budget, in a single write.
+
+.. note:: openserial currently processes a single command per input window:
+   a second frame received in the same window overwrites the first. The
+   number of frames sent per request is therefore capped by
+   ``maxFramesPerRequest``, which defaults to 1; raise it once the firmware
+   queues its input.
+'''
+
+import collections
+import threading
+
+#============================ defines =========================================
+
+SERIAL_INPUT_BUFFER_SIZE       = 200
+
+# frames sent PC->mote, see drivers/common/openserial.h
+SERFRAME_PC2MOTE_SETROOT       = ord('R')
+SERFRAME_PC2MOTE_RESET         = ord('Q')
+SERFRAME_PC2MOTE_DATA          = ord('D')
+SERFRAME_PC2MOTE_TRIGGERSERIALECHO = ord('S')
+SERFRAME_PC2MOTE_COMMAND       = ord('C')
+SERFRAME_PC2MOTE_TRIGGERUSERIALBRIDGE = ord('B')
+
+# lower is more urgent
+DEFAULT_PRIORITIES             = {
+    SERFRAME_PC2MOTE_RESET:                0,
+    SERFRAME_PC2MOTE_SETROOT:              1,
+    SERFRAME_PC2MOTE_COMMAND:              2,
+    SERFRAME_PC2MOTE_DATA:                 3,
+    SERFRAME_PC2MOTE_TRIGGERUSERIALBRIDGE: 3,
+    SERFRAME_PC2MOTE_TRIGGERSERIALECHO:    4,
+}
+DEFAULT_PRIORITY               = 3
+
+#============================ classes =========================================
+
+class InjectionScheduler(object):
+    '''
+    Thread-safe queue of hdlcified PC->mote frames, drained on request.
+    '''
+
+    MAX_DEPTH                  = 1000
+
+    def __init__(self,
+            priorities            = DEFAULT_PRIORITIES,
+            maxDepth              = MAX_DEPTH,
+            inputBufferSize       = SERIAL_INPUT_BUFFER_SIZE,
+            maxFramesPerRequest   = 1,
+        ):
+
+        # store params
+        self.priorities            = dict(priorities)
+        self.maxDepth              = maxDepth
+        self.inputBufferSize       = inputBufferSize
+        self.maxFramesPerRequest   = maxFramesPerRequest
+
+        # local variables
+        self.dataLock              = threading.Lock()
+        self.queues                = {}  # priority -> deque of (frameType,frame)
+        self.depth                 = 0
+        self.maxDepthSeen          = 0
+        self.depthPerType          = collections.defaultdict(int)
+        self.numEnqueued           = collections.defaultdict(int)
+        self.numSent               = collections.defaultdict(int)
+        self.numDropped            = collections.defaultdict(int)
+        self.numRequests           = 0
+        self.numIdleRequests       = 0
+        self.numBytesSent          = 0
+
+    #======================== public ==========================================
+
+    def enqueue(self,frame):
+        '''
+        Queue an hdlcified frame, flags included.
+
+        :returns: ``True`` if queued, ``False`` if dropped because the queue
+            is full.
+        :raises ValueError: if the frame can never fit in the mote's input
+            buffer.
+        '''
+        frame     = bytes(frame)
+        frameType = bytearray(frame[1:2])[0]
+        if self._cost(frame)>self.inputBufferSize:
+            raise ValueError(
+                '{0}B frame does not fit in the {1}B input buffer'.format(len(frame),self.inputBufferSize)
+            )
+        priority  = self.priorities.get(frameType,DEFAULT_PRIORITY)
+        with self.dataLock:
+            if self.maxDepth is not None and self.depth>=self.maxDepth:
+                self.numDropped[frameType]   += 1
+                return False
+            if priority not in self.queues:
+                self.queues[priority]         = collections.deque()
+            self.queues[priority].append((frameType,frame))
+            self.depth                       += 1
+            self.maxDepthSeen                 = max(self.maxDepthSeen,self.depth)
+            self.depthPerType[frameType]     += 1
+            self.numEnqueued[frameType]      += 1
+        return True
+
+    def onRequest(self,write):
+        '''
+        Answer a ``SERFRAME_MOTE2PC_REQUEST`` frame.
+
+        :param write: called once with the concatenation of the frames to
+            send, typically the ``write`` method of the serial port. Not
+            called if there is nothing to send.
+        :returns: the number of frames sent.
+        '''
+        toSend      = []
+        budget      = self.inputBufferSize
+        with self.dataLock:
+            self.numRequests += 1
+            for priority in sorted(self.queues):
+                queue = self.queues[priority]
+                while queue and len(toSend)<self.maxFramesPerRequest:
+                    (frameType,frame) = queue[0]
+                    cost              = self._cost(frame)
+                    if cost>budget:
+                        break
+                    queue.popleft()
+                    budget           -= cost
+                    toSend           += [frame]
+                    self.depth       -= 1
+                    self.depthPerType[frameType] -= 1
+                    self.numSent[frameType]      += 1
+                if len(toSend)>=self.maxFramesPerRequest or (queue and self._cost(queue[0][1])>budget):
+                    # do not let less urgent frames overtake this one
+                    break
+            if not toSend:
+                self.numIdleRequests += 1
+                return 0
+            data               = b''.join(toSend)
+            self.numBytesSent += len(data)
+        write(data)
+        return len(toSend)
+
+    def getStats(self):
+        '''
+        :returns: a dict with the current queue depths and the counters, per
+            frame type (as a one-character string) where applicable.
+        '''
+        def byType(counters):
+            return dict((chr(k),v) for (k,v) in counters.items() if v)
+        with self.dataLock:
+            return {
+                'depth':           self.depth,
+                'maxDepth':        self.maxDepthSeen,
+                'depthPerType':    byType(self.depthPerType),
+                'numEnqueued':     byType(self.numEnqueued),
+                'numSent':         byType(self.numSent),
+                'numDropped':      byType(self.numDropped),
+                'numRequests':     self.numRequests,
+                'numIdleRequests': self.numIdleRequests,
+                'numBytesSent':    self.numBytesSent,
+            }
+
+    #======================== private =========================================
+
+    def _cost(self,frame):
+        # upper bound on the bytes the frame takes in the mote's input buffer:
+        # everything but the flags (stuffing only makes it over-estimate)
+        return len(frame)-2
@@ -0,0 +1,252 @@
+'''
+Streaming latency statistics, in constant memory.
+
+:class:`LogHistogram` is an HDR-style histogram: values are counted in
+buckets whose width doubles with every power of two, each power of two being
+split in ``2**(subBucketBits-1)`` linear sub-buckets, so any percentile is
+reported with a relative error below ``2**-(subBucketBits-1)`` however many
+values were recorded. :class:`LatencyStats` keeps one histogram per source
+mote and per latency estimate, and :class:`SummaryEmitter` periodically
+reports them.
+'''
+
+from __future__ import division
+
+import binascii
+import math
+import threading
+import time
+
+#============================ defines =========================================
+
+PERCENTILES                = [50,90,99,99.9]
+
+#============================ classes =========================================
+
+class LogHistogram(object):
+    '''
+    Log-bucketed histogram of non-negative values.
+
+    :param resolution: the smallest distinguishable value, e.g. 0.01 for
+        values in ms recorded with a 10us resolution.
+    :param highest: values above this are counted in the last bucket.
+    :param subBucketBits: 7 gives a relative error below 1%.
+    '''
+
+    def __init__(self,resolution=0.01,highest=3600000,subBucketBits=7):
+
+        # store params
+        self.resolution       = resolution
+        self.highest          = highest
+        self.subBucketBits    = subBucketBits
+
+        # local variables
+        self.subBucketCount   = 1<<subBucketBits
+        self.subBucketHalf    = self.subBucketCount>>1
+        self.numBuckets       = self._index(int(highest/resolution))+1
+        self.reset()
+
+    #======================== public ==========================================
+
+    def reset(self):
+        self.counts           = [0]*self.numBuckets
+        self.count            = 0
+        self.total            = 0.0
+        self.min              = None
+        self.max              = None
+        self.numOverflows     = 0
+        self.numUnderflows    = 0
+
+    def record(self,value):
+        if self.count==0:
+            self.min          = value
+            self.max          = value
+        elif value<self.min:
+            self.min          = value
+        elif value>self.max:
+            self.max          = value
+        self.count           += 1
+        self.total           += value
+
+        n = int(value/self.resolution)
+        if n<0:
+            self.numUnderflows += 1
+            n = 0
+        elif value>self.highest:
+            self.numOverflows  += 1
+            n = int(self.highest/self.resolution)
+        self.counts[self._index(n)] += 1
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total/self.count
+
+    def percentile(self,p):
+        '''
+        :param p: the percentile, between 0 and 100.
+        :returns: the value below which ``p`` percent of the recorded values
+            fall, or ``None`` if nothing was recorded.
+        '''
+        if not self.count:
+            return None
+        target    = max(1,int(math.ceil(p/100*self.count)))
+        seen      = 0
+        for (idx,c) in enumerate(self.counts):
+            seen += c
+            if seen>=target:
+                # clamp the middle of the bucket to the extremes seen
+                return min(max(self._value(idx),self.min),self.max)
+        return self.max
+
+    def summary(self,percentiles=PERCENTILES):
+        returnVal = {
+            'count':  self.count,
+            'min':    self.min,
+            'max':    self.max,
+            'mean':   self.mean,
+        }
+        for p in percentiles:
+            returnVal['p{0:g}'.format(p)] = self.percentile(p)
+        return returnVal
+
+    #======================== private =========================================
+
+    def _index(self,n):
+        if n<self.subBucketCount:
+            return n
+        shift = n.bit_length()-self.subBucketBits
+        return self.subBucketCount+(shift-1)*self.subBucketHalf+(n>>shift)-self.subBucketHalf
+
+    def _value(self,idx):
+        # middle of the bucket at index idx
+        if idx<self.subBucketCount:
+            return (idx+0.5)*self.resolution
+        (shift,sub) = divmod(idx-self.subBucketCount,self.subBucketHalf)
+        shift      += 1
+        low         = (sub+self.subBucketHalf)<<shift
+        return (low+(1<<shift)/2)*self.resolution
+
+class LatencyStats(object):
+    '''
+    Per-source histograms of one or more latency estimates.
+
+    :param metrics: names of the latency estimates recorded for each packet.
+    '''
+
+    def __init__(self,metrics=('asn','tick'),**histogramKwargs):
+
+        # store params
+        self.metrics          = tuple(metrics)
+        self.histogramKwargs  = histogramKwargs
+
+        # local variables
+        self.dataLock         = threading.Lock()
+        self.histograms       = {} # source -> {metric: LogHistogram}
+
+    #======================== public ==========================================
+
+    def record(self,source,**values):
+        '''
+        Record the latencies of one packet, e.g.
+        ``record(0x1234,asn=100,tick=102.4)``.
+        '''
+        with self.dataLock:
+            if source not in self.histograms:
+                self.histograms[source] = dict(
+                    (m,LogHistogram(**self.histogramKwargs)) for m in self.metrics
+                )
+            histograms = self.histograms[source]
+            for (metric,value) in values.items():
+                histograms[metric].record(value)
+
+    def summary(self):
+        '''
+        :returns: ``{source: {metric: LogHistogram.summary()}}``
+        '''
+        with self.dataLock:
+            return dict(
+                (source,dict((m,h.summary()) for (m,h) in histograms.items()))
+                for (source,histograms) in self.histograms.items()
+            )
+
+    def reset(self):
+        with self.dataLock:
+            for histograms in self.histograms.values():
+                for h in histograms.values():
+                    h.reset()
+
+    def formatSummary(self):
+        '''
+        :returns: the summary as a list of printable lines, one per source and
+            metric.
+        '''
+        lines   = []
+        fields  = ['count','min','mean','p50','p90','p99','p99.9','max']
+        lines  += ['{0:>16} {1:>5} '.format('source','')+' '.join('{0:>9}'.format(f) for f in fields)]
+        for (source,metrics) in sorted(self.summary().items()):
+            for (metric,s) in sorted(metrics.items()):
+                if not s['count']:
+                    continue
+                lines += [
+                    '{0:>16} {1:>5} '.format(formatSource(source),metric)
+                    + '{0:>9} '.format(s['count'])
+                    + ' '.join('{0:>9.3f}'.format(s[f]) for f in fields[1:])
+                ]
+        return lines
+
+class SummaryEmitter(threading.Thread):
+    '''
+    Thread calling ``emit`` with the lines of ``stats.formatSummary()`` every
+    ``period`` seconds.
+
+    :param resetAfterEmit: if ``True``, each summary covers one period only.
+    '''
+
+    def __init__(self,stats,period=60,emit=None,resetAfterEmit=False):
+
+        # store params
+        self.stats            = stats
+        self.period           = period
+        self.emit             = emit or _printLines
+        self.resetAfterEmit   = resetAfterEmit
+
+        # local variables
+        self.stopEvent        = threading.Event()
+
+        # initialize the parent class
+        threading.Thread.__init__(self)
+        self.name             = 'SummaryEmitter'
+        self.daemon           = True
+
+        # start myself
+        self.start()
+
+    def run(self):
+        while not self.stopEvent.wait(self.period):
+            self.emitNow()
+
+    def emitNow(self):
+        self.emit(self.stats.formatSummary())
+        if self.resetAfterEmit:
+            self.stats.reset()
+
+    def close(self):
+        self.stopEvent.set()
+
+#============================ helpers =========================================
+
+def formatSource(source):
+    '''
+    :returns: a printable source: an EUI-64 in hex, a 16-bit address as
+        4 hex digits.
+    '''
+    if isinstance(source,bytes):
+        return binascii.hexlify(source).decode('ascii')
+    if isinstance(source,int):
+        return '{0:04x}'.format(source)
+    return str(source)
+
+def _printLines(lines):
+    print('\n'.join([time.strftime('%Y-%m-%d %H:%M:%S')]+lines))
@@ -0,0 +1,332 @@
+'''
+Sinks the dagroot scripts write their per-packet measurements to.
+
+A sink is created with a list of ``(name,dtype)`` columns, ``dtype`` being a
+NumPy-style type string (``'i4'``, ``'u8'``, ``'f8'``...), and is passed one
+value per column to :meth:`write` for each record.
+
+:class:`ColumnarSink` buffers the records in one typed ``array.array`` per
+column and, every ``blockSize`` records, writes each column as a ``.npy``
+file::
+
+    <dirname>/<column>.<block number>.npy
+
+Records flushed before a block is full are appended to the files of that
+block, whose header is then updated, so flushing often does not multiply the
+files.
+
+The blocks can be memory-mapped with ``numpy.load(...,mmap_mode='r')``, or
+all loaded at once with :func:`loadColumns`. :class:`CsvSink` writes the same
+records as lines of text.
+'''
+
+import array
+import ast
+import glob
+import os
+import struct
+import sys
+import threading
+import time
+
+#============================ defines =========================================
+
+NPY_MAGIC              = b'\x93NUMPY\x01\x00'
+NPY_HEADER_LEN         = struct.Struct('<H')
+NPY_ALIGN              = 64
+
+# array.array typecodes, by NumPy kind
+_TYPECODES             = {
+    'i': 'bhilq',
+    'u': 'BHILQ',
+    'f': 'fd',
+}
+
+_BYTEORDER             = '<' if sys.byteorder=='little' else '>'
+
+_MAX_LENGTH_DIGITS     = 20
+
+#============================ classes =========================================
+
+class ColumnarSink(object):
+    '''
+    Buffer records in typed arrays, and write them out in blocks of ``.npy``
+    files, one per column.
+
+    :param dirname: the directory the blocks are written to, created when
+        the first block is.
+    :param columns: list of ``(name,dtype)``.
+    :param blockSize: number of records per block.
+    :param flushPeriod: if not ``None``, the buffered records are also
+        written, to the current block, when a record arrives more than
+        ``flushPeriod`` seconds after the previous write.
+    '''
+
+    BLOCK_SIZE                 = 4096
+
+    def __init__(self,dirname,columns,blockSize=BLOCK_SIZE,flushPeriod=None):
+
+        # store params
+        self.dirname           = dirname
+        self.columns           = list(columns)
+        self.blockSize         = blockSize
+        self.flushPeriod       = flushPeriod
+
+        # local variables
+        self.dataLock          = threading.Lock()
+        self.numBlocks         = 0
+        self.numRecords        = 0
+        self.blockRecords      = 0 # records already written to the current block
+        self.lastFlush         = time.time()
+        self._newBlock()
+
+    #======================== public ==========================================
+
+    def write(self,*values):
+        '''
+        Append a record, one value per column, in the order of ``columns``.
+        '''
+        with self.dataLock:
+            for (buf,value) in zip(self.buffers,values):
+                buf.append(value)
+            self.numRecords += 1
+            if self.blockRecords+len(self.buffers[0])>=self.blockSize or (
+                    self.flushPeriod is not None and time.time()-self.lastFlush>=self.flushPeriod
+                ):
+                self._writeBlock()
+
+    def flush(self):
+        '''
+        Write the records buffered so far to the current (partial) block.
+        '''
+        with self.dataLock:
+            self._writeBlock()
+
+    def close(self):
+        self.flush()
+
+    #======================== private =========================================
+
+    def _newBlock(self):
+        self.buffers           = [_newArray(dtype) for (_,dtype) in self.columns]
+
+    def _writeBlock(self):
+        self.lastFlush         = time.time()
+        if not len(self.buffers[0]):
+            return
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        numRecords             = self.blockRecords+len(self.buffers[0])
+        for ((name,dtype),buf) in zip(self.columns,self.buffers):
+            filename = os.path.join(self.dirname,'{0}.{1:05d}.npy'.format(name,self.numBlocks))
+            if not self.blockRecords:
+                # write under a temporary name, so a reader never sees half a
+                # block
+                with open(filename+'.tmp','wb') as f:
+                    f.write(_npyHeader(dtype,numRecords))
+                    buf.tofile(f)
+                os.rename(filename+'.tmp',filename)
+            else:
+                # append the records, then count them in the header, which
+                # keeps its size
+                with open(filename,'r+b') as f:
+                    f.seek(0,os.SEEK_END)
+                    buf.tofile(f)
+                    f.flush()
+                    f.seek(0)
+                    f.write(_npyHeader(dtype,numRecords))
+        if numRecords>=self.blockSize:
+            self.numBlocks    += 1
+            self.blockRecords  = 0
+        else:
+            self.blockRecords  = numRecords
+        self._newBlock()
+
+class CsvSink(object):
+    '''
+    Write records as comma-separated lines of text, without a header line.
+
+    :param filename: the file to write to, truncated when the first record
+        is written.
+    :param columns: list of ``(name,dtype)``, only used for their number.
+    '''
+
+    def __init__(self,filename,columns):
+
+        # store params
+        self.filename          = filename
+        self.columns           = list(columns)
+
+        # local variables
+        self.dataLock          = threading.Lock()
+        self.numRecords        = 0
+        self.file              = None
+
+    #======================== public ==========================================
+
+    def write(self,*values):
+        line = ','.join([str(v) for v in values])+'\n'
+        with self.dataLock:
+            if self.file is None:
+                self.file = open(self.filename,'w')
+            self.file.write(line)
+            self.numRecords += 1
+
+    def flush(self):
+        with self.dataLock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        with self.dataLock:
+            if self.file:
+                self.file.close()
+
+#============================ reading =========================================
+
+def readBlock(filename):
+    '''
+    Read one ``.npy`` block without NumPy.
+
+    :returns: the content of the block, as an ``array.array`` (or an array
+        of 8-byte integers with the same interface, see :func:`_newArray`).
+    '''
+    with open(filename,'rb') as f:
+        if f.read(len(NPY_MAGIC))!=NPY_MAGIC:
+            raise ValueError('{0} is not a version 1.0 .npy file'.format(filename))
+        (headerLen,) = NPY_HEADER_LEN.unpack(f.read(NPY_HEADER_LEN.size))
+        header       = ast.literal_eval(f.read(headerLen).decode('latin1'))
+        (length,)    = header['shape']
+        buf          = _newArray(header['descr'][1:])
+        buf.fromfile(f,length)
+    if header['descr'][0] not in (_BYTEORDER,'|'):
+        buf.byteswap()
+    return buf
+
+def blockFiles(dirname,name):
+    '''
+    :returns: the files holding the blocks of column ``name``, in order.
+    '''
+    # by block number, which outgrows the width of the file names
+    returnVal = []
+    for filename in glob.glob(os.path.join(dirname,'{0}.*.npy'.format(name))):
+        number = os.path.basename(filename)[len(name)+1:-len('.npy')]
+        if number.isdigit():
+            returnVal += [(int(number),filename)]
+    return [filename for (_,filename) in sorted(returnVal)]
+
+def loadColumns(dirname,names=None):
+    '''
+    Load whole columns with NumPy.
+
+    :param names: the columns to load, all if ``None``.
+    :returns: a dict ``{name: numpy array}``. A column written as a single
+        block is memory-mapped rather than read.
+    '''
+    import numpy # only needed for analysis
+
+    if names is None:
+        names = sorted(set(
+            os.path.basename(f).split('.')[0]
+            for f in glob.glob(os.path.join(dirname,'*.npy'))
+        ))
+    returnVal = {}
+    for name in names:
+        blocks = [numpy.load(f,mmap_mode='r') for f in blockFiles(dirname,name)]
+        if len(blocks)==1:
+            returnVal[name] = blocks[0]
+        else:
+            returnVal[name] = numpy.concatenate(blocks)
+    return returnVal
+
+#============================ helpers =========================================
+
+def _typecode(dtype):
+    '''
+    :returns: the ``array.array`` typecode storing items of ``dtype``, or
+        ``None`` if no typecode has that kind and size.
+    '''
+    (kind,size) = (dtype[0],int(dtype[1:]))
+    for typecode in _TYPECODES.get(kind,''):
+        try:
+            if array.array(typecode).itemsize==size:
+                return typecode
+        except ValueError:
+            # 'q' and 'Q' are not available before Python 3.3
+            continue
+    return None
+
+def _newArray(dtype):
+    '''
+    :returns: an empty array of items of ``dtype``.
+    :raises ValueError: if ``dtype`` cannot be stored.
+    '''
+    typecode = _typecode(dtype)
+    if typecode is not None:
+        return array.array(typecode)
+    if dtype in ('i8','u8'):
+        # no 8-byte typecode before Python 3.3, and 'l' is 4 bytes on Windows
+        return _WideArray(signed=dtype[0]=='i')
+    raise ValueError('unsupported dtype {0}'.format(dtype))
+
+class _WideArray(object):
+    '''
+    The part of the ``array.array`` interface the sinks use, for 8-byte
+    integers stored as pairs of 4-byte halves, in the memory layout of a
+    native 8-byte integer.
+    '''
+
+    def __init__(self,signed):
+        self.signed            = signed
+        self.halves            = array.array(_typecode('u4'))
+
+    def __len__(self):
+        return len(self.halves)//2
+
+    def __getitem__(self,index):
+        if index<0:
+            index += len(self)
+        if not 0<=index<len(self):
+            raise IndexError('array index out of range')
+        (low,high) = (self.halves[2*index],self.halves[2*index+1])
+        if _BYTEORDER=='>':
+            (low,high) = (high,low)
+        value = (high<<32)|low
+        if self.signed and value>=1<<63:
+            value -= 1<<64
+        return value
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self,value):
+        value      = int(value)&0xffffffffffffffff
+        (low,high) = (value&0xffffffff,value>>32)
+        if _BYTEORDER=='>':
+            (low,high) = (high,low)
+        self.halves.append(low)
+        self.halves.append(high)
+
+    def tofile(self,f):
+        self.halves.tofile(f)
+
+    def fromfile(self,f,n):
+        self.halves.fromfile(f,2*n)
+
+    def byteswap(self):
+        # swap the bytes of each half, then the halves of each item
+        self.halves.byteswap()
+        (self.halves[0::2],self.halves[1::2]) = (self.halves[1::2],self.halves[0::2])
+
+def _npyHeader(dtype,length):
+    header    = "{{'descr': '{0}{1}', 'fortran_order': False, 'shape': ({2},), }}".format(
+        _BYTEORDER,dtype,length,
+    )
+    # leave room for any length, so the header keeps its size as records are
+    # appended to the block
+    header   += ' '*(_MAX_LENGTH_DIGITS-len(str(length)))
+    # pad with spaces so the data is aligned; the header ends with a newline
+    padding   = -(len(NPY_MAGIC)+NPY_HEADER_LEN.size+len(header)+1)%NPY_ALIGN
+    header   += ' '*padding+'\n'
+    return NPY_MAGIC+NPY_HEADER_LEN.pack(len(header))+header.encode('latin1')
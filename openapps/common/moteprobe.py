@@ -0,0 +1,190 @@
+'''
+Serial receive loop shared by the dagroot scripts of the openapps.
+
+Rather than reading one byte per ``read()`` call and running a state machine
+per byte, :class:`MoteProbe` reads everything the serial driver has buffered
+(or blocks for at most ``READ_TIMEOUT`` seconds waiting for the first byte),
+and hands the chunk to a :class:`openhdlc.HdlcDeframer`, which splits it on
+the HDLC flags in one pass. Subclasses implement :meth:`MoteProbe.handleFrame`.
+'''
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+import traceback
+
+import serial
+
+from openhdlc import OpenHdlc, HdlcDeframer
+
+#============================ helpers =========================================
+
+def readChunk(serialHandler):
+    '''
+    Read all the bytes waiting in the serial driver, or block until at least
+    one arrives (or the read timeout of the port expires).
+
+    :returns: the bytes read, possibly empty on timeout.
+    '''
+    try:
+        numWaiting = serialHandler.in_waiting
+    except AttributeError:
+        # pyserial<3.0
+        numWaiting = serialHandler.inWaiting()
+    return serialHandler.read(max(1,numWaiting))
+
+#============================ classes =========================================
+
+class NullSerial(object):
+    '''
+    Stands in for the serial port of a probe which is not connected to a mote,
+    e.g. when replaying a capture. Whatever is written to it is discarded.
+    '''
+
+    def write(self,data):
+        return len(data)
+
+class MoteProbe(threading.Thread):
+    '''
+    Thread reading HDLC frames from a mote connected over a serial port.
+
+    A probe created with ``serialport=None`` is not connected to any mote and
+    must not be started; bytes are fed to it through :meth:`processChunk`,
+    which is how :func:`serialcapture.replay` drives it.
+    '''
+
+    BAUDRATE                      = 115200
+    READ_TIMEOUT                  = 0.100 # seconds
+
+    def __init__(self,serialport=None,baudrate=BAUDRATE,capture=None):
+
+        # store params
+        self.serialport           = serialport
+        self.baudrate             = baudrate
+        self.capture              = capture
+
+        # local variables
+        self.hdlc                 = OpenHdlc()
+        self.deframer             = HdlcDeframer(errorCb=self.handleInvalidFrame)
+        if self.serialport:
+            self.serial           = None
+        else:
+            self.serial           = NullSerial()
+
+        # flag to permit exit from read loop
+        self.goOn                 = True
+
+        # initialize the parent class
+        threading.Thread.__init__(self)
+
+        # give this thread a name
+        self.name                 = 'moteProbe@{0}'.format(self.serialport or 'offline')
+
+        if self.capture:
+            self.capturePortId    = self.capture.addPort(self.name)
+
+    #======================== thread ==========================================
+
+    def run(self):
+        try:
+
+            while self.goOn:     # open serial port
+
+                self.serial = self.openSerial()
+                self.deframer.reset()
+
+                while self.goOn: # read chunks from serial port
+                    try:
+                        chunk = readChunk(self.serial)
+                    except Exception as err:
+                        print(err)
+                        time.sleep(1)
+                        break
+                    else:
+                        if self.capture:
+                            self.capture.write(self.capturePortId,chunk)
+                        self.processChunk(chunk)
+
+        except Exception:
+            traceback.print_exc()
+
+    #======================== public ==========================================
+
+    def processChunk(self,chunk):
+        '''
+        Deframe received bytes and handle the frames they complete.
+
+        :returns: the number of frames handled.
+        '''
+        frames = self.deframer.feed(chunk)
+        for frame in frames:
+            self.handleFrame(frame)
+        return len(frames)
+
+    def close(self):
+        self.goOn = False
+
+    #======================== overridable =====================================
+
+    def openSerial(self):
+        '''
+        Open the serial port. Overwrite to configure the port further.
+        '''
+        return serial.Serial(self.serialport,self.baudrate,timeout=self.READ_TIMEOUT)
+
+    def handleFrame(self,frame):
+        '''
+        Called for each correctly received frame.
+
+        :param frame: the dehdlcified frame, a bytearray.
+        '''
+        raise NotImplementedError()
+
+    def handleInvalidFrame(self,rawFrame,err):
+        '''
+        Called for each frame with an invalid CRC or length.
+        '''
+        print('{0}: invalid serial frame: {2} {1}'.format(self.name, err, rawFrame))
+
+#============================ main ============================================
+
+def runProbe(probeClass,defaultPort,description=None,onStart=None):
+    '''
+    Command line of the dagroot scripts: run a probe of class probeClass on
+    the serial port given as argument, until interrupted with Ctrl-C.
+
+    With ``--capture FILE``, the bytes received are also appended to capture
+    file FILE, which ``serialcapture.py`` can replay.
+
+    :param onStart: called with the probe once it is created, e.g. to start
+        threads sending through it.
+    '''
+    import serialcapture
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('serialport',nargs='?',default=defaultPort,
+        help='serial port of the mote (default: %(default)s)')
+    parser.add_argument('--capture',metavar='FILE',
+        help='record the bytes received into capture file FILE')
+    args   = parser.parse_args()
+
+    if args.capture:
+        capture = serialcapture.CaptureWriter(args.capture)
+    else:
+        capture = None
+    probe  = probeClass(args.serialport,capture=capture)
+    if onStart:
+        onStart(probe)
+    try:
+        # join with a timeout, so Ctrl-C interrupts the wait
+        while probe.is_alive():
+            probe.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        probe.close()
+        probe.join()
+        if capture:
+            capture.close()
@@ -0,0 +1,247 @@
+'''
+HDLC framing shared by the host-side scripts of the openapps.
+
+Frames exchanged with the openserial driver (see
+drivers/common/openserial.c) are delimited by 0x7e flags, byte-stuffed with a
+0x7d escape, and protected by the 16-bit FCS of RFC1662.
+
+This module works on bytes, bytearray and memoryview objects, and avoids a
+Python function call per byte:
+
+- the FCS is computed by ``binascii.crc_hqx`` over a bit-reversed copy of the
+  data (the RFC1662 FCS is the bit-reflected version of the CRC-CCITT computed
+  by ``crc_hqx``), which runs in C;
+- unstuffing splits the frame once on the escape byte;
+- :class:`HdlcDeframer` finds frame boundaries by splitting each received chunk
+  on the flag byte.
+'''
+
+import binascii
+
+#============================ defines =========================================
+
+HDLC_FLAG              = 0x7e
+HDLC_FLAG_ESCAPED      = 0x5e
+HDLC_ESCAPE            = 0x7d
+HDLC_ESCAPE_ESCAPED    = 0x5d
+HDLC_CRCINIT           = 0xffff
+HDLC_CRCGOOD           = 0xf0b8
+
+_FLAG                  = bytes(bytearray([HDLC_FLAG]))
+_ESCAPE                = bytes(bytearray([HDLC_ESCAPE]))
+_FLAG_STUFFED          = bytes(bytearray([HDLC_ESCAPE,HDLC_FLAG_ESCAPED]))
+_ESCAPE_STUFFED        = bytes(bytearray([HDLC_ESCAPE,HDLC_ESCAPE_ESCAPED]))
+
+# the order of the bits in each byte, reversed
+_BITREVERSE_INT        = tuple(int('{0:08b}'.format(i)[::-1],2) for i in range(256))
+_BITREVERSE            = bytes(bytearray(_BITREVERSE_INT))
+
+#============================ helpers =========================================
+
+def _toBytes(buf):
+    '''
+    Return ``buf`` as an immutable ``bytes`` object, copying only if needed.
+    '''
+    if isinstance(buf,bytes):
+        return buf
+    if isinstance(buf,memoryview):
+        return buf.tobytes()
+    return bytes(buf)
+
+def _reverse16(v):
+    return (_BITREVERSE_INT[v & 0xff]<<8) | _BITREVERSE_INT[v>>8]
+
+def crc16(buf,crc=HDLC_CRCINIT):
+    '''
+    Compute the RFC1662 FCS16 of ``buf``, without the final inversion.
+
+    :param buf: bytes, bytearray or memoryview to compute the CRC over.
+    :param crc: the CRC value to start from, which allows the CRC to be
+        computed incrementally.
+    :returns: the CRC register value, an int.
+    '''
+    reflected = binascii.crc_hqx(_toBytes(buf).translate(_BITREVERSE),_reverse16(crc))
+    return _reverse16(reflected)
+
+def unstuff(buf):
+    '''
+    Remove the HDLC byte stuffing from ``buf``.
+
+    :returns: the unstuffed content, a bytearray.
+    '''
+    parts      = _toBytes(buf).split(_ESCAPE)
+    outBuf     = bytearray(parts[0])
+    for part in parts[1:]:
+        if not part:
+            raise ValueError('dangling escape byte')
+        outBuf.append(bytearray(part[:1])[0] ^ 0x20)
+        outBuf.extend(part[1:])
+    return outBuf
+
+#============================ classes =========================================
+
+class OpenHdlc(object):
+    '''
+    Stateless HDLC encoder/decoder.
+
+    Drop-in replacement for the ``OpenHdlc`` class the dagroot scripts used to
+    carry, except that :meth:`dehdlcify` returns a ``bytearray`` rather than a
+    list of ints. Indexing it still yields ints.
+    '''
+
+    HDLC_FLAG              = _FLAG
+    HDLC_FLAG_ESCAPED      = bytes(bytearray([HDLC_FLAG_ESCAPED]))
+    HDLC_ESCAPE            = _ESCAPE
+    HDLC_ESCAPE_ESCAPED    = bytes(bytearray([HDLC_ESCAPE_ESCAPED]))
+    HDLC_CRCINIT           = HDLC_CRCINIT
+    HDLC_CRCGOOD           = HDLC_CRCGOOD
+
+    #============================ public ======================================
+
+    def hdlcify(self,inBuf):
+        '''
+        Build an hdlc frame.
+
+        :param inBuf: the payload, as bytes, bytearray or memoryview.
+        :returns: the stuffed frame, including the opening and closing flags,
+            as bytes.
+        '''
+
+        outBuf     = _toBytes(inBuf)
+
+        # calculate CRC
+        crc        = 0xffff-crc16(outBuf)
+
+        # append CRC
+        outBuf     = outBuf + bytes(bytearray([crc & 0xff,(crc & 0xff00) >> 8]))
+
+        # stuff bytes
+        outBuf     = outBuf.replace(_ESCAPE, _ESCAPE_STUFFED)
+        outBuf     = outBuf.replace(_FLAG,   _FLAG_STUFFED)
+
+        # add flags
+        return _FLAG + outBuf + _FLAG
+
+    def dehdlcify(self,inBuf):
+        '''
+        Parse an hdlc frame.
+
+        :param inBuf: the stuffed frame, with or without its flags.
+        :returns: the extracted payload, a bytearray.
+        :raises ValueError: if the frame is too short or has a wrong CRC.
+        '''
+
+        inBuf      = _toBytes(inBuf)
+
+        # remove flags
+        if inBuf[:1]==_FLAG:
+            inBuf  = inBuf[1:]
+        if inBuf[-1:]==_FLAG:
+            inBuf  = inBuf[:-1]
+
+        return self.decodeBody(inBuf)
+
+    def decodeBody(self,inBuf):
+        '''
+        Parse the content of an hdlc frame, i.e. what sits between two flags.
+
+        :returns: the extracted payload, a bytearray.
+        :raises ValueError: if the frame is too short or has a wrong CRC.
+        '''
+
+        # unstuff
+        outBuf     = unstuff(inBuf)
+
+        if len(outBuf)<2:
+            raise ValueError('packet too short')
+
+        # check CRC
+        if crc16(outBuf)!=HDLC_CRCGOOD:
+            raise ValueError('wrong CRC')
+
+        # remove CRC
+        del outBuf[-2:]
+
+        return outBuf
+
+class HdlcDeframer(object):
+    '''
+    Incremental HDLC deframer.
+
+    Bytes received from the serial port are passed to :meth:`feed` in chunks
+    of any size; complete, CRC-checked frames are returned as they become
+    available. Bytes received before the first flag are discarded, since
+    there is no way of knowing where the frame they belong to started. The
+    same happens to a frame growing beyond ``maxFrameLen`` bytes, which
+    typically means a flag was lost.
+    '''
+
+    MAX_FRAME_LEN         = 1024
+
+    def __init__(self,errorCb=None,maxFrameLen=MAX_FRAME_LEN):
+
+        # store params
+        self.errorCb          = errorCb
+        self.maxFrameLen      = maxFrameLen
+
+        # local variables
+        self.hdlc             = OpenHdlc()
+        self.inSync           = False
+        self.partial          = bytearray()
+        self.numFrames        = 0
+        self.numInvalid       = 0
+
+    #======================== public ==========================================
+
+    def feed(self,chunk):
+        '''
+        Feed received bytes into the deframer.
+
+        :param chunk: bytes, bytearray or memoryview.
+        :returns: the decoded payloads (bytearray) of the frames completed by
+            ``chunk``, as a list. Frames which fail to decode are counted in
+            ``numInvalid`` and passed to ``errorCb``, if any.
+        '''
+        returnVal = []
+        for body in self.feedRaw(chunk):
+            try:
+                frame = self.hdlc.decodeBody(body)
+            except ValueError as err:
+                self.numInvalid += 1
+                if self.errorCb:
+                    self.errorCb(_FLAG+body+_FLAG,err)
+            else:
+                self.numFrames  += 1
+                returnVal       += [frame]
+        return returnVal
+
+    def feedRaw(self,chunk):
+        '''
+        Same as :meth:`feed`, but returns the still stuffed content of the
+        frames, without the flags and unchecked.
+        '''
+        parts = _toBytes(chunk).split(_FLAG)
+
+        if not self.inSync:
+            if len(parts)==1:
+                return []
+            self.inSync  = True
+            parts        = parts[1:]
+        elif len(parts)>1 and self.partial:
+            self.partial.extend(parts[0])
+            parts[0]     = bytes(self.partial)
+            self.partial = bytearray()
+
+        # the last part is not terminated by a flag (yet)
+        self.partial.extend(parts.pop())
+        if len(self.partial)>self.maxFrameLen:
+            self.reset()
+
+        return [body for body in parts if body]
+
+    def reset(self):
+        '''
+        Drop any partially received frame and wait for the next flag.
+        '''
+        self.inSync           = False
+        self.partial          = bytearray()
@@ -0,0 +1,273 @@
+'''
+Serve several DAG roots from a single asyncio event loop.
+
+Where each :class:`moteprobe.MoteProbe` is a thread blocked on its own serial
+port, a :class:`ProbeManager` multiplexes any number of ports on one thread:
+local serial ports are watched with ``loop.add_reader()``, IoT-LAB nodes are
+reached through their TCP serial redirection (port 20000). Received bytes are
+deframed as soon as they arrive and queued per port; one dispatcher task per
+port then hands each frame to the handler registered for its type
+(``SERFRAME_MOTE2PC_*`` in drivers/common/openserial.h).
+
+This module requires Python 3.5 or later.
+'''
+
+import asyncio
+import logging
+
+from openhdlc import HdlcDeframer
+import serialframe
+
+log = logging.getLogger('probemanager')
+log.addHandler(logging.NullHandler())
+
+#============================ defines =========================================
+
+IOTLAB_SERIAL_PORT    = 20000
+
+#============================ classes =========================================
+
+class ProbePort(object):
+    '''
+    One mote connected to the :class:`ProbeManager`.
+
+    Subclasses implement :meth:`open`, :meth:`write` and :meth:`close`, and
+    call :meth:`dataReceived` with whatever bytes they receive. The port is
+    opened through :meth:`start`, from the running event loop.
+    '''
+
+    QUEUE_SIZE            = 1000
+
+    def __init__(self,name,queueSize=QUEUE_SIZE):
+
+        # store params
+        self.name             = name
+        self.queueSize        = queueSize
+
+        # local variables
+        self.deframer         = HdlcDeframer(errorCb=self._invalidFrame)
+        self.frames           = None # created by start(), in the running loop
+        self.numRxFrames      = 0
+        self.numDroppedFrames = 0
+
+    def __str__(self):
+        return self.name
+
+    #======================== public ==========================================
+
+    async def start(self):
+        # before Python 3.10, a queue is bound to the loop current when it is
+        # created, which is not necessarily the one running the manager
+        self.frames           = asyncio.Queue(maxsize=self.queueSize)
+        await self.open()
+
+    async def open(self):
+        raise NotImplementedError()
+
+    def write(self,data):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def dataReceived(self,chunk):
+        for frame in self.deframer.feed(chunk):
+            try:
+                self.frames.put_nowait(frame)
+            except asyncio.QueueFull:
+                self.numDroppedFrames += 1
+            else:
+                self.numRxFrames      += 1
+
+    #======================== private =========================================
+
+    def _invalidFrame(self,rawFrame,err):
+        log.warning('{0}: invalid serial frame: {2} {1}'.format(self.name, err, rawFrame))
+
+class SerialProbePort(ProbePort):
+    '''
+    A mote on a local serial port, read without blocking from the event loop.
+    '''
+
+    BAUDRATE              = 115200
+
+    def __init__(self,serialport,baudrate=BAUDRATE,**kwargs):
+        ProbePort.__init__(self,serialport,**kwargs)
+        self.serialport       = serialport
+        self.baudrate         = baudrate
+        self.serial           = None
+
+    async def open(self):
+        import serial # only needed for local serial ports
+        self.serial           = serial.Serial(self.serialport,self.baudrate,timeout=0)
+        asyncio.get_event_loop().add_reader(self.serial.fileno(),self._readable)
+
+    def write(self,data):
+        self.serial.write(data)
+
+    def close(self):
+        if self.serial:
+            asyncio.get_event_loop().remove_reader(self.serial.fileno())
+            self.serial.close()
+            self.serial       = None
+
+    def _readable(self):
+        try:
+            chunk = self.serial.read(max(1,self.serial.in_waiting))
+        except Exception as err:
+            log.error('{0}: {1}'.format(self.name,err))
+            self.close()
+        else:
+            self.dataReceived(chunk)
+
+class TcpProbePort(ProbePort):
+    '''
+    A mote reached over TCP, e.g. through the serial redirection of an IoT-LAB
+    node.
+    '''
+
+    READ_SIZE             = 4096
+
+    def __init__(self,host,port=IOTLAB_SERIAL_PORT,**kwargs):
+        ProbePort.__init__(self,'{0}:{1}'.format(host,port),**kwargs)
+        self.host             = host
+        self.port             = port
+        self.writer           = None
+        self.readTask         = None
+
+    async def open(self):
+        (reader,self.writer)  = await asyncio.open_connection(self.host,self.port)
+        self.readTask         = asyncio.ensure_future(self._readLoop(reader))
+
+    def write(self,data):
+        self.writer.write(data)
+
+    def close(self):
+        if self.readTask:
+            self.readTask.cancel()
+            self.readTask     = None
+        if self.writer:
+            self.writer.close()
+            self.writer       = None
+
+    async def _readLoop(self,reader):
+        while True:
+            chunk = await reader.read(self.READ_SIZE)
+            if not chunk:
+                log.error('{0}: connection closed'.format(self.name))
+                return
+            self.dataReceived(chunk)
+
+class ProbeManager(object):
+    '''
+    Dispatch the frames received on any number of :class:`ProbePort` to
+    per-frame-type handlers, from a single event loop.
+
+    A handler is called as ``handler(port,frame)``, where ``frame`` is the
+    dehdlcified frame (a bytearray) and ``port`` the :class:`ProbePort` it was
+    received on, which can be used to answer.
+    '''
+
+    FRAME_TYPES           = [
+        serialframe.SERFRAME_MOTE2PC_DATA,
+        serialframe.SERFRAME_MOTE2PC_REQUEST,
+        serialframe.SERFRAME_MOTE2PC_STATUS,
+        serialframe.SERFRAME_MOTE2PC_ERROR,
+        serialframe.SERFRAME_MOTE2PC_SNIFFED_PACKET,
+    ]
+
+    def __init__(self):
+        self.ports            = []
+        self.handlers         = {}
+        self.tasks            = []
+
+    #======================== public ==========================================
+
+    def addPort(self,port):
+        self.ports           += [port]
+        return port
+
+    def addSerialPort(self,serialport,**kwargs):
+        return self.addPort(SerialProbePort(serialport,**kwargs))
+
+    def addTcpPort(self,host,port=IOTLAB_SERIAL_PORT,**kwargs):
+        return self.addPort(TcpProbePort(host,port,**kwargs))
+
+    def setHandler(self,frameType,handler):
+        '''
+        Install the handler for a frame type.
+
+        :param frameType: the type byte, e.g. ``ord('D')``, or the
+            corresponding one-character string.
+        :param handler: callable, or ``None`` to ignore that frame type.
+        '''
+        if not isinstance(frameType,int):
+            frameType = ord(frameType)
+        if handler is None:
+            self.handlers.pop(frameType,None)
+        else:
+            self.handlers[frameType] = handler
+
+    def dispatch(self,port,frame):
+        if not frame:
+            return
+        handler = self.handlers.get(frame[0])
+        if handler:
+            handler(port,frame)
+
+    async def run(self):
+        '''
+        Open all the ports and dispatch their frames until cancelled.
+        '''
+        await asyncio.gather(*[p.start() for p in self.ports])
+        self.tasks = [asyncio.ensure_future(self._dispatchLoop(p)) for p in self.ports]
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            self.close()
+
+    def close(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks            = []
+        for p in self.ports:
+            p.close()
+
+    #======================== private =========================================
+
+    async def _dispatchLoop(self,port):
+        while True:
+            frame = await port.frames.get()
+            try:
+                self.dispatch(port,frame)
+            except Exception:
+                log.exception('{0}: error handling frame'.format(port.name))
+
+#============================ main ============================================
+
+def main():
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+
+    manager = ProbeManager()
+    for arg in sys.argv[1:]:
+        if ':' in arg:
+            (host,port) = arg.rsplit(':',1)
+            manager.addTcpPort(host,int(port))
+        else:
+            manager.addSerialPort(arg)
+
+    def printFrame(port,frame):
+        print('{0}: {1} ({2}B)'.format(port,chr(frame[0]),len(frame)))
+    for frameType in ProbeManager.FRAME_TYPES:
+        manager.setHandler(frameType,printFrame)
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(manager.run())
+    except KeyboardInterrupt:
+        manager.close()
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,220 @@
+'''
+Loss, duplicate and reorder accounting on the sequence counters of the
+packets the motes send.
+
+For each source, :class:`SequenceTracker` keeps the highest sequence number
+received and a bitmap of which of the ``window`` numbers below it were
+received. A number is only declared lost once it leaves that window, so a
+packet which arrives late but within the window counts as reordered, not as
+lost. Counters are compared modulo ``2**bits``, so wrapping around is not a
+gap.
+
+The numbers which leave the window without having been received are also
+grouped in bursts of consecutive losses, whose length distribution is
+reported by :meth:`SequenceTracker.getStats`.
+'''
+
+import collections
+import threading
+
+from latencystats import formatSource
+
+#============================ defines =========================================
+
+# status returned by SequenceTracker.record()
+SEQ_FIRST                  = 'first'
+SEQ_IN_ORDER               = 'in order'
+SEQ_GAP                    = 'gap'
+SEQ_DUPLICATE              = 'duplicate'
+SEQ_REORDERED              = 'reordered'
+SEQ_LATE                   = 'late'
+SEQ_RESYNC                 = 'resync'
+
+#============================ classes =========================================
+
+class _SourceState(object):
+
+    __slots__ = [
+        'highest','bitmap','burst','numConsecutiveLate',
+        'numReceived','numDuplicates','numReordered','numLate','numLost',
+        'numResyncs','bursts',
+    ]
+
+    def __init__(self):
+        self.highest               = None
+        self.bitmap                = 0
+        self.burst                 = 0
+        self.numConsecutiveLate    = 0
+        self.numReceived           = 0
+        self.numDuplicates         = 0
+        self.numReordered          = 0
+        self.numLate               = 0
+        self.numLost               = 0
+        self.numResyncs            = 0
+        self.bursts                = collections.defaultdict(int) # length -> count
+
+class SequenceTracker(object):
+    '''
+    Per-source tracker of sequence counters.
+
+    :param bits: the width of the counters; signed counters are fine.
+    :param window: how many numbers below the highest one received can still
+        arrive (reordered) before being declared lost.
+    :param resyncAfter: after this many consecutive packets older than the
+        window, the source is assumed to have restarted its counter, and the
+        tracking of that source starts over.
+    '''
+
+    WINDOW                     = 64
+    RESYNC_AFTER               = 8
+
+    def __init__(self,bits=16,window=WINDOW,resyncAfter=RESYNC_AFTER):
+
+        # store params
+        self.bits                  = bits
+        self.window                = window
+        self.resyncAfter           = resyncAfter
+
+        # local variables
+        self.dataLock              = threading.Lock()
+        self.modulo                = 1<<bits
+        self.windowMask            = (1<<window)-1
+        self.sources               = {}
+
+    #======================== public ==========================================
+
+    def record(self,source,seq):
+        '''
+        Account for a received packet.
+
+        :returns: a ``(status,gap)`` tuple, ``status`` being one of the
+            ``SEQ_*`` constants and ``gap`` the number of sequence numbers
+            skipped by this packet (non-zero only for ``SEQ_GAP``).
+        '''
+        seq = seq%self.modulo
+        with self.dataLock:
+            state = self.sources.get(source)
+            if state is None:
+                state = self.sources[source] = _SourceState()
+            if state.highest is None:
+                self._start(state,seq)
+                return (SEQ_FIRST,0)
+
+            diff = (seq-state.highest)%self.modulo
+            if diff>=self.modulo>>1:
+                diff -= self.modulo
+
+            if diff>0:
+                state.numConsecutiveLate   = 0
+                state.numReceived         += 1
+                self._advance(state,diff)
+                state.highest              = seq
+                if diff==1:
+                    return (SEQ_IN_ORDER,0)
+                return (SEQ_GAP,diff-1)
+
+            if diff==0:
+                state.numDuplicates       += 1
+                return (SEQ_DUPLICATE,0)
+
+            age = -diff
+            if age<self.window:
+                state.numConsecutiveLate   = 0
+                if (state.bitmap>>age)&1:
+                    state.numDuplicates   += 1
+                    return (SEQ_DUPLICATE,0)
+                state.bitmap              |= 1<<age
+                state.numReceived         += 1
+                state.numReordered        += 1
+                return (SEQ_REORDERED,0)
+
+            # older than the window: already counted as lost
+            state.numConsecutiveLate      += 1
+            if state.numConsecutiveLate>=self.resyncAfter:
+                self._advance(state,self.window)
+                self._endBurst(state)
+                state.numResyncs          += 1
+                self._start(state,seq)
+                return (SEQ_RESYNC,0)
+            state.numLate                 += 1
+            return (SEQ_LATE,0)
+
+    def getStats(self,source=None):
+        '''
+        :param source: the source to report on, or ``None`` for the sum over
+            all sources.
+        :returns: a dict of counters. ``numLost`` only includes numbers which
+            left the window, ``numPending`` those missing within it.
+            ``bursts`` maps a burst length to the number of bursts of
+            consecutive losses of that length.
+        '''
+        with self.dataLock:
+            if source is None:
+                states = list(self.sources.values())
+            else:
+                states = [self.sources[source]] if source in self.sources else []
+            returnVal = {
+                'numReceived':    0,
+                'numDuplicates':  0,
+                'numReordered':   0,
+                'numLate':        0,
+                'numLost':        0,
+                'numPending':     0,
+                'numResyncs':     0,
+                'bursts':         collections.defaultdict(int),
+            }
+            for state in states:
+                for k in ['numReceived','numDuplicates','numReordered','numLate','numLost','numResyncs']:
+                    returnVal[k] += getattr(state,k)
+                returnVal['numPending'] += self.window-bin(state.bitmap).count('1')
+                for (length,count) in state.bursts.items():
+                    returnVal['bursts'][length] += count
+            returnVal['bursts'] = dict(returnVal['bursts'])
+            return returnVal
+
+    def formatSummary(self):
+        '''
+        :returns: the counters of each source as a list of printable lines.
+        '''
+        lines  = []
+        fields = ['numReceived','numLost','numPending','numDuplicates','numReordered','numLate']
+        lines += ['{0:>16} '.format('source')+' '.join('{0:>13}'.format(f) for f in fields)+' bursts']
+        with self.dataLock:
+            sources = sorted(self.sources)
+        for source in sources:
+            stats  = self.getStats(source)
+            lines += [
+                '{0:>16} '.format(formatSource(source))
+                + ' '.join('{0:>13}'.format(stats[f]) for f in fields)
+                + ' '+' '.join('{0}:{1}'.format(l,c) for (l,c) in sorted(stats['bursts'].items()))
+            ]
+        return lines
+
+    #======================== private =========================================
+
+    def _start(self,state,seq):
+        # whatever precedes the first number received is not expected
+        state.highest              = seq
+        state.bitmap               = self.windowMask
+        state.numConsecutiveLate   = 0
+        state.numReceived         += 1
+
+    def _advance(self,state,diff):
+        # the numbers shifted out of the window, oldest first: first the
+        # oldest bits of the bitmap, then, if diff exceeds the window, the
+        # numbers skipped which never entered it
+        for i in range(self.window-1,max(self.window-diff,0)-1,-1):
+            if (state.bitmap>>i)&1:
+                self._endBurst(state)
+            else:
+                state.burst       += 1
+                state.numLost     += 1
+        if diff>self.window:
+            state.burst           += diff-self.window
+            state.numLost         += diff-self.window
+        state.bitmap               = ((state.bitmap<<diff)|1)&self.windowMask
+
+    def _endBurst(self,state):
+        if state.burst:
+            state.bursts[state.burst] += 1
+            state.burst            = 0
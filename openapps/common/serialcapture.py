@@ -0,0 +1,241 @@
+'''
+Record the raw bytes received from motes, and replay them offline.
+
+A capture file starts with an 8-byte magic, followed by records which are
+only ever appended::
+
+    kind (uint8) | timestamp (float64) | portId (uint16) | length (uint32) | data
+
+``kind`` is either ``RECORD_DATA`` (``data`` is a chunk of bytes as returned by
+the serial port) or ``RECORD_PORT`` (``data`` is the name of the port
+``portId`` refers to from then on). All fields are little-endian.
+
+:class:`CaptureReader` memory-maps a capture and returns the chunks as
+memoryviews into the map, without copying. :func:`replay` feeds a capture
+into the parsing pipeline of a :class:`moteprobe.MoteProbe` as fast as it
+goes, and reports how fast that was.
+'''
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+#============================ defines =========================================
+
+CAPTURE_MAGIC          = b'OWSNCAP\x01'
+
+RECORD_HEADER          = struct.Struct('<BdHI')
+
+RECORD_DATA            = 0
+RECORD_PORT            = 1
+
+#============================ classes =========================================
+
+class CaptureWriter(object):
+    '''
+    Append chunks of received bytes to a capture file.
+
+    One writer can be shared by several probes (threads), each identified by
+    the ``portId`` returned by :meth:`addPort`. When appending to an existing
+    capture, the ports it already names keep their ``portId``.
+    '''
+
+    def __init__(self,filename):
+
+        # store params
+        self.filename         = filename
+
+        # local variables
+        self.dataLock         = threading.Lock()
+        self.portIds          = {}
+        self.nextPortId       = 0
+        if os.path.exists(filename) and os.path.getsize(filename):
+            reader            = CaptureReader(filename)
+            try:
+                for _ in reader:
+                    pass
+            finally:
+                reader.close()
+            for (portId,name) in sorted(reader.portNames.items()):
+                self.portIds[name] = portId
+            self.nextPortId   = max(reader.portNames)+1 if reader.portNames else 0
+        self.file             = open(filename,'ab')
+        if self.file.tell()==0:
+            self.file.write(CAPTURE_MAGIC)
+
+    #======================== public ==========================================
+
+    def addPort(self,name):
+        '''
+        :returns: the ``portId`` to pass to :meth:`write` for port ``name``.
+        '''
+        with self.dataLock:
+            if name not in self.portIds:
+                self.portIds[name] = self.nextPortId
+                self.nextPortId   += 1
+                self._writeRecord(RECORD_PORT,time.time(),self.portIds[name],name.encode('utf-8'))
+            return self.portIds[name]
+
+    def write(self,portId,chunk,timestamp=None):
+        if not chunk:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        with self.dataLock:
+            self._writeRecord(RECORD_DATA,timestamp,portId,chunk)
+
+    def flush(self):
+        with self.dataLock:
+            self.file.flush()
+
+    def close(self):
+        with self.dataLock:
+            self.file.close()
+
+    #======================== private =========================================
+
+    def _writeRecord(self,kind,timestamp,portId,data):
+        self.file.write(RECORD_HEADER.pack(kind,timestamp,portId,len(data)))
+        self.file.write(data)
+
+class CaptureReader(object):
+    '''
+    Memory-mapped, read-only view of a capture file.
+    '''
+
+    def __init__(self,filename):
+
+        # store params
+        self.filename         = filename
+
+        # local variables
+        self.portNames        = {}
+        with open(filename,'rb') as f:
+            self.map          = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        if self.map[:len(CAPTURE_MAGIC)]!=CAPTURE_MAGIC:
+            self.map.close()
+            raise ValueError('{0} is not a capture file'.format(filename))
+        try:
+            self.buf          = memoryview(self.map)
+        except TypeError:
+            # Python 2 cannot take a memoryview of a mmap; slicing it copies
+            self.buf          = self.map
+
+    def __iter__(self):
+        '''
+        Iterate over the data records.
+
+        :returns: an iterator over ``(timestamp,portId,chunk)`` tuples.
+        '''
+        offset       = len(CAPTURE_MAGIC)
+        size         = len(self.map)
+        while offset+RECORD_HEADER.size<=size:
+            (kind,timestamp,portId,length) = RECORD_HEADER.unpack_from(self.map,offset)
+            offset  += RECORD_HEADER.size
+            if offset+length>size:
+                # truncated record, the capture is still being written
+                return
+            chunk    = self.buf[offset:offset+length]
+            offset  += length
+            if kind==RECORD_DATA:
+                yield (timestamp,portId,chunk)
+            elif kind==RECORD_PORT:
+                self.portNames[portId] = bytes(chunk).decode('utf-8')
+
+    def close(self):
+        self.buf              = None
+        try:
+            self.map.close()
+        except BufferError:
+            # chunks returned by the iterator are still referenced; the map
+            # is unmapped when the last of them goes away
+            pass
+
+#============================ replay ==========================================
+
+def replay(filename,probes):
+    '''
+    Feed the content of a capture file through the parsing pipeline of one or
+    more probes, as fast as possible.
+
+    :param filename: the capture file.
+    :param probes: either a single :class:`moteprobe.MoteProbe`, which then
+        receives the chunks of all ports, or a dict ``{portId: probe}``;
+        chunks of ports without a probe are skipped. The probes should not be
+        started (see :class:`moteprobe.MoteProbe`).
+    :returns: a dict of statistics, including ``framesPerSecond``.
+    '''
+    reader        = CaptureReader(filename)
+    numChunks     = 0
+    numBytes      = 0
+    numFrames     = 0
+    startTime     = time.time()
+    try:
+        for (_,portId,chunk) in reader:
+            if isinstance(probes,dict):
+                probe = probes.get(portId)
+                if probe is None:
+                    continue
+            else:
+                probe = probes
+            numChunks  += 1
+            numBytes   += len(chunk)
+            numFrames  += probe.processChunk(chunk)
+    finally:
+        reader.close()
+    duration      = time.time()-startTime
+    return {
+        'numChunks':         numChunks,
+        'numBytes':          numBytes,
+        'numFrames':         numFrames,
+        'duration':          duration,
+        'framesPerSecond':   numFrames/duration if duration else float('inf'),
+        'bytesPerSecond':    numBytes/duration  if duration else float('inf'),
+    }
+
+#============================ main ============================================
+
+def main():
+    '''
+    Replay a capture through the moteProbe of a dagroot script, e.g.::
+
+        python serialcapture.py capture.bin ../uinject/uinject_dagroot.py
+    '''
+    import sys
+
+    if len(sys.argv)!=3:
+        sys.exit('usage: {0} <capture file> <dagroot script>'.format(sys.argv[0]))
+
+    dagroot = _loadScript('dagroot',sys.argv[2])
+    # the probe class is moteProbe in most scripts, MoteProbe in the others
+    if hasattr(dagroot,'moteProbe'):
+        probeClass = dagroot.moteProbe
+    else:
+        probeClass = dagroot.MoteProbe
+    probe   = probeClass()
+    try:
+        stats = replay(sys.argv[1],probe)
+    finally:
+        # write out what the probe buffered, e.g. its measurement sinks
+        probe.close()
+    sys.stderr.write(
+        '{numFrames} frames ({numBytes} bytes) in {duration:.3f}s: '
+        '{framesPerSecond:.0f} frames/s, {bytesPerSecond:.0f} bytes/s\n'.format(**stats)
+    )
+
+def _loadScript(name,filename):
+    try:
+        import importlib.util
+    except ImportError:
+        # Python 2
+        import imp
+        return imp.load_source(name,filename)
+    spec   = importlib.util.spec_from_file_location(name,filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+if __name__=="__main__":
+    main()
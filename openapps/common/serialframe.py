@@ -0,0 +1,122 @@
+'''
+Zero-copy parsing of the frames a mote sends over its serial port.
+
+The layouts below mirror what drivers/common/openserial.c writes for a
+``SERFRAME_MOTE2PC_DATA`` frame, and what openapps/uinject/uinject.c and
+openapps/llatency/llatency.c append to their UDP payload. They are compiled
+once, and each is decoded by a single ``unpack_from`` straight out of the
+frame's buffer. The headers and trailers which carry an ASN expose it as an
+:class:`asn.Asn`, through their ``asn`` property.
+'''
+
+import collections
+import struct
+
+from asn import Asn
+
+#============================ defines =========================================
+
+# frames sent mote->PC, see drivers/common/openserial.h
+SERFRAME_MOTE2PC_DATA          = ord('D')
+SERFRAME_MOTE2PC_STATUS        = ord('S')
+SERFRAME_MOTE2PC_INFO          = ord('I')
+SERFRAME_MOTE2PC_ERROR         = ord('E')
+SERFRAME_MOTE2PC_CRITICAL      = ord('C')
+SERFRAME_MOTE2PC_REQUEST       = ord('R')
+SERFRAME_MOTE2PC_SNIFFED_PACKET= ord('P')
+
+UINJECT_MASK                   = b'uinject'
+LLATENCY_MASK                  = b'llatency'
+
+# type, source, ASN (3 fields), ticks at start of slot, ticks now
+DATA_HEADER                    = struct.Struct('<BHHHBII')
+
+# what openbridge prepends to the packet: my address, previous hop (EUI-64s)
+BRIDGE_HOPS                    = struct.Struct('<8s8s')
+
+# ASN (3 fields), counter, mask
+UINJECT_TRAILER                = struct.Struct('<HHBh{0}s'.format(len(UINJECT_MASK)))
+
+# ticks at start of slot, ticks at creation, ASN (3 fields), counter, mask
+LLATENCY_TRAILER               = struct.Struct('<IIHHBh{0}s'.format(len(LLATENCY_MASK)))
+
+class _HasAsn(object):
+
+    __slots__ = ()
+
+    @property
+    def asn(self):
+        return Asn.fromFields(self.asn_0_1,self.asn_2_3,self.asn_4)
+
+class DataHeader(_HasAsn,collections.namedtuple(
+        'DataHeader',
+        ['type','src','asn_0_1','asn_2_3','asn_4','asnTicks','timerTicks'],
+    )):
+    __slots__ = ()
+
+class UinjectTrailer(_HasAsn,collections.namedtuple(
+        'UinjectTrailer',
+        ['asn_0_1','asn_2_3','asn_4','counter','mask'],
+    )):
+    __slots__ = ()
+
+class LlatencyTrailer(_HasAsn,collections.namedtuple(
+        'LlatencyTrailer',
+        ['asnTicks','timerTicks','asn_0_1','asn_2_3','asn_4','counter','mask'],
+    )):
+    __slots__ = ()
+
+#============================ classes =========================================
+
+class SerialFrame(object):
+    '''
+    A dehdlcified frame, backed by a memoryview over the buffer it was
+    received into.
+    '''
+
+    __slots__ = ['buf']
+
+    def __init__(self,buf):
+        self.buf = memoryview(buf)
+
+    def __len__(self):
+        return len(self.buf)
+
+    #======================== public ==========================================
+
+    @property
+    def frameType(self):
+        return struct.unpack_from('<B',self.buf)[0]
+
+    def endswith(self,suffix):
+        return len(self.buf)>=len(suffix) and self.buf[len(self.buf)-len(suffix):].tobytes()==suffix
+
+    def dataHeader(self):
+        '''
+        :returns: the :class:`DataHeader` of a ``SERFRAME_MOTE2PC_DATA`` frame.
+        '''
+        return DataHeader._make(DATA_HEADER.unpack_from(self.buf))
+
+    def previousHop(self):
+        '''
+        :returns: the EUI-64 of the neighbor a bridged packet was received
+            from, which is its source in single-hop topologies.
+        '''
+        return BRIDGE_HOPS.unpack_from(self.buf,DATA_HEADER.size)[1]
+
+    def uinjectTrailer(self):
+        '''
+        :returns: the :class:`UinjectTrailer` at the end of the frame.
+        '''
+        return UinjectTrailer._make(self._unpackTail(UINJECT_TRAILER))
+
+    def llatencyTrailer(self):
+        '''
+        :returns: the :class:`LlatencyTrailer` at the end of the frame.
+        '''
+        return LlatencyTrailer._make(self._unpackTail(LLATENCY_TRAILER))
+
+    #======================== private =========================================
+
+    def _unpackTail(self,layout):
+        return layout.unpack_from(self.buf,len(self.buf)-layout.size)
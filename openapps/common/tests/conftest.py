@@ -0,0 +1,6 @@
+import sys
+
+# probemanager is asyncio based, its tests do not even parse on Python 2
+collect_ignore = []
+if sys.version_info[0]<3:
+    collect_ignore += ['test_probemanager.py']
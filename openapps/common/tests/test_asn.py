@@ -0,0 +1,45 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import struct
+
+import pytest
+
+import asn
+
+#============================ tests =================================
+
+def test_fields():
+    a = asn.Asn.fromFields(0x0201,0x0403,0x05)
+    assert int(a)==0x0504030201
+    assert a==asn.Asn.fromBytes(b'\x01\x02\x03\x04\x05')
+    assert a.toFields()==(0x0201,0x0403,0x05)
+    assert a.toBytes()==b'\x01\x02\x03\x04\x05'
+
+def test_borrow():
+    # the low field wrapped between the two ASNs
+    a = asn.Asn.fromFields(0x0002,0x0001,0)
+    b = asn.Asn.fromFields(0xfffe,0x0000,0)
+    assert a-b==4
+    assert b-a==-4
+    assert a.elapsed(b,10)==40
+
+def test_wraparound():
+    a = asn.Asn(asn.ASN_MASK)
+    assert a+3==asn.Asn(2)
+    assert asn.Asn(2)-a==3
+    assert a-asn.Asn(2)==-3
+
+def test_batch():
+    numpy   = pytest.importorskip('numpy')
+    values  = [0,0xfffe,0x10002,asn.ASN_MASK,0x0504030201]
+    fields  = numpy.array([asn.Asn(v).toFields() for v in values])
+    asns    = asn.fromFieldsArray(fields[:,0],fields[:,1],fields[:,2])
+    assert list(asns)==values
+    buf     = b''.join(asn.Asn(v).toBytes()+b'xyz' for v in values)
+    assert list(asn.fromBytesArray(buf,stride=8))==values
+    since   = numpy.array([5,0xfffc,0,2,0x0504030200])
+    assert list(asn.diffArray(asns,since))==[asn.diff(v,s) for (v,s) in zip(values,since.tolist())]
+    assert list(asn.elapsedArray(asns,since,10))==[10*asn.diff(v,s) for (v,s) in zip(values,since.tolist())]
@@ -0,0 +1,55 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import pytest
+
+import openhdlc
+import injectionscheduler
+
+#============================ helpers ===============================
+
+hdlc = openhdlc.OpenHdlc()
+
+class Sink(object):
+    def __init__(self):
+        self.writes = []
+    def write(self,data):
+        self.writes += [data]
+
+#============================ tests =================================
+
+def test_priorities():
+    scheduler = injectionscheduler.InjectionScheduler()
+    scheduler.enqueue(hdlc.hdlcify(b'Ddata1'))
+    scheduler.enqueue(hdlc.hdlcify(b'Ddata2'))
+    scheduler.enqueue(hdlc.hdlcify(b'R\x01'))
+    sink      = Sink()
+    while scheduler.onRequest(sink.write):
+        pass
+    assert [hdlc.dehdlcify(w) for w in sink.writes]==[b'R\x01',b'Ddata1',b'Ddata2']
+    stats     = scheduler.getStats()
+    assert stats['numSent']=={'D':2,'R':1}
+    assert stats['numIdleRequests']==1
+    assert stats['depth']==0
+
+def test_fill_input_buffer():
+    scheduler = injectionscheduler.InjectionScheduler(maxFramesPerRequest=10)
+    frame     = hdlc.hdlcify(b'D'+b'x'*60)
+    for _ in range(5):
+        scheduler.enqueue(frame)
+    sink      = Sink()
+    assert scheduler.onRequest(sink.write)==3
+    assert sink.writes==[frame*3]
+    assert scheduler.getStats()['depthPerType']=={'D':2}
+
+def test_bounded():
+    scheduler = injectionscheduler.InjectionScheduler(maxDepth=2)
+    frame     = hdlc.hdlcify(b'Dpoipoi')
+    assert scheduler.enqueue(frame)
+    assert scheduler.enqueue(frame)
+    assert not scheduler.enqueue(frame)
+    assert scheduler.getStats()['numDropped']=={'D':1}
+    with pytest.raises(ValueError):
+        scheduler.enqueue(hdlc.hdlcify(b'D'+b'x'*300))
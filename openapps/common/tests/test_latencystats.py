@@ -0,0 +1,45 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import random
+
+import latencystats
+
+#============================ tests =================================
+
+def test_percentiles():
+    rnd       = random.Random(42)
+    values    = [rnd.expovariate(1/50.0) for _ in range(20000)]
+    histogram = latencystats.LogHistogram()
+    for v in values:
+        histogram.record(v)
+    values.sort()
+    for p in [50,90,99,99.9]:
+        exact = values[int(len(values)*p/100)-1]
+        assert abs(histogram.percentile(p)-exact)<=0.01*exact+0.01
+    assert histogram.min==values[0]
+    assert histogram.max==values[-1]
+    assert abs(histogram.mean-sum(values)/len(values))<1e-6
+
+def test_constant_memory():
+    histogram = latencystats.LogHistogram()
+    numBuckets = len(histogram.counts)
+    for v in range(0,3600000,997):
+        histogram.record(v)
+    histogram.record(1e9)
+    assert len(histogram.counts)==numBuckets
+    assert histogram.numOverflows==1
+
+def test_per_source():
+    stats = latencystats.LatencyStats(metrics=('asn','tick'))
+    for i in range(100):
+        stats.record(b'\x00'*7+b'\x01',asn=10*i,tick=10*i+1)
+        stats.record(b'\x00'*7+b'\x02',asn=20,tick=21)
+    summary = stats.summary()
+    assert summary[b'\x00'*7+b'\x02']['asn']['p99']==20
+    assert summary[b'\x00'*7+b'\x01']['tick']['count']==100
+    lines   = stats.formatSummary()
+    assert len(lines)==5
+    assert lines[1].split()[0]=='0000000000000001'
@@ -0,0 +1,93 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import measurementsink
+
+#============================ defines ===============================
+
+COLUMNS = [('counter','i4'),('latency','f8'),('source','u8')]
+
+#============================ tests =================================
+
+def test_columnar_blocks(tmpdir):
+    dirname = str(tmpdir.join('run'))
+    sink    = measurementsink.ColumnarSink(dirname,COLUMNS,blockSize=100)
+    for i in range(250):
+        sink.write(i,i*1.5,0x14159200000000+i)
+    assert len(measurementsink.blockFiles(dirname,'counter'))==2
+    sink.close()
+    blocks  = measurementsink.blockFiles(dirname,'latency')
+    assert len(blocks)==3
+    values  = []
+    for f in blocks:
+        values += list(measurementsink.readBlock(f))
+    assert values==[i*1.5 for i in range(250)]
+    assert measurementsink.readBlock(measurementsink.blockFiles(dirname,'source')[2])[-1]==0x14159200000000+249
+    for f in blocks:
+        with open(f,'rb') as fd:
+            assert fd.read().index(b'\n')%64==63
+
+def test_numpy_load(tmpdir):
+    numpy   = __import__('pytest').importorskip('numpy')
+    dirname = str(tmpdir)
+    sink    = measurementsink.ColumnarSink(dirname,COLUMNS,blockSize=10)
+    for i in range(25):
+        sink.write(i,-i,i)
+    sink.close()
+    columns = measurementsink.loadColumns(dirname)
+    assert sorted(columns)==['counter','latency','source']
+    assert columns['counter'].dtype==numpy.int32
+    assert list(columns['latency'])==[-i for i in range(25)]
+
+def test_csv(tmpdir):
+    filename = str(tmpdir.join('run.csv'))
+    sink     = measurementsink.CsvSink(filename,COLUMNS)
+    sink.write(1,10.5,3)
+    sink.close()
+    with open(filename) as f:
+        assert f.read()=='1,10.5,3\n'
+
+def test_wide_columns(tmpdir,monkeypatch):
+    # as on Python<3.3, or with a 4-byte 'l' (Windows)
+    monkeypatch.setitem(measurementsink._TYPECODES,'i','bhi')
+    monkeypatch.setitem(measurementsink._TYPECODES,'u','BHI')
+    dirname = str(tmpdir.join('run'))
+    sink    = measurementsink.ColumnarSink(dirname,[('asn','i8'),('source','u8')])
+    assert not os.path.exists(dirname)
+    values  = [(-1,0x14159200000000),(2**40,2**64-1)]
+    for v in values:
+        sink.write(*v)
+    sink.close()
+    asn     = measurementsink.readBlock(measurementsink.blockFiles(dirname,'asn')[0])
+    source  = measurementsink.readBlock(measurementsink.blockFiles(dirname,'source')[0])
+    assert list(zip(asn,source))==values
+    monkeypatch.undo()
+    assert list(measurementsink.readBlock(measurementsink.blockFiles(dirname,'asn')[0]))==[-1,2**40]
+
+def test_flush_appends(tmpdir):
+    dirname = str(tmpdir.join('run'))
+    sink    = measurementsink.ColumnarSink(dirname,COLUMNS,blockSize=10)
+    for i in range(25):
+        sink.write(i,i*0.5,i)
+        if i%3==0:
+            sink.flush()
+    sink.close()
+    blocks  = measurementsink.blockFiles(dirname,'counter')
+    assert len(blocks)==3
+    values  = []
+    for f in blocks:
+        values += list(measurementsink.readBlock(f))
+    assert values==list(range(25))
+    assert len(measurementsink.readBlock(blocks[2]))==5
+
+def test_block_order(tmpdir):
+    dirname = str(tmpdir)
+    sink    = measurementsink.ColumnarSink(dirname,[('counter','i4')],blockSize=1)
+    sink.numBlocks = 99998
+    for i in range(3):
+        sink.write(i)
+    blocks  = measurementsink.blockFiles(dirname,'counter')
+    assert [os.path.basename(f) for f in blocks]==['counter.99998.npy','counter.99999.npy','counter.100000.npy']
+    assert [measurementsink.readBlock(f)[0] for f in blocks]==[0,1,2]
@@ -0,0 +1,102 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import binascii
+
+import pytest
+
+import openhdlc
+
+#============================ defines ===============================
+
+# frames captured from a dagroot (see uinject_dagroot.py)
+CMD_SET_DAGROOT = '7e5259bbbb00000000000001deadbeefcafedeadbeefcafedeadbeefa7d97e'
+CMD_SEND_DATA   = '7e44141592000012e63b78001180bbbb0000000000000000000000000001bbbb000000000000141592000012e63b07d007d0000ea30d706f69706f697a837e'
+
+#============================ helpers ===============================
+
+def crcIteration(crc,b):
+    # bit-by-bit reference implementation
+    for _ in range(8):
+        if (crc ^ b) & 0x01:
+            crc = (crc >> 1) ^ 0x8408
+        else:
+            crc = crc >> 1
+        b >>= 1
+    return crc
+
+def referenceCrc(buf):
+    crc = 0xffff
+    for b in bytearray(buf):
+        crc = crcIteration(crc,b)
+    return crc
+
+#============================ tests =================================
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    b'R',
+    b'\x7e\x7d\x00\xff',
+    bytes(bytearray(range(256))),
+])
+def test_crc16(payload):
+    assert openhdlc.crc16(payload)==referenceCrc(payload)
+    assert openhdlc.crc16(bytearray(payload))==referenceCrc(payload)
+    assert openhdlc.crc16(memoryview(payload))==referenceCrc(payload)
+
+def test_crc16_incremental():
+    payload = bytes(bytearray(range(100)))
+    crc     = openhdlc.crc16(payload[:30])
+    assert openhdlc.crc16(payload[30:],crc)==referenceCrc(payload)
+
+@pytest.mark.parametrize('frame', [CMD_SET_DAGROOT, CMD_SEND_DATA])
+def test_roundtrip_captured(frame):
+    hdlc  = openhdlc.OpenHdlc()
+    raw   = binascii.unhexlify(frame)
+    body  = hdlc.dehdlcify(raw)
+    assert isinstance(body,bytearray)
+    assert hdlc.hdlcify(body)==raw
+
+def test_stuffing():
+    hdlc    = openhdlc.OpenHdlc()
+    payload = b'D\x7e\x7d\x7e\x7d'
+    frame   = hdlc.hdlcify(payload)
+    assert frame.count(b'\x7e')==2
+    assert hdlc.dehdlcify(frame)==payload
+
+def test_wrong_crc():
+    hdlc  = openhdlc.OpenHdlc()
+    frame = bytearray(hdlc.hdlcify(b'Dpoipoi'))
+    frame[2] ^= 0x01
+    with pytest.raises(ValueError):
+        hdlc.dehdlcify(frame)
+
+def test_deframer_byte_by_byte():
+    hdlc     = openhdlc.OpenHdlc()
+    stream   = b'garbage'+hdlc.hdlcify(b'R')+hdlc.hdlcify(b'D\x7epoipoi')+b'\x7e\x7e'
+    deframer = openhdlc.HdlcDeframer()
+    frames   = []
+    for i in range(len(stream)):
+        frames += deframer.feed(stream[i:i+1])
+    assert frames==[b'R',b'D\x7epoipoi']
+    assert deframer.numInvalid==0
+
+def test_deframer_chunks():
+    hdlc     = openhdlc.OpenHdlc()
+    stream   = b''.join(hdlc.hdlcify(bytes(bytearray([0x44,i,0x7e]))) for i in range(50))
+    deframer = openhdlc.HdlcDeframer()
+    frames   = []
+    for i in range(0,len(stream),7):
+        frames += deframer.feed(memoryview(stream)[i:i+7])
+    assert len(frames)==50
+    assert frames[10]==b'\x44\x0a\x7e'
+
+def test_deframer_invalid():
+    errors   = []
+    deframer = openhdlc.HdlcDeframer(errorCb=lambda frame,err: errors.append(frame))
+    frames   = deframer.feed(b'\x7epoipoi\x7e'+openhdlc.OpenHdlc().hdlcify(b'R'))
+    assert frames==[b'R']
+    assert deframer.numInvalid==1
+    assert errors==[b'\x7epoipoi\x7e']
@@ -0,0 +1,84 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import socket
+import asyncio
+
+import pytest
+
+probemanager = pytest.importorskip('probemanager')
+import openhdlc
+
+#============================ tests =================================
+
+def test_tcp_ports():
+    hdlc     = openhdlc.OpenHdlc()
+    received = []
+
+    async def serve(reader,writer):
+        writer.write(hdlc.hdlcify(b'R')+hdlc.hdlcify(b'Dpoipoi')[:5])
+        await writer.drain()
+        writer.write(hdlc.hdlcify(b'Dpoipoi')[5:]+hdlc.hdlcify(b'E\x01'))
+        await writer.drain()
+        # echo what the manager answers
+        received.append(await reader.read(100))
+        writer.close()
+
+    async def scenario():
+        servers = [await asyncio.start_server(serve,'127.0.0.1',0) for _ in range(3)]
+        manager = probemanager.ProbeManager()
+        for s in servers:
+            manager.addTcpPort('127.0.0.1',s.sockets[0].getsockname()[1])
+        frames  = []
+        manager.setHandler('D',lambda port,frame: frames.append((port.name,bytes(frame))))
+        manager.setHandler('R',lambda port,frame: port.write(b'ack'))
+        task    = asyncio.ensure_future(manager.run())
+        while len(frames)<3 or len(received)<3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        for s in servers:
+            s.close()
+        return (manager,frames)
+
+    loop = asyncio.new_event_loop()
+    try:
+        (manager,frames) = loop.run_until_complete(asyncio.wait_for(scenario(),5))
+    finally:
+        loop.close()
+    assert sorted(set(name for (name,_) in frames))==sorted(p.name for p in manager.ports)
+    assert all(frame==b'Dpoipoi' for (_,frame) in frames)
+    assert received==[b'ack']*3
+    assert all(p.numRxFrames==3 for p in manager.ports)
+
+def test_ports_added_before_the_loop():
+    hdlc    = openhdlc.OpenHdlc()
+
+    async def serve(reader,writer):
+        writer.write(hdlc.hdlcify(b'Dpoipoi'))
+        await writer.drain()
+        writer.close()
+
+    # the manager and its ports are created outside the loop which runs them
+    sock    = socket.socket()
+    sock.bind(('127.0.0.1',0))
+    manager = probemanager.ProbeManager()
+    manager.addTcpPort('127.0.0.1',sock.getsockname()[1])
+    frames  = []
+    manager.setHandler('D',lambda port,frame: frames.append(bytes(frame)))
+
+    async def scenario():
+        server = await asyncio.start_server(serve,sock=sock)
+        task   = asyncio.ensure_future(manager.run())
+        while not frames:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        server.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.wait_for(scenario(),5))
+    finally:
+        loop.close()
+    assert frames==[b'Dpoipoi']
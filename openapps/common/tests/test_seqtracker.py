@@ -0,0 +1,51 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import seqtracker
+
+#============================ tests =================================
+
+def test_wraparound():
+    tracker = seqtracker.SequenceTracker(window=8)
+    for seq in range(32760,32780):
+        # the uinject counter is a signed 16-bit integer
+        status  = tracker.record('a',seq-65536 if seq>32767 else seq)
+    assert status==(seqtracker.SEQ_IN_ORDER,0)
+    stats = tracker.getStats('a')
+    assert stats['numReceived']==20
+    assert stats['numLost']==0
+
+def test_loss_bursts():
+    tracker = seqtracker.SequenceTracker(window=8)
+    received = [0,1,2,5,6,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30]
+    for seq in received:
+        tracker.record('a',seq)
+    assert tracker.record('a',31)==(seqtracker.SEQ_IN_ORDER,0)
+    stats = tracker.getStats()
+    assert stats['numLost']==5
+    assert stats['numPending']==0
+    assert stats['bursts']=={2:1,3:1}
+
+def test_reorder_and_duplicates():
+    tracker = seqtracker.SequenceTracker(window=8)
+    assert tracker.record('a',10)==(seqtracker.SEQ_FIRST,0)
+    assert tracker.record('a',13)==(seqtracker.SEQ_GAP,2)
+    assert tracker.getStats()['numPending']==2
+    assert tracker.record('a',11)==(seqtracker.SEQ_REORDERED,0)
+    assert tracker.record('a',11)==(seqtracker.SEQ_DUPLICATE,0)
+    assert tracker.record('a',13)==(seqtracker.SEQ_DUPLICATE,0)
+    assert tracker.record('a',12)==(seqtracker.SEQ_REORDERED,0)
+    assert tracker.record('a',2)==(seqtracker.SEQ_LATE,0)
+    # another source does not interfere
+    assert tracker.record('b',11)==(seqtracker.SEQ_FIRST,0)
+    stats = tracker.getStats()
+    assert (stats['numReceived'],stats['numDuplicates'],stats['numReordered'],stats['numLost'],stats['numPending'])==(5,2,2,0,0)
+
+def test_resync():
+    tracker = seqtracker.SequenceTracker(window=8,resyncAfter=3)
+    for seq in range(100,120):
+        tracker.record('a',seq)
+    statuses = [tracker.record('a',seq)[0] for seq in range(0,4)]
+    assert statuses==[seqtracker.SEQ_LATE]*2+[seqtracker.SEQ_RESYNC,seqtracker.SEQ_IN_ORDER]
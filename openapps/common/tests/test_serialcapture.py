@@ -0,0 +1,78 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import openhdlc
+import serialcapture
+
+#============================ helpers ===============================
+
+class CountingProbe(object):
+    # what replay() needs from a moteprobe.MoteProbe
+    def __init__(self):
+        self.deframer = openhdlc.HdlcDeframer()
+        self.frames   = []
+    def processChunk(self,chunk):
+        frames        = self.deframer.feed(chunk)
+        self.frames  += [bytes(f) for f in frames]
+        return len(frames)
+
+#============================ tests =================================
+
+def test_write_read(tmpdir):
+    filename = str(tmpdir.join('capture.bin'))
+    writer   = serialcapture.CaptureWriter(filename)
+    portA    = writer.addPort('COM1')
+    portB    = writer.addPort('COM2')
+    writer.write(portA,b'abc',timestamp=1.0)
+    writer.write(portB,bytearray(b'de'),timestamp=2.0)
+    writer.close()
+
+    # append to an existing capture
+    writer   = serialcapture.CaptureWriter(filename)
+    writer.write(portA,b'f',timestamp=3.0)
+    writer.close()
+
+    reader   = serialcapture.CaptureReader(filename)
+    records  = [(t,p,bytes(c)) for (t,p,c) in reader]
+    assert records==[(1.0,portA,b'abc'),(2.0,portB,b'de'),(3.0,portA,b'f')]
+    assert reader.portNames=={portA:'COM1',portB:'COM2'}
+    reader.close()
+
+def test_append_ports(tmpdir):
+    filename = str(tmpdir.join('capture.bin'))
+    writer   = serialcapture.CaptureWriter(filename)
+    portA    = writer.addPort('COM1')
+    writer.write(portA,b'a',timestamp=1.0)
+    writer.close()
+
+    # a later session keeps the ids of the ports already named
+    writer   = serialcapture.CaptureWriter(filename)
+    portB    = writer.addPort('COM2')
+    assert writer.addPort('COM1')==portA
+    assert portB!=portA
+    writer.write(portB,b'b',timestamp=2.0)
+    writer.close()
+
+    reader   = serialcapture.CaptureReader(filename)
+    records  = [(p,bytes(c)) for (_,p,c) in reader]
+    assert records==[(portA,b'a'),(portB,b'b')]
+    assert reader.portNames=={portA:'COM1',portB:'COM2'}
+    reader.close()
+
+def test_replay(tmpdir):
+    filename = str(tmpdir.join('capture.bin'))
+    hdlc     = openhdlc.OpenHdlc()
+    stream   = b''.join(hdlc.hdlcify(b'D'+bytes(bytearray([i]))) for i in range(100))
+    writer   = serialcapture.CaptureWriter(filename)
+    port     = writer.addPort('COM1')
+    for i in range(0,len(stream),13):
+        writer.write(port,stream[i:i+13])
+    writer.close()
+
+    probe    = CountingProbe()
+    stats    = serialcapture.replay(filename,{port: probe})
+    assert stats['numFrames']==100
+    assert stats['numBytes']==len(stream)
+    assert probe.frames[42]==b'D\x2a'
@@ -0,0 +1,52 @@
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+import struct
+
+import serialframe
+
+#============================ helpers ===============================
+
+def dataFrame(payload,asn=(0x0201,0x0403,0x05),asnTicks=100,timerTicks=150):
+    return bytearray(
+        struct.pack('<BHHHBII',ord('D'),0x1234,asn[0],asn[1],asn[2],asnTicks,timerTicks)
+        + payload
+    )
+
+#============================ tests =================================
+
+def test_header():
+    frame  = serialframe.SerialFrame(dataFrame(b'poipoi'))
+    header = frame.dataHeader()
+    assert frame.frameType==serialframe.SERFRAME_MOTE2PC_DATA
+    assert header.src==0x1234
+    assert (header.asn_0_1,header.asn_2_3,header.asn_4)==(0x0201,0x0403,0x05)
+    assert header.timerTicks==150
+
+def test_uinject():
+    payload = b'\x00'*20 + struct.pack('<HHBh',7,8,9,-2) + b'uinject'
+    frame   = serialframe.SerialFrame(dataFrame(payload))
+    assert frame.endswith(serialframe.UINJECT_MASK)
+    assert not frame.endswith(serialframe.LLATENCY_MASK)
+    assert frame.uinjectTrailer()==(7,8,9,-2,b'uinject')
+
+def test_llatency():
+    payload = b'\x00'*20 + struct.pack('<IIHHBh',0x10000,0x10010,7,8,9,3) + b'llatency'
+    trailer = serialframe.SerialFrame(dataFrame(payload)).llatencyTrailer()
+    assert trailer.timerTicks-trailer.asnTicks==0x10
+    assert trailer.counter==3
+
+def test_endswith_short():
+    assert not serialframe.SerialFrame(bytearray(b'R')).endswith(serialframe.UINJECT_MASK)
+
+def test_previous_hop():
+    payload = b'\x14\x15\x92\x00\x00\x12\xe6\x3b' + b'\x14\x15\x92\x00\x00\x12\xe6\x78' + b'poipoi'
+    frame   = serialframe.SerialFrame(dataFrame(payload))
+    assert frame.previousHop()==b'\x14\x15\x92\x00\x00\x12\xe6\x78'
+
+def test_asn():
+    payload = b'\x00'*20 + struct.pack('<HHBh',0xffff,0x0402,0x05,1) + b'uinject'
+    frame   = serialframe.SerialFrame(dataFrame(payload))
+    assert frame.dataHeader().asn-frame.uinjectTrailer().asn==0x202
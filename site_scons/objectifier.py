@@ -0,0 +1,468 @@
+import os
+import re
+import time
+import shutil
+import hashlib
+import atexit
+import threading
+import multiprocessing
+
+'''
+Rewrites the C sources of the stack so they can be built into the Python
+extension module of the 'python' board, as used by projects/python.
+
+Objectifying a source turns the global variables it uses into fields of the
+OpenMote object, and adds that object as first argument of the functions of
+the stack. The names to rewrite are given as tables to an Objectifier, which
+compiles each table into a single regex, so a source is rewritten in a fixed
+number of passes over it. The rewritten sources are cached by content, and
+the entries of the cache not used for CACHE_MAX_AGE seconds are removed by
+pruneCache().
+
+objectifyAll() objectifies a batch of sources on a pool of worker processes.
+The Objectifier is sent to each worker once, when the pool starts.
+
+The pool is created by the first batch with more than one source, i.e. forked
+from whichever SCons job thread runs that batch. A forked worker only holds
+that thread, and a lock another thread held at that moment stays locked in
+the worker forever. The workers thus only use the modules imported here, and
+take no lock: cache entries are written under a temporary name of their own
+rather than with tempfile, whose name generator is guarded by one. The pool
+is closed when SCons exits.
+'''
+
+#============================ defines =========================================
+
+# bump when changing how the sources are rewritten, to invalidate the cache
+OBJECTIFY_VERSION    = 2
+
+# cache entries not used for this long are removed, in seconds
+CACHE_MAX_AGE        = 30*24*60*60
+
+# the cache is pruned at most once per this many seconds
+CACHE_PRUNE_INTERVAL = 24*60*60
+
+#============================ helpers =========================================
+
+def alternation(names):
+    '''
+    A regex matching any of names, factored as a trie ('ab(?:c|d)' rather than
+    'abc|abd') so the regex engine does not try each name in turn.
+    '''
+    if not names:
+        return '(?!)'
+    trie = {}
+    for name in names:
+        node = trie
+        for c in name:
+            node = node.setdefault(c,{})
+        node[''] = {}
+    def toRegex(node):
+        alts = [re.escape(c)+toRegex(node[c]) for c in sorted(node) if c]
+        if not alts:
+            return ''
+        if '' in node:
+            return '(?:{0})?'.format('|'.join(alts))
+        if len(alts)==1:
+            return alts[0]
+        return '(?:{0})'.format('|'.join(alts))
+    return toRegex(trie)
+
+def linkOrCopy(source,target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source,target)
+    except (OSError,AttributeError):
+        # no hard links on this filesystem, or across filesystems
+        shutil.copyfile(source,target)
+
+#============================ objectifier =====================================
+
+class Objectifier(object):
+    '''
+    Rewrites sources according to the rewrite tables of projects/python.
+
+    :param cacheDir: the directory the objectified sources are cached in,
+        None to disable the cache.
+    '''
+
+    def __init__(self,varsToChange,callbackFunctionsToChange,functionsToChange,returnTypes,headerFiles,cacheDir=None):
+
+        # store params
+        self.varsToChange              = varsToChange
+        self.callbackFunctionsToChange = callbackFunctionsToChange
+        self.functionsToChange         = functionsToChange
+        self.returnTypes               = returnTypes
+        self.headerFiles               = headerFiles
+        self.cacheDir                  = cacheDir
+
+        # local variables
+        self.rewriteTablesDigest       = hashlib.sha1(repr((
+            OBJECTIFY_VERSION,
+            varsToChange,
+            callbackFunctionsToChange,
+            functionsToChange,
+            returnTypes,
+            headerFiles,
+        ))).hexdigest()
+        self._compile()
+
+    def __getstate__(self):
+        # sent to the worker processes without the compiled regexes
+        state = dict(self.__dict__)
+        for name in self._compiled:
+            del state[name]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._compile()
+
+    #======================== public ==========================================
+
+    def objectify(self,source,target,projectName=None):
+        '''
+        Write the objectified version of file source to file target.
+
+        :param projectName: the name of the Python module source is built
+            into, which replaces REPLACE_BY_PROJ_NAME in openwsnmodule.c.
+            Only needed for that file.
+        '''
+
+        #========== read
+
+        f = open(source,'r')
+        lines = f.read()
+        f.close()
+
+        filename = os.path.split(source)[1]
+
+        if filename.split('.')[0]=='openwsnmodule':
+            assert projectName, 'openwsnmodule.c needs the name of its Python module'
+
+        if self.cacheDir:
+            cacheFile = self.cacheFile(filename,lines,projectName)
+            if os.path.exists(cacheFile):
+                # the modification time of an entry is the time it was last
+                # used, see pruneCache()
+                try:
+                    os.utime(cacheFile,None)
+                    linkOrCopy(cacheFile,target)
+                    return
+                except (IOError,OSError):
+                    pass # removed by a concurrent prune, rewrite it
+
+        #========= modify
+
+        lines = self.rewrite(filename,lines,projectName)
+
+        #========== write
+
+        if self.cacheDir:
+            # write the cache entry, then link the target to it, so the target
+            # is never written in place while linked to the cache
+            cacheDir = os.path.dirname(cacheFile)
+            if not os.path.isdir(cacheDir):
+                try:
+                    os.makedirs(cacheDir)
+                except OSError:
+                    pass # created by a concurrent build
+            tmp = '{0}.{1}.{2}.tmp'.format(cacheFile,os.getpid(),threading.current_thread().ident)
+            f = open(tmp,'w')
+            f.write(lines)
+            f.close()
+            try:
+                os.rename(tmp,cacheFile)
+            except OSError:
+                # Windows does not replace an entry a concurrent build just wrote
+                os.remove(tmp)
+            linkOrCopy(cacheFile,target)
+        else:
+            f = open(target,'w')
+            f.write(lines)
+            f.close()
+
+    def cacheFile(self,filename,lines,projectName):
+        '''
+        The cache entry of the objectified version of source filename, whose
+        content is lines, built into Python module projectName.
+        '''
+        key = hashlib.sha1(self.rewriteTablesDigest)
+        key.update(filename)
+        if filename.split('.')[0]=='openwsnmodule':
+            key.update(projectName)
+        key.update(lines)
+        key = key.hexdigest()
+        return os.path.join(self.cacheDir,key[:2],key+os.path.splitext(filename)[1])
+
+    def rewrite(self,filename,lines,projectName):
+        '''
+        :returns: the objectified version of lines, the content of source
+            filename, built into Python module projectName.
+        '''
+
+        basefilename = filename.split('.')[0]
+
+        if filename.split('.')[1]=='h':
+            headerFile = True
+        else:
+            headerFile = False
+
+        #=== all files
+
+        # add banner
+        banner    = []
+        banner   += ['/**']
+        banner   += ['DO NOT EDIT DIRECTLY!!']
+        banner   += ['']
+        banner   += ['This file was \'objectified\' by SCons as a pre-processing']
+        banner   += ['step for the building a Python extension module.']
+        banner   += ['*/']
+        banner   += ['']
+        banner    = '\n'.join(banner)
+
+        lines     = banner+lines
+
+        # update the included headers
+        lines = self.headerFilesRe.sub(r'\1_obj.h',lines)
+        if basefilename not in self.headerFiles:
+            lines = re.sub(
+                r'\b{0}.h\b'.format(basefilename),
+                r'{0}_obj.h'.format(basefilename),
+                lines
+            )
+
+        # change callback function declaration signatures
+        def replaceCallbackFunctionDeclarations(matchObj):
+            function        = matchObj.group(1)
+            args            = matchObj.group(2)
+
+            if args and "void" not in args:
+                return '{0}(OpenMote* self, {1})'.format(function, args)
+            else:
+                return '{0}(OpenMote* self)'.format(function)
+
+        lines = re.sub(
+            pattern         = r'(typedef[ \S]+_cbt\))\((.*?)\)',
+            repl            = replaceCallbackFunctionDeclarations,
+            string          = lines,
+            flags           = re.DOTALL,
+        )
+
+        # comment out global variables declarations
+        if not headerFile:
+            lines = self.globalVarsDeclRe.sub(
+                r'// declaration of global variable _\1_ removed during objectification.',
+                lines
+            )
+
+        # change global variables by self->* counterpart
+        if basefilename!='openwsnmodule':
+            lines = self.globalVarsRe.sub(r'(self->\1)',lines)
+
+        # change function signatures
+        argsStart = [None] # where the arguments of the last function matched start
+
+        def replaceFunctions(matchObj):
+            returnType      = matchObj.group(1)
+            function        = matchObj.group(2)
+            voidArgs        = matchObj.group(3)
+            args            = matchObj.group(4)
+
+            if returnType in self.returnTypes:
+                selfArg     = 'OpenMote* self'
+            else:
+                selfArg     = 'self'
+
+            if matchObj.start()==argsStart[0] and not returnType:
+                # a call starting the arguments, after the ', ' added below
+                prefix      = function
+            else:
+                prefix      = '{0} {1}'.format(returnType,function)
+
+            if voidArgs is not None:
+                # arguments and closing parenthesis consumed
+                return '{0}({1})'.format(prefix,selfArg)
+            elif args:
+                # arguments left in place, rewritten by the rest of the pass
+                argsStart[0] = matchObj.end()
+                return '{0}({1}, '.format(prefix,selfArg)
+            else:
+                return '{0}({1}'.format(prefix,selfArg)
+
+        if basefilename!='openwsnmodule':
+            lines = self.functionsRe.sub(replaceFunctions,lines)
+
+        #=== .h files only
+
+        if headerFile:
+            # include Python.h first
+            lines = re.sub(
+                r'(#include [<"]\w+\.h[>"])',
+                r'#include "Python.h"\n\n\1',
+                lines,
+                count=1
+            )
+
+            # include openwsn module header file
+            lines = re.sub(
+                r'(//[=]+ prototypes [=]+)',
+                r'#include "openwsnmodule_obj.h"\ntypedef struct OpenMote OpenMote;\n\n\1',
+                lines,
+            )
+
+        #=== .c files only
+
+        if not headerFile:
+
+            # change function signatures
+            def replaceCallbackFunctionCalls(matchObj):
+                operator        = matchObj.group(1)
+                function        = matchObj.group(2)
+                args            = matchObj.group(3)
+
+                # the arguments and closing parenthesis are left in place
+                if args:
+                    return '{0}{1}(self, '.format(operator,function)
+                else:
+                    return '{0}{1}(self'.format(operator,function)
+
+            lines = self.callbackFunctionsRe.sub(replaceCallbackFunctionCalls,lines)
+
+            # modify Python module name
+            if basefilename=='openwsnmodule':
+                lines = re.sub(
+                    'REPLACE_BY_PROJ_NAME',
+                    projectName,
+                    lines
+                )
+
+        return lines
+
+    #======================== private =========================================
+
+    _compiled = [
+        'headerFilesRe',
+        'globalVarsDeclRe',
+        'globalVarsRe',
+        'functionsRe',
+        'callbackFunctionsRe',
+    ]
+
+    def _compile(self):
+        # each table is rewritten by a single regex, so objectifying a file
+        # takes a fixed number of passes over it
+
+        self.headerFilesRe = re.compile(
+            r'\b({0}).h\b'.format(alternation(self.headerFiles))
+        )
+
+        self.globalVarsDeclRe = re.compile(
+            r'.*({0})_t\s+\1\s*;'.format(alternation(self.varsToChange))
+        )
+
+        self.globalVarsRe = re.compile(
+            r'\b({0})\b'.format(alternation(self.varsToChange))
+        )
+
+        # the arguments are only consumed when they are dropped (those
+        # containing 'void'), so calls nested in the arguments are rewritten
+        # by the same pass
+        self.functionsRe = re.compile(
+            r'([\w\*]*)[ \t]*({0})[ \t]*\((?:((?:(?!\)).)*?void.*?)\)|(?=(.*?)\)))'.format(alternation(self.functionsToChange)),
+            re.DOTALL,
+        )
+
+        self.callbackFunctionsRe = re.compile(
+            r'(\.|->)({0})\((?=(.*?)\))'.format(alternation(self.callbackFunctionsToChange))
+        )
+
+#============================ cache ===========================================
+
+def pruneCache(cacheDir,maxAge=CACHE_MAX_AGE):
+    '''
+    Remove the entries of the cache in cacheDir not used for maxAge seconds.
+
+    The cache is only walked if it was not pruned in the last
+    CACHE_PRUNE_INTERVAL seconds, as recorded by the modification time of
+    a stamp file in cacheDir, so calling this in every build is cheap.
+    '''
+    stamp = os.path.join(cacheDir,'pruned')
+    now   = time.time()
+    if not os.path.isdir(cacheDir):
+        return
+    try:
+        if now-os.stat(stamp).st_mtime<CACHE_PRUNE_INTERVAL:
+            return
+    except OSError:
+        pass # never pruned
+    try:
+        open(stamp,'w').close()
+    except IOError:
+        return # read-only cache
+    for (root,dirs,files) in os.walk(cacheDir):
+        for name in files:
+            path = os.path.join(root,name)
+            if path==stamp:
+                continue
+            try:
+                if now-os.stat(path).st_mtime>maxAge:
+                    os.remove(path)
+            except OSError:
+                pass # removed by a concurrent prune
+
+#============================ process pool ====================================
+
+_pools     = {}               # (rewriteTablesDigest,cacheDir) -> pool
+_poolsLock = threading.Lock()
+_worker    = None             # the Objectifier of a worker process
+
+def _initWorker(objectifier):
+    global _worker
+    _worker = objectifier
+
+def _objectifyInWorker(job):
+    (source,target,projectName) = job
+    _worker.objectify(source,target,projectName)
+
+def _getPool(objectifier):
+    key = (objectifier.rewriteTablesDigest,objectifier.cacheDir)
+    with _poolsLock:
+        if key not in _pools:
+            if not _pools:
+                atexit.register(closePools)
+            _pools[key] = multiprocessing.Pool(
+                initializer = _initWorker,
+                initargs    = (objectifier,),
+            )
+        return _pools[key]
+
+def closePools():
+    '''
+    Wait for the worker processes to finish their work, and stop them.
+    '''
+    with _poolsLock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+        pool.join()
+
+def objectifyAll(objectifier,jobs):
+    '''
+    Objectify the (source,target,projectName) jobs, see
+    Objectifier.objectify(), on a pool of worker processes (one per CPU,
+    shared by all the calls) when there is more than one.
+
+    The pool needs os.fork(), the jobs are run one after the other in this
+    process otherwise.
+    '''
+    jobs = list(jobs)
+    if len(jobs)<2 or not hasattr(os,'fork') or multiprocessing.cpu_count()<2:
+        for (source,target,projectName) in jobs:
+            objectifier.objectify(source,target,projectName)
+        return
+
+    # waiting with a timeout keeps the wait interruptible with Ctrl-C
+    _getPool(objectifier).map_async(_objectifyInWorker,jobs,chunksize=1).get(60*60)
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import atexit
+
+'''
+Index of the projects of each board, and of the files of each project, kept
+across SCons invocations.
+
+Finding the projects of a board lists the board's directory, then each
+project directory. The index keeps each listing with the modification time of
+the directory it lists, and lists a directory again only when that time
+changed, i.e. when an entry was added, removed or renamed in it. The index is
+built once per SCons invocation, and written to disk at exit when a listing
+changed, so a no-op build only stats the directories.
+
+The same listings serve sconsUtils.findPattern(), for the trees it walks.
+Like os.walk(), the walk does not follow the symbolic links to directories.
+Only the listings of directories in the repository are written to disk, those
+of the other trees walked (e.g. the Python headers) are kept for the current
+invocation.
+'''
+
+#============================ defines =========================================
+
+# bump when changing the layout of the index file
+INDEX_VERSION = 2
+
+# a directory modified less than this many seconds before it is listed may be
+# modified again without its modification time changing, its listing is not
+# kept on disk
+RACY_SECONDS  = 2
+
+# the root of the repository, only the listings below it are kept on disk
+REPO_ROOT     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#============================ index ===========================================
+
+class ProjectIndex(object):
+    '''
+    Listings of directories, each valid as long as the modification time of
+    the directory does not change.
+
+    :param path: the file the index is kept in across invocations, None to
+        only keep it for this invocation.
+    :param root: only the listings of the directories below root are kept in
+        that file.
+    '''
+
+    def __init__(self,path=None,root=REPO_ROOT):
+
+        # store params
+        self.path         = path
+        self.root         = os.path.abspath(root)
+
+        # local variables
+        self.listings     = {}    # absolute path -> {'mtime','dirs','links','files','racy'}
+        self.checked      = set() # paths whose listing is known valid
+        self.dirty        = False
+
+        self._load()
+
+    #======================== public ==========================================
+
+    def listing(self,path):
+        '''
+        :returns: a (dirs,files) tuple, the sorted names of the subdirectories
+            and files of directory path. As for os.walk(), dirs includes the
+            symbolic links to directories.
+        '''
+        path = os.path.abspath(path)
+        if path not in self.checked:
+            mtime   = os.stat(path).st_mtime
+            entry   = self.listings.get(path)
+            if not entry or entry['mtime']!=mtime:
+                dirs  = []
+                links = []
+                files = []
+                for name in sorted(os.listdir(path)):
+                    if os.path.isdir(os.path.join(path,name)):
+                        dirs  += [name]
+                        if os.path.islink(os.path.join(path,name)):
+                            links += [name]
+                    else:
+                        files += [name]
+                entry = {
+                    'mtime': mtime,
+                    'dirs':  dirs,
+                    'links': links,
+                    'files': files,
+                    'racy':  time.time()-mtime<RACY_SECONDS,
+                }
+                self.listings[path] = entry
+                self.dirty          = True
+            self.checked.add(path)
+        entry = self.listings[path]
+        return (entry['dirs'],entry['files'])
+
+    def projects(self,boardDir):
+        '''
+        :returns: the projects of the board in directory boardDir, as a list
+            of (projectDir,files) tuples sorted by projectDir, files being the
+            names of the files in the project directory.
+        '''
+        returnVal = []
+        for projectDir in self.listing(boardDir)[0]:
+            returnVal += [(projectDir,self.listing(os.path.join(boardDir,projectDir))[1])]
+        return returnVal
+
+    def boards(self,projectsDir):
+        '''
+        :returns: a dict mapping the name of each board directory in
+            projectsDir (including 'common') to its projects, as returned by
+            projects().
+        '''
+        returnVal = {}
+        for board in self.listing(projectsDir)[0]:
+            returnVal[board] = self.projects(os.path.join(projectsDir,board))
+        return returnVal
+
+    def walk(self,path):
+        '''
+        Like os.walk(), top-down, from the listings of the index. The
+        symbolic links to directories are listed but not followed.
+        '''
+        (dirs,files) = self.listing(path)
+        yield (path,dirs,files)
+        links = self.listings[os.path.abspath(path)]['links']
+        for name in dirs:
+            if name in links:
+                continue
+            for returnVal in self.walk(os.path.join(path,name)):
+                yield returnVal
+
+    def save(self):
+        '''
+        Write the index to its file, if a listing changed since it was read.
+        '''
+        if not self.path or not self.dirty:
+            return
+        listings = dict([(p,e) for (p,e) in self.listings.items() if not e['racy'] and self._inRoot(p)])
+        dirname  = os.path.dirname(self.path)
+        try:
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # write under another name first, so a concurrent build never reads
+            # half an index
+            tmp  = '{0}.{1}.tmp'.format(self.path,os.getpid())
+            f    = open(tmp,'w')
+            json.dump({'version': INDEX_VERSION, 'listings': listings},f)
+            f.close()
+            if os.name=='nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp,self.path)
+        except (IOError,OSError):
+            pass # the index is only a cache
+        self.dirty = False
+
+    #======================== private =========================================
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            f = open(self.path,'r')
+            try:
+                index = json.load(f)
+            finally:
+                f.close()
+        except (IOError,OSError,ValueError):
+            # missing or corrupted, start over
+            return
+        if not isinstance(index,dict) or index.get('version')!=INDEX_VERSION:
+            return
+        try:
+            # json gives unicode strings, SCons expects the names as str
+            for (path,entry) in index['listings'].items():
+                self.listings[str(path)] = {
+                    'mtime': entry['mtime'],
+                    'dirs':  [str(name) for name in entry['dirs']],
+                    'links': [str(name) for name in entry['links']],
+                    'files': [str(name) for name in entry['files']],
+                    'racy':  False,
+                }
+        except (UnicodeError,KeyError,TypeError,AttributeError):
+            # non-ASCII names or corrupted, start over
+            self.listings = {}
+
+    def _inRoot(self,path):
+        return path==self.root or path.startswith(self.root.rstrip(os.sep)+os.sep)
+
+#============================ functions =======================================
+
+_index = None
+
+def getIndex(path=None):
+    '''
+    :returns: the index of this SCons invocation, created on the first call,
+        from file path if given, and written back to it at exit.
+    '''
+    global _index
+    if _index is None:
+        if path:
+            path = os.path.expanduser(path)
+        _index = ProjectIndex(path)
+        atexit.register(_index.save)
+    return _index
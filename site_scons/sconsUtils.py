@@ -1,5 +1,6 @@
 import os
 import fnmatch
+import projectindex
 from SCons.Script import *
 
 '''
@@ -21,12 +22,12 @@ def printEnv(env):
 def findPattern(pattern, path):
     '''
     Finds the files matching the provided pattern in the directory tree rooted
-    at the provided path.
+    at the provided path, from the listings of the project index.
 
     :returns: List of the files found
     '''
     returnVal = []
-    for (dirpath,dirnames,filenames) in os.walk(path):
+    for (dirpath,dirnames,filenames) in projectindex.getIndex().walk(path):
         for filename in filenames:
             if fnmatch.fnmatch(filename,pattern):
                 returnVal += [os.path.join(dirpath,filename)]